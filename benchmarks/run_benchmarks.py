@@ -0,0 +1,241 @@
+""" Benchmarks for jpeg_reader, run against a generated corpus of synthetic JPEG files.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --json results.json
+    python -m benchmarks.run_benchmarks --compare results.json
+
+Each benchmark reports files/s, MB/s and peak memory. Timings are the best of several runs, and the corpus is generated
+from a fixed seed, so results from different commits (on the same machine) can be compared directly.
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+from benchmarks.synthetic import make_jpeg
+from benchmarks.synthetic import write_jpeg
+from jpeg_reader import JpegFile
+from jpeg_reader import scan_directory
+from utils import scanner
+from utils import segment_markers
+
+
+Result = namedtuple('Result', "name files bytes seconds peak_bytes")
+
+# Corpus profiles: name -> (number of files, make_jpeg arguments)
+PROFILES = {
+    'small': (200, dict(width=640, height=480, scan_bytes=32 * 1024)),
+    'camera': (50, dict(scan_bytes=2 * 1024 * 1024, exif_entries=32, maker_note_bytes=16 * 1024)),
+    'exif_heavy': (100, dict(scan_bytes=64 * 1024, exif_entries=1000, maker_note_bytes=32 * 1024, endian='>')),
+    'app_heavy': (100, dict(scan_bytes=64 * 1024, app_segments=12, app_segment_bytes=60 * 1024)),
+    'progressive': (50, dict(scan_bytes=2 * 1024 * 1024, progressive=True)),
+    'restart': (50, dict(scan_bytes=2 * 1024 * 1024, restart_interval=512)),
+    'ff_heavy': (50, dict(scan_bytes=2 * 1024 * 1024, ff_density=0.25)),
+}
+
+# Regressions larger than this fraction are flagged by --compare
+REGRESSION_THRESHOLD = 0.10
+
+# Real files for the decoder benchmarks; the synthetic corpus only has random entropy-coded data.
+TEST_IMAGES_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_images')
+
+
+def build_corpus(directory, scale=1.0):
+    """ Write the corpus into a directory, one subdirectory per profile. Returns {profile name: [file paths]}. """
+    corpus = dict()
+    for name, (count, kwargs) in PROFILES.items():
+        profile_directory = os.path.join(directory, name)
+        os.makedirs(profile_directory, exist_ok=True)
+        paths = list()
+        for x in range(max(1, int(count * scale))):
+            path = os.path.join(profile_directory, f'{name}_{x:04d}.jpg')
+            if not os.path.exists(path):
+                write_jpeg(path, seed=x, **kwargs)
+            paths.append(path)
+        corpus[name] = paths
+    return corpus
+
+
+def measure(name, fn, files, byte_count, repeat=3):
+    """ Time fn() (best of `repeat` runs), then run it once more under tracemalloc for its peak memory use. """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    # tracemalloc slows allocation down, so it is kept out of the timed runs.
+    tracemalloc.start()
+    fn()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return Result(name, files, byte_count, seconds, peak_bytes)
+
+
+def bench_header(name, paths):
+    """ Open each file and decode its resolution and metadata, stopping at the first SOS. """
+    def _run():
+        for path in paths:
+            with JpegFile(path) as jpeg_file:
+                _ = jpeg_file.resolution, jpeg_file.metadata
+    return measure(f'header/{name}', _run, len(paths), _total_size(paths))
+
+
+def bench_full_scan(name, paths):
+    """ Walk every segment up to EOI, including the entropy-coded data. """
+    def _run():
+        for path in paths:
+            with JpegFile(path, full_scan=True) as jpeg_file:
+                _ = jpeg_file.segments
+    return measure(f'full_scan/{name}', _run, len(paths), _total_size(paths))
+
+
+def bench_find_marker(name, data):
+    """ Find every marker in a buffer with the scanner used inside entropy-coded data. """
+    def _run():
+        position = 0
+        try:
+            while True:
+                position = scanner.find_marker(data, position)[0] + 2
+        except EOFError:
+            pass
+    return measure(f'find_marker/{name}', _run, 1, len(data))
+
+
+def bench_ifd_decode(name, data, iterations=100):
+    """ Decode all IFDs from an in-memory file, so the time is spent decoding rather than on I/O. """
+    def _run():
+        for _ in range(iterations):
+            _ = JpegFile.from_bytes(data).metadata
+    return measure(f'ifd_decode/{name}', _run, iterations, len(data) * iterations)
+
+
+def bench_decode(name, datas, preview, iterations=5):
+    """ Decode in-memory files, at 1/8 scale from DC coefficients only (preview) or in full. """
+    def _run():
+        for _ in range(iterations):
+            for data in datas:
+                with JpegFile.from_bytes(data) as jpeg_file:
+                    _ = jpeg_file.decode_preview() if preview else jpeg_file.decode()
+    byte_count = sum(len(data) for data in datas) * iterations
+    return measure(f'{"decode_preview" if preview else "decode"}/{name}', _run, len(datas) * iterations, byte_count)
+
+
+def bench_scan_directory(directory, workers):
+    """ Read a whole directory tree the way the command line does. """
+    paths = [os.path.join(root, file_name) for root, _, file_names in os.walk(directory) for file_name in file_names]
+
+    def _run():
+        for result in scan_directory(directory, recursive=True, workers=workers):
+            if result.error is not None:
+                raise RuntimeError(result.error)
+    # Process pools are expensive to start, so this one is only repeated twice.
+    return measure(f'scan_directory/workers={workers}', _run, len(paths), _total_size(paths), repeat=2)
+
+
+def run_benchmarks(directory, scale=1.0, workers=None):
+    corpus = build_corpus(directory, scale=scale)
+    results = list()
+    for name, paths in corpus.items():
+        results.append(bench_header(name, paths))
+    for name in ('camera', 'progressive', 'restart', 'ff_heavy'):
+        results.append(bench_full_scan(name, corpus[name]))
+    for name in ('camera', 'restart', 'ff_heavy'):
+        results.append(bench_find_marker(name, make_jpeg(**PROFILES[name][1])))
+    for name in ('camera', 'exif_heavy'):
+        results.append(bench_ifd_decode(name, make_jpeg(**dict(PROFILES[name][1], scan_bytes=0))))
+    if importlib.util.find_spec('numpy') is not None:
+        results.extend(run_decode_benchmarks())
+    results.append(bench_scan_directory(directory, workers=1))
+    workers = workers or os.cpu_count() or 1
+    if workers > 1:
+        results.append(bench_scan_directory(directory, workers=workers))
+    return results
+
+
+def run_decode_benchmarks():
+    """ Decode the files in test_images/. Full decodes only cover the baseline files, since progressive ones aren't
+    supported.
+    """
+    datas = list()
+    for path in sorted(glob.glob(os.path.join(TEST_IMAGES_DIRECTORY, '*.jpg'))):
+        with open(path, 'rb') as f:
+            datas.append(f.read())
+
+    baseline_datas = list()
+    for data in datas:
+        with JpegFile.from_bytes(data) as jpeg_file:
+            if any(segment.marker is segment_markers.SOF0 for segment in jpeg_file.segments):
+                baseline_datas.append(data)
+
+    return [
+        bench_decode('test_images', datas, preview=True),
+        bench_decode('test_images', baseline_datas, preview=False),
+    ]
+
+
+def print_results(results, baseline=None):
+    """ Print a table of results, with the change in throughput against a baseline (name -> result dict) if given. """
+    print(f"{'benchmark':<32} {'files/s':>10} {'MB/s':>10} {'peak MB':>9}  {'vs baseline':>11}")
+    regressions = list()
+    for result in results:
+        files_per_second = result.files / result.seconds
+        mb_per_second = result.bytes / result.seconds / 1e6
+        line = f"{result.name:<32} {files_per_second:>10.1f} {mb_per_second:>10.1f} {result.peak_bytes / 1e6:>9.2f}"
+
+        old = (baseline or dict()).get(result.name)
+        if old is not None:
+            # Compare time per byte, so a corpus generated at a different scale is still comparable.
+            change = (old['seconds'] / old['bytes']) / (result.seconds / result.bytes) - 1
+            line += f"  {change:>+10.1%}"
+            if change < -REGRESSION_THRESHOLD:
+                line += "  REGRESSION"
+                regressions.append(result.name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark jpeg_reader against a synthetic JPEG corpus.")
+    parser.add_argument('--corpus', metavar='DIR',
+                        help="Write the corpus here, and reuse it on later runs (default: a temporary directory)")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiply the number of files in each profile")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Workers for the parallel scan_directory benchmark (default: CPU count)")
+    parser.add_argument('--json', metavar='PATH', help="Write the results to a JSON file")
+    parser.add_argument('--compare', metavar='PATH', help="Compare against results from an earlier --json run")
+    args = parser.parse_args(argv)
+
+    if args.corpus is None:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run_benchmarks(directory, scale=args.scale, workers=args.workers)
+    else:
+        results = run_benchmarks(args.corpus, scale=args.scale, workers=args.workers)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = {result['name']: result for result in json.load(f)['results']}
+    regressions = print_results(results, baseline)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version, 'results': [result._asdict() for result in results]}, f, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+
+def _total_size(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+""" Generator for synthetic JPEG files with controllable structure, for benchmarking.
+
+The files are structurally valid (segment lengths, EXIF IFDs, stuffed entropy-coded data, restart markers) but their
+scan data is random, so they only decode as noise. They are meant for timing the parser, not a decoder.
+"""
+import random
+import struct
+
+
+# Tags written to the EXIF IFD, cycled through until the requested entry count is reached: (tag id, type id, count)
+_EXIF_ENTRY_TEMPLATES = (
+    (0x829a, 5, 1),  # ExposureTime
+    (0x829d, 5, 1),  # FNumber
+    (0x8822, 3, 1),  # ExposureProgram
+    (0x8827, 3, 1),  # ISOSpeedRatings
+    (0x9003, 2, 20),  # DateTimeOriginal
+    (0x9004, 2, 20),  # DateTimeDigitized
+    (0x9201, 10, 1),  # ShutterSpeedValue
+    (0x9202, 5, 1),  # ApertureValue
+    (0x9207, 3, 1),  # MeteringMode
+    (0x9209, 3, 1),  # Flash
+    (0x920a, 5, 1),  # FocalLength
+    (0x9214, 3, 4),  # SubjectArea
+    (0xa002, 4, 1),  # PixelXDimension
+    (0xa003, 4, 1),  # PixelYDimension
+    (0xa20e, 5, 1),  # FocalPlaneXResolution
+    (0xa20f, 5, 1),  # FocalPlaneYResolution
+)
+
+# Struct format of each numeric tag type, and how many of them make up one value (rationals are 2 LONGs).
+_TYPE_FORMATS = {3: ('H', 1), 4: ('L', 1), 5: ('L', 2), 10: ('l', 2)}
+
+
+def make_jpeg(width=6000, height=4000, scan_bytes=1024 * 1024, app_segments=0, app_segment_bytes=4096,
+              exif_entries=16, maker_note_bytes=0, gps=True, thumbnail_bytes=0, progressive=False, restart_interval=0,
+              ff_density=0.01, endian='<', seed=0):
+    """ Build a synthetic JPEG file and return its bytes.
+
+    scan_bytes: Approximate size of the entropy-coded data, split across scans for progressive files.
+    app_segments: Number of extra APP segments (APP2-APPF) of app_segment_bytes each, e.g. ICC profiles or XMP.
+    exif_entries: Number of entries in the EXIF IFD.
+    maker_note_bytes: Size of the MakerNote tag in the EXIF IFD (0 for none). The whole EXIF segment must fit in 64 KiB.
+    thumbnail_bytes: Approximate size of a JPEG thumbnail embedded in IFD1 (0 for none).
+    progressive: Write an SOF2 frame with several scans, separated by DHT segments.
+    restart_interval: If set, write a DRI segment and an RST marker every restart_interval bytes of scan data.
+    ff_density: Fraction of scan data bytes that are 0xff (each one is written stuffed, as 0xff00).
+    """
+    rng = random.Random(seed)
+    parts = [b'\xff\xd8']
+    parts.append(_segment(0xffe0, b'JFIF\x00' + struct.pack('>2BB2H2B', 1, 1, 1, 72, 72, 0, 0)))
+    thumbnail = None
+    if thumbnail_bytes:
+        thumbnail = make_jpeg(
+            width=160, height=120, scan_bytes=thumbnail_bytes, exif_entries=0, gps=False, endian=endian, seed=seed)
+    tiff = _make_tiff(exif_entries, maker_note_bytes, gps, thumbnail, endian, rng)
+    parts.append(_segment(0xffe1, b'Exif\x00\x00' + tiff))
+    for x in range(app_segments):
+        payload = bytes(rng.getrandbits(8) for _ in range(16)) * (app_segment_bytes // 16)
+        parts.append(_segment(0xffe2 + x % 14, payload))
+
+    parts.append(_segment(0xffdb, b'\x00' + bytes(range(1, 65))))
+    sof_marker = 0xffc2 if progressive else 0xffc0
+    components = b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'  # Y at 2x2 sampling, Cb and Cr at 1x1 (4:2:0)
+    parts.append(_segment(sof_marker, struct.pack('>B2HB', 8, height, width, 3) + components))
+    parts.append(_segment(0xffc4, _dummy_huffman_table()))
+    if restart_interval:
+        parts.append(_segment(0xffdd, struct.pack('>H', restart_interval)))
+
+    scan_count = 6 if progressive else 1
+    for scan in range(scan_count):
+        if scan > 0:
+            parts.append(_segment(0xffc4, _dummy_huffman_table()))
+        parts.append(_segment(0xffda, b'\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00'))
+        parts.append(_make_scan_data(scan_bytes // scan_count, restart_interval, ff_density, rng))
+
+    parts.append(b'\xff\xd9')
+    return b''.join(parts)
+
+
+def write_jpeg(file_path, **kwargs):
+    """ Write a synthetic JPEG file; see make_jpeg for the keyword arguments. Returns the file size. """
+    data = make_jpeg(**kwargs)
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def _segment(marker, payload):
+    if len(payload) > 0xffff - 2:
+        raise ValueError(f"Segment payload is too large: {len(payload)} bytes")
+    return struct.pack('>2H', marker, len(payload) + 2) + payload
+
+
+def _dummy_huffman_table():
+    """ A DHT payload with one code of each length from 1 to 16. """
+    return b'\x00' + b'\x01' * 16 + bytes(range(16))
+
+
+def _make_scan_data(size, restart_interval, ff_density, rng):
+    """ Random entropy-coded data, with 0xff bytes stuffed and RST markers inserted at the restart interval. """
+    if size <= 0:
+        return b''
+    data = bytes(rng.getrandbits(8) for _ in range(min(size, 65536)))
+    data = (data * (size // len(data) + 1))[:size]
+
+    # Make every byte something other than 0xff; the requested fraction of 0xff bytes is put back, stuffed, below.
+    data = data.replace(b'\xff', b'\xfe')
+    stuffing_step = max(1, round(1 / ff_density)) if ff_density else 0
+
+    chunks = list()
+    interval = restart_interval or len(data)
+    for x, start in enumerate(range(0, len(data), interval)):
+        if x > 0:
+            chunks.append(struct.pack('>H', 0xffd0 + (x - 1) % 8))
+        chunk = data[start:start + interval]
+        if stuffing_step:
+            chunk = b'\xff\x00'.join(chunk[i:i + stuffing_step] for i in range(0, len(chunk), stuffing_step))
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _make_tiff(exif_entries, maker_note_bytes, gps, thumbnail, endian, rng):
+    """ A TIFF structure with IFD0, an EXIF IFD, and optionally a GPSInfo IFD and an IFD1 holding a thumbnail. """
+    # Entries are (tag id, type id, count, value bytes). Pointer values are filled in once offsets are known.
+    ifd0 = [
+        (0x010f, 2, 10, b'Synthetic\x00'),
+        (0x0110, 2, 10, b'Benchmark\x00'),
+        (0x0112, 3, 1, struct.pack(f'{endian}H', 1)),
+        (0x011a, 5, 1, struct.pack(f'{endian}2L', 300, 1)),
+        (0x011b, 5, 1, struct.pack(f'{endian}2L', 300, 1)),
+        (0x0128, 3, 1, struct.pack(f'{endian}H', 2)),
+        (0x0131, 2, 14, b'jpeg_reader 1\x00'),
+        (0x0132, 2, 20, b'2020:01:01 00:00:00\x00'),
+        (0x8769, 4, 1, None),
+    ]
+    if gps:
+        ifd0.append((0x8825, 4, 1, None))
+
+    exif_ifd = list()
+    for x in range(exif_entries):
+        tag_id, type_id, count = _EXIF_ENTRY_TEMPLATES[x % len(_EXIF_ENTRY_TEMPLATES)]
+        exif_ifd.append((tag_id, type_id, count, _random_value(type_id, count, endian, rng)))
+    if maker_note_bytes:
+        exif_ifd.append((0x927c, 7, maker_note_bytes, b'M' * maker_note_bytes))
+
+    gps_ifd = [
+        (0x0000, 1, 4, b'\x02\x03\x00\x00'),
+        (0x0001, 2, 2, b'N\x00'),
+        (0x0002, 5, 3, struct.pack(f'{endian}6L', 51, 1, 30, 1, 0, 1)),
+        (0x0003, 2, 2, b'W\x00'),
+        (0x0004, 5, 3, struct.pack(f'{endian}6L', 0, 1, 7, 1, 0, 1)),
+    ]
+
+    ifd1 = None
+    if thumbnail is not None:
+        ifd1 = [
+            (0x0103, 3, 1, struct.pack(f'{endian}H', 6)),  # Compression: JPEG
+            (0x0201, 4, 1, None),
+            (0x0202, 4, 1, struct.pack(f'{endian}L', len(thumbnail))),
+        ]
+
+    # Lay out the IFDs one after another, each followed by its out-of-line values. The thumbnail goes last.
+    ifds = [ifd0, exif_ifd] + ([gps_ifd] if gps else []) + ([ifd1] if ifd1 is not None else [])
+    ifd_offsets = list()
+    offset = 8
+    for ifd in ifds:
+        ifd_offsets.append(offset)
+        offset += _ifd_size(ifd)
+    if ifd1 is not None:
+        ifd1[1] = (0x0201, 4, 1, struct.pack(f'{endian}L', offset))
+
+    ifd0[ifd0.index((0x8769, 4, 1, None))] = (0x8769, 4, 1, struct.pack(f'{endian}L', ifd_offsets[1]))
+    if gps:
+        ifd0[ifd0.index((0x8825, 4, 1, None))] = (0x8825, 4, 1, struct.pack(f'{endian}L', ifd_offsets[2]))
+
+    byte_order = b'II' if endian == '<' else b'MM'
+    tiff = bytearray(byte_order + struct.pack(f'{endian}HL', 42, 8))
+    for ifd, ifd_offset in zip(ifds, ifd_offsets):
+        # IFD0 links to IFD1; the EXIF and GPSInfo IFDs are reached through pointer tags instead.
+        next_ifd_offset = ifd_offsets[-1] if ifd is ifd0 and ifd1 is not None else 0
+        tiff += _pack_ifd(ifd, ifd_offset, next_ifd_offset, endian)
+    if thumbnail is not None:
+        tiff += thumbnail
+    return bytes(tiff)
+
+
+def _random_value(type_id, count, endian, rng):
+    if type_id == 2:
+        return b'2020:01:01 12:34:56'[:count - 1].ljust(count - 1, b' ') + b'\x00'
+    value_format, values_per_count = _TYPE_FORMATS[type_id]
+    values = [rng.randint(1, 1000) for _ in range(count * values_per_count)]
+    return struct.pack(f'{endian}{len(values)}{value_format}', *values)
+
+
+def _ifd_size(ifd):
+    values_size = sum(len(value) for _, _, _, value in ifd if value is not None and len(value) > 4)
+    return 2 + 12 * len(ifd) + 4 + values_size
+
+
+def _pack_ifd(ifd, ifd_offset, next_ifd_offset, endian):
+    entries = bytearray(struct.pack(f'{endian}H', len(ifd)))
+    values = bytearray()
+    values_offset = ifd_offset + 2 + 12 * len(ifd) + 4
+    for tag_id, type_id, count, value in ifd:
+        entries += struct.pack(f'{endian}2HL', tag_id, type_id, count)
+        if len(value) > 4:
+            entries += struct.pack(f'{endian}L', values_offset + len(values))
+            values += value
+        else:
+            entries += value.ljust(4, b'\x00')
+    entries += struct.pack(f'{endian}L', next_ifd_offset)
+    return bytes(entries + values)
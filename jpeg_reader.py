@@ -1,18 +1,69 @@
+import array
+import contextlib
+import mmap
 import os
-import pprint
 import struct
 import sys
-import traceback
+import time
+import warnings
 from collections import namedtuple
 from typing import BinaryIO
 
 from utils import constants
+from utils import encoding
 from utils import exif
+from utils import instrumentation
+from utils import integrity
 from utils import jfif
+from utils import rewrite
+from utils import scanner
 from utils import segment_markers
+from utils.limits import LimitExceeded
+from utils.limits import ReadLimits
+from utils.segment_table import Segment
+from utils.segment_table import SegmentTable
 
 
-Segment = namedtuple('Segment', "marker offset")
+ScanResult = namedtuple('ScanResult', "file_path resolution pixel_aspect segments metadata error stats scan_hash",
+                        defaults=(None, None))
+ThumbnailResult = namedtuple('ThumbnailResult', "file_path output_path length error")
+VerifyResult = namedtuple('VerifyResult', "file_path status offset detail error")
+StripResult = namedtuple('StripResult', "file_path output_path length error")
+
+# File extensions (lowercase) picked up when scanning a directory.
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# String metadata values up to this length are interned in results from other processes (and the cache), since
+# values like Make and Model repeat across a whole library.
+INTERNED_VALUE_LENGTH = 32
+
+# Stands in for the arguments of a call in _imap_unordered, when its value is already known (e.g. from the cache).
+_Ready = namedtuple('_Ready', "value")
+
+# Placeholder for JpegFile values that haven't been decoded yet.
+_UNREAD = object()
+
+# Stands in for a phase timer when instrumentation is off.
+_NO_TIMER = contextlib.nullcontext()
+
+# Instrumentation phase of each IFD0 pointer tag's IFD
+_SUB_IFD_PHASES = {0x8769: 'exif_ifd', 0x8825: 'gps_ifd'}
+
+# Number of bytes read from a stream at a time, when it has to be read rather than memory-mapped.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# With ReadLimits, entropy-coded data is scanned this many bytes at a time, checking the time budget in between.
+SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Size in bytes of the BLAKE2b digest used for scan_hash
+SCAN_HASH_SIZE = 16
+
+# Markers of the segments covered by scan_hash: the scans, with their entropy-coded data and restart markers, and with
+# hash_tables, the tables and frame header needed to decode them.
+_SCAN_HASH_MARKERS = frozenset(marker.marker for marker in (segment_markers.SOS, ) + segment_markers.RST_MARKERS)
+_TABLE_HASH_MARKERS = frozenset(
+    marker.marker for marker in (segment_markers.DQT, segment_markers.DHT, segment_markers.DAC, segment_markers.DRI)
+    + segment_markers.SOF_MARKERS)
 
 
 class ReadSegment:
@@ -25,9 +76,11 @@ class ReadSegment:
         ff = Segment marker identifier
         MM = Segment marker type
         LLLL = Segment length, not including first 2 bytes of identifier and type
+
+    Pass a ReadStats as `stats` to count the read and seek calls made on the file.
     """
-    def __init__(self, file: BinaryIO, segment_start):
-        self.file = file
+    def __init__(self, file: BinaryIO, segment_start, stats=None):
+        self.file = file if stats is None else instrumentation.CountingStream(file, stats)
         self.segment_start = segment_start
         self.segment_end = None
 
@@ -54,151 +107,836 @@ class ReadSegment:
         self.file.seek(4, os.SEEK_CUR)
 
 
+class BufferSegment:
+    """ Equivalent of ReadSegment for a buffer (bytes, mmap, memoryview) instead of a file handle.
+
+    There is no file position to move around, so the segment's absolute offsets into the buffer are exposed instead,
+    ready to be used with struct.unpack_from.
+    """
+    def __init__(self, buffer, segment_start):
+        self.buffer = buffer
+        self.segment_start = segment_start
+        self.segment_end = None
+
+    def __enter__(self):
+        segment_length = struct.unpack_from('>H', self.buffer, self.segment_start + 2)[0]
+        self.segment_end = self.segment_start + 2 + segment_length
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    @property
+    def segment_data(self):
+        """ Offset of the segment data, past the segment marker and length bytes. """
+        return self.segment_start + 4
+
+
 class JpegFile:
-    def __init__(self, file_path):
+    """ Reads resolution, pixel aspect ratio and metadata from a JPEG file.
+
+    By default only the header is parsed: marker discovery stops at the first SOS (Start of Scan) segment, since
+    the frame header and APP segments all come before it. Pass full_scan=True to keep walking the entropy-coded
+    data to EOI, which is needed if you want RST/EOI offsets in `segments`.
+
+    `file_path` may be a path (str, bytes or path-like), data already in memory (bytearray, memoryview, mmap) or a
+    readable binary stream; see from_bytes and from_stream. As bytes are a path here, pass bytes data to from_bytes.
+    Files on disk are memory-mapped, and every field is unpacked in place from absolute offsets.
+
+    Only the marker pass runs up front. Everything else is decoded the first time it is asked for: `resolution` only
+    reads the SOF segment, and the JFIF, IFD0, EXIF and GPSInfo metadata groups are each decoded on their own. The
+    file stays open until close() is called (or the `with` block exits, when used as a context manager); after that,
+    only values that were already read are available.
+
+    `quality` and `chroma_subsampling` tell how the image was encoded, from the DQT and SOF segments alone.
+
+    Pass a set of tag names as `tags` to restrict `metadata` to those tags; see get_tags.
+
+    Pass a ReadStats (from utils.instrumentation) as `stats` to record the time spent in each phase of reading the
+    file, and the I/O calls made. Without one, nothing is measured.
+
+    To keep what was read without holding on to the file (e.g. for many files at once), use detach().
+
+    Pass a ReadLimits (from utils.limits) as `limits` to bound the bytes scanned, segments, EXIF IFD sizes and time
+    spent on a file that may be corrupt or hostile; a limit that is hit raises LimitExceeded. Without one, files are
+    read in full however large they are.
+
+    Pass hash_scan=True to hash the compressed image data (every SOS segment, with its entropy-coded data and RST
+    markers) with BLAKE2b during the marker pass, which then walks to EOI as with full_scan. Files holding the same
+    compressed pixels get the same `scan_hash` whatever their metadata, so duplicates can be found without reading
+    them a second time. With hash_tables=True, the quantization and Huffman tables, restart interval and frame header
+    are hashed too, so that only files that also decode the same way match.
+    """
+    __slots__ = (
+        '_file_path', '_full_scan', '_tags', '_stats', '_segments', '_resolution', '_pixel_aspect', '_metadata',
+        '_app_segments', '_jfif_metadata', '_ifd0_metadata', '_exif_metadata', '_gps_metadata', '_sub_ifd_pointers',
+        '_thumbnail_location', '_restart_index', '_data', '_view', '_header_only', '_limits', '_deadline',
+        '_scan_hash', '_quantization_tables', '_components', '_quality')
+
+    def __init__(self, file_path, full_scan=False, tags=None, stats=None, limits: ReadLimits = None, hash_scan=False,
+                 hash_tables=False):
         self._file_path = file_path
-        self._resolution = (None, None)
-        self._pixel_aspect = None
-        self._segments = list()
-        self._metadata = dict()
+        self._full_scan = full_scan or hash_scan
+        self._tags = None if tags is None else frozenset(tags)
+        self._stats = stats
+        self._limits = limits
+        self._deadline = None
+        self._segments = SegmentTable()
+
+        # Decoded on first access
+        self._resolution = _UNREAD
+        self._pixel_aspect = _UNREAD
+        self._metadata = _UNREAD
+        self._app_segments = _UNREAD
+        self._jfif_metadata = _UNREAD
+        self._ifd0_metadata = _UNREAD
+        self._exif_metadata = _UNREAD
+        self._gps_metadata = _UNREAD
+        self._sub_ifd_pointers = _UNREAD
+        self._thumbnail_location = _UNREAD
+        self._restart_index = _UNREAD
+        self._scan_hash = None
+        self._quantization_tables = _UNREAD
+        self._components = _UNREAD
+        self._quality = _UNREAD
+
+        self._data = None
+        self._view = None
+        self._header_only = False
+        if stats is not None:
+            stats.files += 1
+        # The time budget covers opening the file and the marker pass.
+        self._start_budget()
+        with self._timer('open'):
+            self._open()
+        try:
+            with self._timer('markers'):
+                self._read_segments(hash_scan, hash_tables)
+        except BaseException:
+            self.close()
+            raise
+
+    @classmethod
+    def from_bytes(cls, data, full_scan=False, tags=None, stats=None, limits=None, hash_scan=False, hash_tables=False):
+        """ Read a JPEG file that is already in memory (bytes, bytearray, memoryview or mmap). Segment offsets are
+        relative to the start of `data`.
+        """
+        if isinstance(data, bytes):
+            # The constructor takes bytes for a path, as open() does.
+            data = memoryview(data)
+        return cls(data, full_scan=full_scan, tags=tags, stats=stats, limits=limits, hash_scan=hash_scan,
+                   hash_tables=hash_tables)
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, full_scan=False, tags=None, stats=None, limits=None, hash_scan=False,
+                    hash_tables=False):
+        """ Read a JPEG file from a readable binary stream, starting at its current position. Segment offsets are
+        relative to that position.
+        """
+        return cls(stream, full_scan=full_scan, tags=tags, stats=stats, limits=limits, hash_scan=hash_scan,
+                   hash_tables=hash_tables)
+
+    @classmethod
+    async def aopen(cls, file_path, full_scan=False, tags=None, executor=None, stats=None, limits=None,
+                    hash_scan=False, hash_tables=False):
+        """ Read a JPEG file without blocking the event loop. The file is read in `executor` (the loop's default
+        executor if None), everything is decoded there, and the file is closed, so reading properties afterwards never
+        touches the disk.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, cls._read_and_close, file_path, full_scan, tags, stats, limits, hash_scan, hash_tables)
 
-        self._file = None
-        self._read_file()
+    @classmethod
+    def _read_and_close(cls, file_path, full_scan, tags, stats=None, limits=None, hash_scan=False, hash_tables=False):
+        with cls(file_path, full_scan=full_scan, tags=tags, stats=stats, limits=limits, hash_scan=hash_scan,
+                 hash_tables=hash_tables) as jpeg_file:
+            jpeg_file.load()
+        return jpeg_file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def load(self):
+        """ Decode everything now, instead of on first access. """
+        _ = self.resolution, self.pixel_aspect, self.metadata, self.thumbnail_location, self.quality
+
+    def detach(self):
+        """ Decode the resolution, pixel aspect ratio and metadata, and return them in a ScanResult that holds no
+        reference to the file or its data. Files read from bytes or unnamed streams get a description as file_path.
+        """
+        file_path = self._name
+        if not isinstance(file_path, (str, bytes, os.PathLike)):
+            file_path = str(file_path)
+        return ScanResult(
+            file_path=file_path,
+            resolution=self.resolution,
+            pixel_aspect=self.pixel_aspect,
+            segments=self._segments,
+            metadata=self.metadata,
+            error=None,
+            stats=self._stats,
+            scan_hash=self._scan_hash)
+
+    def close(self):
+        """ Release the file. Values that were already read remain available. """
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if isinstance(self._data, mmap.mmap) and self._data is not self._file_path:
+            self._data.close()
+        self._data = None
+
+    @property
+    def closed(self):
+        return self._view is None
 
     @property
     def resolution(self):
+        if self._resolution is _UNREAD:
+            with self._timer('sof'):
+                self._resolution = self._get_resolution()
         return self._resolution
 
+    @property
+    def quantization_tables(self):
+        """ The quantization tables defined before the first scan, by table id: 64 values each, in zigzag order. Tables
+        that overrun their DQT segment are left out.
+        """
+        if self._quantization_tables is _UNREAD:
+            with self._timer('tables'):
+                self._read_encoding_tables()
+        return self._quantization_tables
+
+    @property
+    def components(self):
+        """ The frame's components (utils.encoding.Component): id, horizontal and vertical sampling factors, and
+        quantization table id. Empty if the file has no SOF segment.
+        """
+        if self._components is _UNREAD:
+            with self._timer('tables'):
+                self._read_encoding_tables()
+        return self._components
+
+    @property
+    def quality(self):
+        """ The IJG (libjpeg) quality factor the quantization tables correspond to, as a utils.encoding.QualityEstimate
+        of the quality (1-100) and whether the tables are exactly libjpeg's. None if the file has no tables, or the
+        luminance table is damaged.
+        """
+        if self._quality is _UNREAD:
+            self._quality = self._get_quality()
+        return self._quality
+
+    @property
+    def chroma_subsampling(self):
+        """ The chroma subsampling of the frame, e.g. '4:2:0', or '4:0:0' for grayscale. None if the file has no SOF
+        segment, or its sampling factors don't match a common scheme.
+        """
+        components = self.components
+        return encoding.chroma_subsampling(components) if components else None
+
     @property
     def pixel_aspect(self):
+        if self._pixel_aspect is _UNREAD:
+            self._pixel_aspect = self._get_pixel_aspect()
         return self._pixel_aspect
 
     @property
     def segments(self):
+        """ The segments found, as a SegmentTable: iterating over it gives Segment (marker, offset) tuples. """
         return self._segments
 
     @property
     def metadata(self):
+        """ All metadata groups, merged into a single dictionary. Restricted to the requested tags, if any. """
+        if self._metadata is _UNREAD and self._tags is not None:
+            self._metadata = self.get_tags(self._tags)
+        elif self._metadata is _UNREAD:
+            metadata = dict()
+            metadata.update(self.jfif_metadata)
+            metadata.update(self.ifd0_metadata)
+            metadata.update(self.exif_metadata)
+            metadata.update(self.gps_metadata)
+            self._metadata = metadata
         return self._metadata
 
-    def _read_file(self):
-        with open(self._file_path, 'rb') as f:
-            # Validate that the file we're reading is a JPEG file
-            self._file = f
-            marker = self._find_next_marker()
-            assert marker == segment_markers.SOI.marker, f"File is not a JPEG file: {self._file_path}"
-
-            # Build list of segment markers
-            while marker != segment_markers.EOI.marker:
-                marker = self._find_next_marker()
-
-            # Read data from known segments
-            for segment in self.segments:  # type: Segment
-                marker = segment.marker  # type:segment_markers.SegmentMarker
-                if segment.marker in segment_markers.SOF_MARKERS:
-                    # Get resolution from any SOF marker.
-                    self._get_resolution(segment.offset)
-                    continue
-                elif marker in segment_markers.APP_MARKERS:
-                    # APP Markers can contain pixel aspect ratio and other useful metadata.
-                    self._read_app_segment(segment.offset)
-                    continue
+    @property
+    def jfif_metadata(self):
+        """ Metadata from the JFIF APP0 segment. """
+        if self._jfif_metadata is _UNREAD:
+            jfif_metadata = dict()
+            with self._timer('jfif'):
+                for offset in self._get_app_segments()[0]:
+                    jfif_metadata.update(self._read_jfif_segment(offset))
+            self._jfif_metadata = jfif_metadata
+        return self._jfif_metadata
 
-    def _find_next_marker(self):
-        """ Find and return the next marker (2 bytes). """
-        # Find first byte following 0xff that is not 0xff or null
-        b1, b2 = self._file.read(2)
-        while b1 != 0xff:
-            self._file.seek(-1, os.SEEK_CUR)
-            b1, b2 = self._file.read(2)
-            while b2 == 0x00 or b2 == 0xff:
-                self._file.seek(-1, os.SEEK_CUR)
-                b1, b2 = self._file.read(2)
-
-        # Read marker
-        marker = b1 << 8 | b2
-        marker_offset = self._file.tell() - 2
-        self._record_segment(marker, marker_offset)
-        return marker
+    @property
+    def ifd0_metadata(self):
+        """ TIFF tags from IFD0 of the EXIF APP1 segment. """
+        if self._ifd0_metadata is _UNREAD:
+            self._ifd0_metadata = self._read_ifd0()
+        return self._ifd0_metadata
+
+    @property
+    def exif_metadata(self):
+        """ Tags from the EXIF IFD of the EXIF APP1 segment. """
+        if self._exif_metadata is _UNREAD:
+            self._exif_metadata = self._read_sub_ifds(0x8769, exif.exif_tag_names)
+        return self._exif_metadata
+
+    @property
+    def gps_metadata(self):
+        """ Tags from the GPSInfo IFD of the EXIF APP1 segment. """
+        if self._gps_metadata is _UNREAD:
+            self._gps_metadata = self._read_sub_ifds(0x8825, exif.gpsinfo_tag_names)
+        return self._gps_metadata
+
+    @property
+    def thumbnail_location(self):
+        """ Offset and length of the JPEG thumbnail embedded in IFD1 of the EXIF segment, or None if there isn't one.
+        """
+        if self._thumbnail_location is _UNREAD:
+            with self._timer('ifd1'):
+                self._thumbnail_location = self._find_thumbnail()
+        return self._thumbnail_location
+
+    def get_thumbnail(self):
+        """ Get the embedded JPEG thumbnail as a memoryview of the file's data, without copying or decoding it, or None
+        if there isn't one. Release the view (or use it in a `with` block) before the file is closed; use bytes() on it
+        to keep a copy.
+        """
+        location = self.thumbnail_location
+        if location is None:
+            return None
+        offset, length = location
+        return self._buffer[offset:offset + length]
+
+    def write_thumbnail(self, destination):
+        """ Write the embedded JPEG thumbnail straight from the file's data to a path or a writable binary stream.
+        Returns the number of bytes written, or None if there is no thumbnail (in which case nothing is created).
+        """
+        thumbnail = self.get_thumbnail()
+        if thumbnail is None:
+            return None
+
+        with thumbnail:
+            if hasattr(destination, 'write'):
+                destination.write(thumbnail)
+            else:
+                with open(destination, 'wb') as f:
+                    f.write(thumbnail)
+            return len(thumbnail)
+
+    def write_stripped(self, destination, drop_segments=(), drop_tags=rewrite.PRIVATE_TAGS, replacements=None):
+        """ Write a copy of the file without some of its metadata to a path or a writable binary stream, and return the
+        number of bytes written. Nothing is decoded: the image data, and every segment that isn't changed, is copied
+        verbatim. When the file was read from a path and is written to one, the copying is done by the kernel
+        (see utils.rewrite.copy_range), so it takes about as long as copying the file.
+
+        drop_segments = Segments to leave out, given as segment markers (e.g. segment_markers.COM) or APP segment
+            header strings (e.g. constants.XMP_HEADER)
+        drop_tags = Names of the EXIF tags to remove; by default the GPSInfo IFD and the MakerNote (see utils.rewrite)
+        replacements = Maps the offset of a segment to the data (without its marker and length) to write in its place,
+            or to None to leave it out
+
+        Only the segments before the first scan are changed. Raises if an EXIF segment is too damaged for the tags to be
+        removed, rather than leaving them in.
+        """
+        if self._header_only:
+            raise ValueError(f"Only the header of {self._name} was read; read it with full_scan=True to rewrite it")
+        pieces = self._get_stripped_pieces(drop_segments, drop_tags, replacements or dict())
+        if hasattr(destination, 'write'):
+            return _write_pieces(self._buffer, pieces, destination)
+
+        source_path = self._file_path if isinstance(self._file_path, (str, bytes, os.PathLike)) else None
+        if source_path is not None and os.path.exists(destination) and os.path.samefile(source_path, destination):
+            raise ValueError(f"Writing {destination} would overwrite the file it comes from")
+        with contextlib.ExitStack() as stack:
+            source = None
+            if source_path is not None:
+                source = stack.enter_context(open(source_path, 'rb'))
+                if os.fstat(source.fileno()).st_size != len(self._buffer):
+                    # The file has changed since it was read; only the data that was read can be trusted.
+                    source = None
+            with open(destination, 'wb', buffering=0) as f:
+                return _write_pieces(self._buffer, pieces, f, source)
+
+    def verify(self, deep=False):
+        """ Check that the file is complete and well-formed, and return a utils.integrity.Verification: one of the
+        statuses in utils.integrity, where the problem is, and a description of it. The quick check reads the header
+        and the last two bytes; a deep one walks the whole file and checks the order of the RST markers. See
+        verify_file to check a file without reading anything else.
+        """
+        if self._header_only:
+            raise ValueError(f"Only the header of {self._name} was read; read it with full_scan=True to verify it")
+        return integrity.verify_buffer(self._buffer, deep=deep)
+
+    @property
+    def scan_hash(self):
+        """ Hex digest of the compressed image data, computed during the marker pass when the file was read with
+        hash_scan=True (see the class docstring); None otherwise.
+        """
+        return self._scan_hash
+
+    @property
+    def restart_index(self):
+        """ The restart index (utils.restart.RestartIndex) of the first scan: the DRI restart interval, and the offset
+        of each RST marker, which can be mapped to the MCU row and column decoding restarts at. None if the file has no
+        restart interval. RST markers already found by a full scan are reused; otherwise the scan data is searched.
+        """
+        if self._restart_index is _UNREAD:
+            self._restart_index = self._get_restart_index()
+        return self._restart_index
+
+    def decode_preview(self, workers=1):
+        """ Decode the image at 1/8 scale, from only the DC coefficient (the mean) of each 8x8 block. Much faster than
+        a full decode, and good enough for small previews or perceptual hashes. Baseline, extended sequential and
+        progressive files are supported. Needs NumPy. See decode for `workers`.
+
+        Returns a uint8 ndarray, shaped (height, width, 3) for colour images or (height, width) for grayscale.
+        """
+        # Imported here, so that NumPy is only needed for decoding.
+        from utils import decoder
+        with _decoder_executor(workers) as executor:
+            return decoder.Decoder(self._get_image_data(), self._segments).decode_dc(executor=executor)
+
+    def decode(self, box=None, workers=1):
+        """ Decode the image. Baseline and extended sequential files with 8-bit samples are supported, in grayscale or
+        colour. Like decode_preview, it is written in Python and NumPy, so it is slow next to a native decoder, but
+        needs nothing else installed.
+
+        Pass `box` (left, top, right, bottom) to decode only that region. Files with a restart interval (see
+        restart_index) are made of chunks that decode independently: only the chunks covering the box are decoded,
+        and with `workers` > 1 (None for one per CPU) they are decoded in a process pool. Without a restart interval,
+        the whole scan is decoded by a single worker.
+
+        Returns a uint8 ndarray, shaped (height, width, 3) for colour images or (height, width) for grayscale.
+        """
+        # Imported here, so that NumPy is only needed for decoding.
+        from utils import decoder
+        with _decoder_executor(workers) as executor:
+            return decoder.Decoder(self._get_image_data(), self._segments).decode(box, executor=executor)
+
+    @property
+    def full_scan(self):
+        return self._full_scan
+
+    @property
+    def stats(self):
+        """ The ReadStats being recorded into, or None if this file isn't instrumented. """
+        return self._stats
+
+    def get_tags(self, tags):
+        """ Get only the given metadata tags (by name). Values of other tags aren't decoded, and the EXIF and GPSInfo
+        IFDs are only read if one of the tags lives there. Tags that aren't in the file are left out.
+        """
+        tags = set(tags)
+        tag_data = dict()
+
+        if tags & jfif.tag_name_set:
+            tag_data.update(self.jfif_metadata)
+
+        # Groups that were already decoded in full are filtered; the others are read for these tags only.
+        if not tags & exif.tiff_tag_name_set:
+            pass
+        elif self._ifd0_metadata is not _UNREAD:
+            tag_data.update(self._ifd0_metadata)
+        else:
+            tag_data.update(self._read_ifd0(tag_filter=tags))
+
+        if not tags & exif.exif_tag_name_set:
+            pass
+        elif self._exif_metadata is not _UNREAD:
+            tag_data.update(self._exif_metadata)
+        else:
+            tag_data.update(self._read_sub_ifds(0x8769, exif.exif_tag_names, tag_filter=tags))
+
+        if not tags & exif.gpsinfo_tag_name_set:
+            pass
+        elif self._gps_metadata is not _UNREAD:
+            tag_data.update(self._gps_metadata)
+        else:
+            tag_data.update(self._read_sub_ifds(0x8825, exif.gpsinfo_tag_names, tag_filter=tags))
+
+        return {tag_name: value for tag_name, value in tag_data.items() if tag_name in tags}
+
+    @property
+    def _buffer(self):
+        if self._view is None:
+            raise ValueError(f"JpegFile is closed: {self._name}")
+        return self._view
+
+    @property
+    def _name(self):
+        """ Description of where the file was read from, for error messages. """
+        if isinstance(self._file_path, (bytearray, memoryview, mmap.mmap)):
+            return f"<{type(self._file_path).__name__} of {len(self._file_path)} bytes>"
+        elif isinstance(self._file_path, (str, bytes, os.PathLike)):
+            # The whole path; a pathlib.Path's `name` is only its last component.
+            return os.fspath(self._file_path)
+        # Streams are described by their name, if they have one
+        return getattr(self._file_path, 'name', self._file_path)
+
+    def _get_image_data(self):
+        """ The buffer, checked to hold the entropy-coded data as well as the header. """
+        if self._header_only:
+            raise ValueError(f"Only the header of {self._name} was read; read it with full_scan=True to decode it")
+        return self._buffer
+
+    def _timer(self, phase):
+        """ Time a phase of reading the file, if it is instrumented. """
+        if self._stats is None:
+            return _NO_TIMER
+        return self._stats.timer(phase)
+
+    def _start_budget(self):
+        """ Start the time budget for a step of reading the file, if there are limits. """
+        if self._limits is not None:
+            self._deadline = self._limits.deadline()
+
+    def _check_budget(self, offset=None):
+        """ Raise LimitExceeded if the current step has run out of time. """
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            raise LimitExceeded('max_seconds', self._limits.max_seconds, self._name, offset)
+
+    def _open(self):
+        """ Get the data to read from, and a view of it. """
+        if isinstance(self._file_path, (bytearray, memoryview, mmap.mmap)):
+            self._data = self._file_path
+        elif hasattr(self._file_path, 'read'):
+            self._data = self._read_stream(self._counted(self._file_path))
+        else:
+            with open(self._file_path, 'rb') as f:
+                self._data = self._read_stream(self._counted(f))
+        self._view = memoryview(self._data)
+
+    def _counted(self, stream: BinaryIO):
+        """ Wrap the stream to count its read and seek calls, if the file is instrumented. """
+        if self._stats is None:
+            return stream
+        return instrumentation.CountingStream(stream, self._stats)
+
+    def _read_stream(self, stream: BinaryIO):
+        """ Memory-map the stream if it is a regular file read from the start; otherwise read it into memory. Unless a
+        full scan was requested, reading stops once the header is complete. With limits, no more than one byte past
+        max_bytes_scanned is read, which is enough for the marker pass to report the limit.
+        """
+        max_bytes = None if self._limits is None else self._limits.max_bytes_scanned
+        data = None
+        if _is_mappable(stream):
+            data = _map_file(stream)
+        if data is not None and self._stats is not None:
+            self._stats.bytes_mapped += len(data)
+        if data is None and self._full_scan:
+            data = stream.read(-1 if max_bytes is None else max_bytes + 1)
+        elif data is None:
+            data = _read_header(stream, self._limits)
+            self._header_only = True
+        return data
+
+    def _read_segments(self, hash_scan=False, hash_tables=False):
+        # Validate that the file we're reading is a JPEG file; it must start with an SOI marker.
+        soi_bytes = struct.pack('>H', segment_markers.SOI.marker)
+        if self._buffer[:2] != soi_bytes:
+            raise ValueError(f"File is not a JPEG file: {self._name}")
+        self._record_segment(segment_markers.SOI.marker, 0)
+
+        # Build list of segment markers. Unless a full scan was requested, stop at the first SOS marker; nothing
+        # we read lives in the entropy-coded data that follows it.
+        if self._full_scan:
+            stop_markers = (segment_markers.EOI.marker, )
+        else:
+            stop_markers = (segment_markers.SOS.marker, segment_markers.EOI.marker)
+        if hash_scan:
+            # Imported here, so that reading files without hashing them doesn't pay for it.
+            import hashlib
+            hasher = hashlib.blake2b(digest_size=SCAN_HASH_SIZE)
+            hashed_markers = _SCAN_HASH_MARKERS | _TABLE_HASH_MARKERS if hash_tables else _SCAN_HASH_MARKERS
+            self._find_segments(2, stop_markers, hasher, hashed_markers)
+            self._scan_hash = hasher.hexdigest()
+        else:
+            self._find_segments(2, stop_markers)
+        if self._stats is not None:
+            self._stats.bytes_scanned += self._segments[-1].offset + 2
+
+    def _find_segments(self, position, stop_markers, hasher=None, hashed_markers=()):
+        """ Walk from segment to segment using each segment's length field. Byte scanning is only needed inside
+        entropy-coded data, which follows an SOS header and runs until the next marker that isn't a RST marker.
+
+        With a hasher, each segment whose marker is in `hashed_markers` is fed to it, from its marker up to the next
+        marker (so including any entropy-coded data), right after it is walked.
+        """
+        in_scan_data = False
+        hash_start = None
+        while True:
+            if in_scan_data:
+                marker_offset, marker = self._scan_for_marker(position)
+            else:
+                marker_offset, marker = self._read_marker(position)
+            if hash_start is not None:
+                with self._buffer[hash_start:marker_offset] as hashed:
+                    hasher.update(hashed)
+            hash_start = marker_offset if marker in hashed_markers else None
+            self._record_segment(marker, marker_offset)
+            if self._limits is not None:
+                self._check_segment_limits(marker_offset)
+
+            if marker in stop_markers:
+                break
+            elif segment_markers.get_segment_marker(marker) in segment_markers.STANDALONE_MARKERS:
+                position = marker_offset + 2
+            else:
+                with BufferSegment(self._buffer, segment_start=marker_offset) as seg:
+                    position = seg.segment_end
+                in_scan_data = marker == segment_markers.SOS.marker
+
+    def _read_marker(self, position):
+        """ Read the marker expected at `position`. Fill bytes (0xff) before the marker are skipped; if something
+        other than a marker is found there, fall back to scanning for the next one.
+        """
+        buffer = self._buffer
+        end = len(buffer) - 1
+        while position < end and buffer[position] == 0xff and buffer[position + 1] == 0xff:
+            position += 1
+
+        if position >= end:
+            raise EOFError(f"Reached end of file while reading a segment marker at {hex(position)}")
+        elif buffer[position] == 0xff and buffer[position + 1] != 0x00:
+            return position, buffer[position] << 8 | buffer[position + 1]
+        else:
+            return self._scan_for_marker(position)
+
+    def _scan_for_marker(self, position):
+        """ Scan for the next marker, e.g. through entropy-coded data. With limits, the scan stops at
+        max_bytes_scanned, and goes a chunk at a time so that the time budget is checked along the way.
+        """
+        if self._limits is None:
+            return scanner.find_marker(self._buffer, position)
+
+        buffer_end = len(self._buffer)
+        max_bytes = self._limits.max_bytes_scanned
+        end = buffer_end if max_bytes is None else min(buffer_end, max_bytes)
+        while True:
+            chunk_end = min(end, position + SCAN_CHUNK_SIZE)
+            try:
+                return scanner.find_marker(self._buffer, position, chunk_end)
+            except EOFError:
+                if chunk_end >= buffer_end:
+                    raise
+                elif chunk_end >= end:
+                    raise LimitExceeded('max_bytes_scanned', max_bytes, self._name, chunk_end) from None
+            self._check_budget(chunk_end)
+            # Start the next chunk on the last byte of this one, in case a marker straddles them.
+            position = chunk_end - 1
+
+    def _check_segment_limits(self, marker_offset):
+        """ Check the marker pass against the limits, after a segment is found. """
+        limits = self._limits
+        if limits.max_segments is not None and len(self._segments) > limits.max_segments:
+            raise LimitExceeded('max_segments', limits.max_segments, self._name, marker_offset)
+        elif limits.max_bytes_scanned is not None and marker_offset + 2 > limits.max_bytes_scanned:
+            raise LimitExceeded('max_bytes_scanned', limits.max_bytes_scanned, self._name, marker_offset)
+        self._check_budget(marker_offset)
 
     def _record_segment(self, marker, offset):
         """ Add segment marker and location to list of segments. """
-        segment_marker = segment_markers.get_segment_marker(marker)
-        if segment_marker is not None:
-            self._segments.append(Segment(segment_marker, offset))
+        if segment_markers.get_segment_marker(marker) is not None:
+            self._segments.append(marker, offset)
 
-    def _get_resolution(self, offset):
+    def _get_resolution(self):
         """ Get the resolution from a SOF frame header segment. """
-        with ReadSegment(self._file, segment_start=offset) as seg:
-            seg.go_to_segment_data()
-            self._file.seek(1, os.SEEK_CUR)  # Skip sample precision
-            y = struct.unpack('>H', self._file.read(2))[0]  # Number of lines
-            x = struct.unpack('>H', self._file.read(2))[0]  # Number of samples per line
-            self._resolution = (x, y)
-
-    def _read_app_segment(self, offset):
-        """ Read an APP segment and handle any known segment types. """
-        with ReadSegment(self._file, segment_start=offset) as seg:
-            seg.go_to_segment_data()
-            if self._unpack_header_string(4) in [constants.JFIF_HEADER, constants.JFXX_HEADER]:
-                self._read_jfif_segment()
-                return
-            elif self._unpack_header_string(4) == constants.EXIF_HEADER:
-                self._read_exif_segment()
-                return
-
-    def _unpack_header_string(self, length):
-        """ Read the next characters as a string. """
-        start_pos = self._file.tell()
+        resolution = (None, None)
+        for segment in self._segments:  # type: Segment
+            if segment.marker in segment_markers.SOF_MARKERS:
+                with BufferSegment(self._buffer, segment_start=segment.offset) as seg:
+                    # Skip sample precision, then read number of lines and number of samples per line
+                    y, x = struct.unpack_from('>2H', self._buffer, seg.segment_data + 1)
+                    resolution = (x, y)
+        return resolution
+
+    def _read_encoding_tables(self):
+        """ Read the quantization tables and the frame's components from the DQT and SOF segments before the first
+        scan. A table that is defined again replaces the earlier one, as it would for the decoder. These only describe
+        the file, so damaged segments are skipped rather than raised: a table that overruns its DQT segment is left
+        out, as is a frame header too short for its components. Decoding the file reports them.
+        """
+        buffer = self._buffer
+        tables = dict()
+        components = ()
+        for segment in self._segments:  # type: Segment
+            if segment.marker is segment_markers.DQT:
+                with BufferSegment(buffer, segment_start=segment.offset) as seg:
+                    position = seg.segment_data
+                    segment_end = min(seg.segment_end, len(buffer))
+                    while position < segment_end:
+                        # Each table starts with its precision (8 or 16-bit values) and id
+                        precision, table_id = buffer[position] >> 4, buffer[position] & 0x0f
+                        value_format = '>64H' if precision else '64B'
+                        table_end = position + 1 + struct.calcsize(value_format)
+                        if table_end > segment_end:
+                            break
+                        tables[table_id] = struct.unpack_from(value_format, buffer, position + 1)
+                        position = table_end
+            elif segment.marker in segment_markers.SOF_MARKERS:
+                with BufferSegment(buffer, segment_start=segment.offset) as seg:
+                    # Skip sample precision and size, then read each component's id, sampling factors and table id
+                    component_count = buffer[seg.segment_data + 5] if seg.segment_data + 5 < len(buffer) else 0
+                    if seg.segment_data + 6 + component_count * 3 > min(seg.segment_end, len(buffer)):
+                        continue
+                    fields = [struct.unpack_from('3B', buffer, seg.segment_data + 6 + x * 3)
+                              for x in range(component_count)]
+                components = tuple(
+                    encoding.Component(component_id, sampling >> 4, sampling & 0x0f, table_id)
+                    for component_id, sampling, table_id in fields)
+            elif segment.marker is segment_markers.SOS:
+                break
+        self._quantization_tables = tables
+        self._components = components
+
+    def _get_stripped_pieces(self, drop_segments, drop_tags, replacements):
+        """ The pieces write_stripped writes, in order: (start, end) ranges of the file, or bytes that replace a
+        segment.
+        """
+        buffer = self._buffer
+        drop_headers = [header.encode() for header in drop_segments if isinstance(header, str)]
+        # Markers are matched by their code: some codes have two names (e.g. COM, which is found as JPGE).
+        drop_markers = {marker.marker for marker in drop_segments if isinstance(marker, segment_markers.SegmentMarker)}
+        exif_byte_orders = dict(self._get_app_segments()[1]) if drop_tags else dict()
+        pieces = list()
+        for number, segment in enumerate(self._segments):  # type: int, Segment
+            if segment.marker is segment_markers.SOS:
+                pieces.append((segment.offset, len(buffer)))
+                break
+            # Each segment runs until the next one, so fill bytes in between are kept.
+            end = self._segments[number + 1].offset if number + 1 < len(self._segments) else len(buffer)
+
+            if segment.offset in replacements:
+                data = replacements[segment.offset]
+                if data is not None:
+                    if len(data) + 2 > 0xffff:
+                        raise ValueError(f"Replacement for the segment at {hex(segment.offset)} is too long")
+                    pieces.append(struct.pack('>2H', segment.marker.marker, len(data) + 2) + bytes(data))
+                continue
+            elif segment.marker.marker in drop_markers:
+                continue
+            elif segment.marker in segment_markers.APP_MARKERS and drop_headers:
+                with BufferSegment(buffer, segment_start=segment.offset) as seg:
+                    if any(buffer[seg.segment_data:seg.segment_data + len(header)] == header
+                           for header in drop_headers):
+                        continue
+
+            # The TIFF header follows the 6 byte Exif header string.
+            tiff_header_offset = segment.offset + 10
+            if tiff_header_offset in exif_byte_orders:
+                with BufferSegment(buffer, segment_start=segment.offset) as seg:
+                    data = bytearray(buffer[segment.offset:seg.segment_end])
+                    if rewrite.remove_exif_tags(data, 10, exif_byte_orders[tiff_header_offset], drop_tags):
+                        pieces.append(bytes(data))
+                        pieces.append((seg.segment_end, end))
+                        continue
+            elif drop_tags and segment.marker in segment_markers.APP_MARKERS:
+                with BufferSegment(buffer, segment_start=segment.offset) as seg:
+                    if self._unpack_header_string(seg.segment_data, 4) == constants.EXIF_HEADER:
+                        # Its TIFF header couldn't be read, so there is no telling which tags it holds.
+                        raise ValueError(f"The EXIF segment at {hex(segment.offset)} of {self._name} is too damaged "
+                                         f"to remove tags from; drop the whole segment instead")
+            pieces.append((segment.offset, end))
+        return pieces
+
+    def _get_quality(self):
+        """ Estimate the quality from the luminance table and, for colour files, the chrominance table: the tables of
+        the first two components, or tables 0 and 1 if the file has no SOF segment.
+        """
+        tables = self.quantization_tables
+        if self.components:
+            table_ids = [component.table_id for component in self.components[:2]]
+        else:
+            table_ids = sorted(tables)[:2]
+        if not table_ids or table_ids[0] not in tables:
+            return None
+        luminance = tables[table_ids[0]]
+        chrominance = None
+        if len(table_ids) > 1 and table_ids[1] != table_ids[0]:
+            chrominance = tables.get(table_ids[1])
+        return encoding.estimate_quality(luminance, chrominance)
+
+    def _get_pixel_aspect(self):
+        """ Get the pixel aspect ratio from the JFIF density, or the EXIF resolution when there is one. """
+        pixel_aspect = None
+        tag_data = self.get_tags(['Xdensity', 'Ydensity', 'XResolution', 'YResolution'])
+
+        x_density = tag_data.get('Xdensity')
+        y_density = tag_data.get('Ydensity')
+        if x_density is not None and y_density is not None and y_density != 0:
+            pixel_aspect = float(x_density) / float(y_density)
+
+        x_resolution = tag_data.get('XResolution')
+        y_resolution = tag_data.get('YResolution')
+        if x_resolution is not None and y_resolution is not None and y_resolution != 0:
+            pixel_aspect = float(x_resolution) / float(y_resolution)
+
+        return pixel_aspect
+
+    def _get_app_segments(self):
+        """ Find the JFIF and EXIF APP segments. Returns the offsets of the JFIF segment data, and the TIFF header
+        offset and byte order of each EXIF segment.
+        """
+        if self._app_segments is _UNREAD:
+            jfif_offsets = list()
+            exif_headers = list()
+            for segment in self._segments:  # type: Segment
+                if segment.marker not in segment_markers.APP_MARKERS:
+                    continue
+
+                with BufferSegment(self._buffer, segment_start=segment.offset) as seg:
+                    header = self._unpack_header_string(seg.segment_data, 4)
+                    if header in [constants.JFIF_HEADER, constants.JFXX_HEADER]:
+                        jfif_offsets.append(seg.segment_data)
+                    elif header == constants.EXIF_HEADER:
+                        tiff_header_offset = seg.segment_data + 6
+                        try:
+                            endian = self._get_exif_byte_order(tiff_header_offset)
+                        except Exception as e:
+                            # The rest of the file can still be read; only this segment's tags are missing.
+                            warnings.warn(f"Skipping the EXIF segment at {hex(segment.offset)} of {self._name}: {e}")
+                            continue
+                        exif_headers.append((tiff_header_offset, endian))
+            self._app_segments = (jfif_offsets, exif_headers)
+        return self._app_segments
+
+    def _unpack_header_string(self, offset, length):
+        """ Read the characters at offset as a string. """
         # noinspection PyBroadException
         try:
-            header = struct.unpack(f'>{length}s', self._file.read(length))[0]
+            header = struct.unpack_from(f'>{length}s', self._buffer, offset)[0]
             header = header.decode('utf-8')
         except Exception:
             header = None
-        finally:
-            self._file.seek(start_pos, os.SEEK_SET)
         return header
 
-    def _read_jfif_segment(self):
+    def _read_jfif_segment(self, offset):
         """ Read the JFIF APP0 segment. """
-        self._file.seek(5, os.SEEK_CUR)  # Skip JFIF header string
-
-        version_major, version_minor = struct.unpack('>2B', self._file.read(2))
+        # Skip JFIF header string
+        version_major, version_minor, density_units, x_density, y_density = struct.unpack_from(
+            '>3B2H', self._buffer, offset + 5)
         jfif_version = f"{version_major}.{version_minor}"
-        density_units = struct.unpack('>B', self._file.read(1))[0]
-        x_density, y_density = struct.unpack('>2H', self._file.read(4))
 
-        self._metadata.update({
+        return {
             'JFIFVersion': jfif_version,
             'DensityUnits': jfif.density_unit_map.get(density_units, density_units),
             'Xdensity': x_density,
             'Ydensity': y_density
-        })
-        self._pixel_aspect = float(x_density) / float(y_density)
-
-    def _read_exif_segment(self):
-        self._file.seek(6, os.SEEK_CUR)
-        tiff_header_offset = self._file.tell()
-
-        try:
-            endian = self._get_exif_byte_order(tiff_header_offset)
-        except Exception as e:
-            print(e)
-            return
-
-        self._read_exif_ifds(tiff_header_offset, endian)
-
-        # Update pixel aspect ratio
-        x_resolution = self.metadata.get('XResolution')
-        y_resolution = self.metadata.get('YResolution')
-        if x_resolution is not None and y_resolution is not None and y_resolution != 0:
-            self._pixel_aspect = float(x_resolution) / float(y_resolution)
+        }
 
     def _get_exif_byte_order(self, tiff_header_offset):
         """ Get byte order for EXIF APP segment. """
-        self._file.seek(tiff_header_offset, os.SEEK_SET)
-        byte_order_signature = struct.unpack('>2s', self._file.read(2))[0]
+        byte_order_signature = struct.unpack_from('>2s', self._buffer, tiff_header_offset)[0]
         byte_order_signature = byte_order_signature.decode('utf-8')
         if byte_order_signature == "II":
             # 0x4949, Intel, little-endian
@@ -207,117 +945,216 @@ class JpegFile:
             # 0x4d4d, Motorola, big-endian
             endian = '>'
         else:
-            pos = hex(self._file.tell())
+            pos = hex(tiff_header_offset)
             raise RuntimeError(f"Unsupported byte order signature at {pos}: {byte_order_signature}")
 
         # Validate byte order; next 2 bytes are always 0x002a (42)
-        bytes_42 = struct.unpack(f'{endian}H', self._file.read(2))[0]
-        assert bytes_42 == 0x002a, "EXIF data order does not match byte order signature."
+        bytes_42 = struct.unpack_from(f'{endian}H', self._buffer, tiff_header_offset + 2)[0]
+        if bytes_42 != 0x002a:
+            raise RuntimeError("EXIF data order does not match byte order signature.")
 
         return endian
 
-    def _read_exif_ifds(self, tiff_header_offset, endian):
-        """ Read all IFDs from an EXIF Segment and set metadata. """
-        # Get offset to the first IFD, from the TIFF header.
-        self._file.seek(tiff_header_offset, os.SEEK_SET)
-        self._file.seek(4, os.SEEK_CUR)
-        ifd_pointer = struct.unpack(f'{endian}I', self._file.read(4))[0]
-        ifd0_offset = tiff_header_offset + ifd_pointer
-
-        # Get info from IFD0.
-        ifd0_data = self._get_ifd_data(
-           ifd0_offset,
-           tiff_header_offset,
-           endian,
-           tag_names=exif.tiff_tag_names)
-
-        # IDF0 will contain pointer to EXIF IFD.
-        # noinspection PyBroadException
-        try:
-            exif_ifd_tag = exif.tiff_tag_names.get(0x8769)
-            exif_ifd_pointer = ifd0_data.pop(exif_ifd_tag)
-            exif_ifd_offset = tiff_header_offset + exif_ifd_pointer
-            exif_ifd_data = self._get_ifd_data(
-                exif_ifd_offset,
-                tiff_header_offset,
-                endian,
-                tag_names=exif.exif_tag_names)
-        except Exception:
-            exif_ifd_data = {}
+    def _read_ifd0(self, tag_filter=None):
+        """ Read IFD0 from each EXIF segment, optionally only the tags named in `tag_filter`. IFD0 also holds the
+        pointers to the EXIF and GPSInfo IFDs, which are always read and kept aside so those IFDs can be read
+        separately.
+        """
+        ifd0_metadata = dict()
+        sub_ifd_pointers = list()
+        if tag_filter is not None:
+            tag_filter = set(tag_filter) | {exif.tiff_tag_names.get(tag_id) for tag_id in (0x8769, 0x8825)}
+        with self._timer('ifd0'):
+            self._start_budget()
+            for tiff_header_offset, endian in self._get_app_segments()[1]:
+                # Get offset to the first IFD, from the TIFF header.
+                ifd_pointer = struct.unpack_from(f'{endian}I', self._buffer, tiff_header_offset + 4)[0]
+                ifd0_offset = tiff_header_offset + ifd_pointer
 
-        # IDF0 may contain optional GPSInfo pointer.
-        # noinspection PyBroadException
-        try:
-            gpsinfo_ifd_tag = exif.tiff_tag_names.get(0x8825)
-            gpsinfo_ifd_pointer = ifd0_data.pop(gpsinfo_ifd_tag)
-            gpsinfo_ifd_offset = tiff_header_offset + gpsinfo_ifd_pointer
-            gpsinfo_ifd_data = self._get_ifd_data(
-                gpsinfo_ifd_offset,
-                tiff_header_offset,
-                endian,
-                tag_names=exif.gpsinfo_tag_names)
-        except Exception:
-            gpsinfo_ifd_data = {}
+                ifd0_data = self._get_ifd_data(
+                    ifd0_offset,
+                    tiff_header_offset,
+                    endian,
+                    tag_names=exif.tiff_tag_names,
+                    tag_filter=tag_filter)
 
-        self._metadata.update(ifd0_data)
-        self._metadata.update(exif_ifd_data)
-        self._metadata.update(gpsinfo_ifd_data)
+                pointers = dict()
+                for tag_id in (0x8769, 0x8825):
+                    pointers[tag_id] = ifd0_data.pop(exif.tiff_tag_names.get(tag_id), None)
+                sub_ifd_pointers.append((tiff_header_offset, endian, ifd_pointer, pointers))
+                ifd0_metadata.update(ifd0_data)
+
+        self._sub_ifd_pointers = sub_ifd_pointers
+        return ifd0_metadata
+
+    def _read_sub_ifds(self, pointer_tag_id, tag_names, tag_filter=None):
+        """ Read the IFD that an IFD0 pointer tag points to, from each EXIF segment, optionally only the tags named in
+        `tag_filter`. These IFDs are optional.
+        """
+        if self._sub_ifd_pointers is _UNREAD:
+            # Only the pointers are needed here.
+            self._read_ifd0(tag_filter=set())
 
-    def _get_ifd_data(self, ifd_offset, tiff_header_offset, endian, tag_names):
-        """ Iterate over each interoperability. """
         ifd_data = dict()
-        self._file.seek(ifd_offset, os.SEEK_SET)
+        with self._timer(_SUB_IFD_PHASES[pointer_tag_id]):
+            self._start_budget()
+            for tiff_header_offset, endian, ifd0_pointer, pointers in self._sub_ifd_pointers:
+                ifd_pointer = pointers.get(pointer_tag_id)
+                if ifd_pointer is None or _is_ifd_revisit(ifd_pointer, ifd0_pointer, pointers.values()):
+                    continue
+
+                # noinspection PyBroadException
+                try:
+                    ifd_data.update(self._get_ifd_data(
+                        tiff_header_offset + ifd_pointer,
+                        tiff_header_offset,
+                        endian,
+                        tag_names=tag_names,
+                        tag_filter=tag_filter))
+                except LimitExceeded:
+                    raise
+                except Exception:
+                    pass
+        return ifd_data
+
+    def _get_restart_index(self):
+        """ Build the restart index of the first scan from the DRI, SOF and SOS segments before it. """
+        from utils import restart
+        buffer = self._buffer
+        interval = 0
+        frame = None
+        for number, segment in enumerate(self._segments):
+            if segment.marker is segment_markers.DRI:
+                interval = struct.unpack_from('>H', buffer, segment.offset + 4)[0]
+            elif segment.marker in segment_markers.SOF_MARKERS:
+                # Skip sample precision, then read the size and each component's id and sampling factors
+                height, width, component_count = struct.unpack_from('>2HB', buffer, segment.offset + 5)
+                components = [struct.unpack_from('2B', buffer, segment.offset + 10 + x * 3)
+                              for x in range(component_count)]
+                frame = (width, height, components)
+            elif segment.marker is segment_markers.SOS:
+                break
+        else:
+            return None
+        if not interval or frame is None:
+            return None
+
+        width, height, components = frame
+        component_ids = [component_id for component_id, _ in components]
+        scan_component_ids = [buffer[segment.offset + 5 + x * 2] for x in range(buffer[segment.offset + 4])]
+        scan_component_indexes = [component_ids.index(component_id) for component_id in scan_component_ids]
+        sampling_factors = [(sampling >> 4, sampling & 0x0f) for _, sampling in components]
+        mcus_x, mcus_y = restart.scan_mcu_grid(width, height, sampling_factors, scan_component_indexes)
 
-        interop_count = struct.unpack(f'{endian}H', self._file.read(2))[0]
-        for x in range(interop_count):
-            tag_id = struct.unpack(f'{endian}H', self._file.read(2))[0]
-            type_id = struct.unpack(f'{endian}H', self._file.read(2))[0]
-            count = struct.unpack(f'{endian}L', self._file.read(4))[0]
+        with BufferSegment(buffer, segment_start=segment.offset) as seg:
+            data_offset = seg.segment_end
+        if self._full_scan:
+            # The marker pass already found the scan's RST markers; the scan data ends at the marker after them.
+            marker_offsets = array.array('Q')
+            data_end = len(buffer)
+            for following in self._segments[number + 1:]:
+                if following.marker not in segment_markers.RST_MARKERS:
+                    data_end = following.offset
+                    break
+                marker_offsets.append(following.offset)
+        else:
+            marker_offsets, data_end = restart.find_restart_markers(self._get_image_data(), data_offset)
+        return restart.RestartIndex(interval, mcus_x, mcus_y, data_offset, data_end, marker_offsets)
+
+    def _find_thumbnail(self):
+        """ Find the JPEG thumbnail that IFD1 of an EXIF segment points to. IFD1 is the IFD that follows IFD0, through
+        its next IFD pointer.
+        """
+        buffer = self._buffer
+        soi_bytes = struct.pack('>H', segment_markers.SOI.marker)
+        tag_filter = {'JPEGInterchangeFormat', 'JPEGInterchangeFormatLength'}
+        self._start_budget()
+        for tiff_header_offset, endian in self._get_app_segments()[1]:
+            # noinspection PyBroadException
+            try:
+                # The next IFD pointer comes right after IFD0's entries.
+                ifd_pointer = exif.get_struct(f'{endian}I').unpack_from(buffer, tiff_header_offset + 4)[0]
+                ifd0_offset = tiff_header_offset + ifd_pointer
+                interop_count = exif.get_struct(f'{endian}H').unpack_from(buffer, ifd0_offset)[0]
+                next_ifd_offset = ifd0_offset + 2 + interop_count * 12
+                ifd1_pointer = exif.get_struct(f'{endian}I').unpack_from(buffer, next_ifd_offset)[0]
+                if ifd1_pointer == 0 or ifd1_pointer == ifd_pointer:
+                    # No IFD1, or a next IFD pointer that loops back to IFD0
+                    continue
+
+                ifd1_data = self._get_ifd_data(
+                    tiff_header_offset + ifd1_pointer,
+                    tiff_header_offset,
+                    endian,
+                    tag_names=exif.tiff_tag_names,
+                    tag_filter=tag_filter)
+            except LimitExceeded:
+                raise
+            except Exception:
+                continue
 
+            thumbnail_pointer = ifd1_data.get('JPEGInterchangeFormat')
+            length = ifd1_data.get('JPEGInterchangeFormatLength')
+            if thumbnail_pointer is None or not length:
+                continue
+
+            # Only trust the pointers if they lead to a JPEG file that is inside the data.
+            offset = tiff_header_offset + thumbnail_pointer
+            if offset + length <= len(buffer) and buffer[offset:offset + 2] == soi_bytes:
+                return offset, length
+        return None
+
+    def _get_ifd_data(self, ifd_offset, tiff_header_offset, endian, tag_names, tag_filter=None):
+        """ Iterate over each interoperability. If `tag_filter` is given, only tags named in it are decoded. """
+        ifd_data = dict()
+        buffer = self._buffer
+        max_value_bytes = None
+        if self._limits is not None:
+            max_value_bytes = self._limits.max_value_bytes
+            self._check_budget(ifd_offset)
+
+        # Unpack the entry count, then each 12-byte entry of the table.
+        interop_count = exif.get_struct(f'{endian}H').unpack_from(buffer, ifd_offset)[0]
+        if self._limits is not None and self._limits.max_ifd_entries is not None:
+            if interop_count > self._limits.max_ifd_entries:
+                raise LimitExceeded('max_ifd_entries', self._limits.max_ifd_entries, self._name, ifd_offset)
+        entries = exif.unpack_ifd_entries(buffer, endian, ifd_offset, interop_count)
+        for x, (tag_id, type_id, count, value_field) in enumerate(entries):
             tag_name = tag_names.get(tag_id)
+            if tag_name is None or (tag_filter is not None and tag_name not in tag_filter):
+                # Skip non-standard tags, and tags that weren't asked for, without decoding their values.
+                continue
+
             tag_type = exif.tag_types.get(type_id)
             total_bytes = exif.get_byte_count(tag_type, count)
+            if max_value_bytes is not None and total_bytes > max_value_bytes:
+                raise LimitExceeded('max_value_bytes', max_value_bytes, self._name, ifd_offset + 2 + x * 12)
 
             # Treat strings as having a count of 1.
             if tag_type == 's':
                 tag_type = f'{count}s'
                 count = 1
 
-            # Dynamically assign ifd unpacking function
+            if total_bytes > 4:
+                # When total bytes is greater than 4, the value field stores the offset to the value.
+                value_offset = tiff_header_offset + value_field
+            else:
+                # Otherwise, the value is stored in the value field itself.
+                value_offset = ifd_offset + 2 + x * 12 + 8
+
+            # Read ifd value
             if tag_type is not None:
                 # Standard ifd value unpacking
-                def _unpack_ifd():
-                    string = self._file.read(total_bytes)
-                    if count == 1:
-                        return exif.unpack_standard_ifd_value(string, endian, tag_type)
-                    else:
-                        values = []
-                        step = int(total_bytes / count)
-                        for c in range(count):
-                            sub_string = string[c*step:c*step+step]
-                            values.append(exif.unpack_standard_ifd_value(sub_string, endian, tag_type))
-                        return values
+                if count == 1:
+                    value = exif.unpack_standard_ifd_value(buffer, endian, tag_type, value_offset)
+                else:
+                    value = exif.unpack_standard_ifd_values(buffer, endian, tag_type, count, value_offset)
             else:
                 # Undefined ifd values are interpreted uniquely for each field
-                def _unpack_ifd():
-                    string = self._file.read(total_bytes)
-                    return exif.unpack_undefined_ifd_value(tag_id, string, count)
+                value = exif.unpack_undefined_ifd_value(tag_id, buffer, count, value_offset)
 
-            # Read ifd value
-            if total_bytes <= 4:
-                # When total bytes is 4 or less, next 4 bytes stores the value.
-                value = _unpack_ifd()
-                self._file.seek(4 - total_bytes, os.SEEK_CUR)  # Handle padding
-            else:
-                # When total bytes is greater than 4, the next 4 bytes stores the offset to the value.
-                value_offset = struct.unpack(f'{endian}I', self._file.read(4))[0]
-                current_offset = self._file.tell()
-                self._file.seek(tiff_header_offset + value_offset, os.SEEK_SET)
-                value = _unpack_ifd()
-                self._file.seek(current_offset, os.SEEK_SET)
-
-            if tag_name is None or value is None:
-                # If for some reason we've encountered a non-standard tag with missing info, skip it.
+            if value is None:
+                # If for some reason we've encountered a tag with missing info, skip it.
                 continue
 
             ifd_data.update({tag_name: value})
@@ -325,28 +1162,699 @@ class JpegFile:
         return ifd_data
 
 
-def print_file_info(file_path):
+class JpegPrefixParser:
+    """ Incrementally parses the header of a JPEG file from consecutive chunks of its first bytes, e.g. from range
+    reads of a remote object.
+
+    feed() returns how many more bytes are needed before the header (every segment up to the first SOS marker) is
+    complete; it is only a lower bound, so fetching larger chunks is fine. Once it returns 0, jpeg_file() builds a
+    header-only JpegFile from the bytes fed so far.
+
+    With `limits` (a ReadLimits), feed() raises LimitExceeded once more than max_bytes_scanned bytes have been fed
+    without the header being complete, and jpeg_file() reads the header with the same limits.
+    """
+    def __init__(self, limits: ReadLimits = None):
+        self._limits = limits
+        self._data = bytearray()
+        self._position = 0
+        self._bytes_needed = 2
+        self._done = False
+        # Set once the EOI marker has been fed, i.e. the whole file rather than only its header
+        self._complete = False
+
+    @property
+    def done(self):
+        return self._done
+
+    @property
+    def bytes_needed(self):
+        return self._bytes_needed
+
+    @property
+    def data(self):
+        """ All bytes fed so far. """
+        return self._data
+
+    def feed(self, chunk):
+        """ Add the next chunk of the file, and return how many more bytes are needed (0 when done). """
+        if not self._done:
+            self._data += chunk
+            self._bytes_needed = self._advance()
+            self._done = self._bytes_needed == 0
+
+        max_bytes = None if self._limits is None else self._limits.max_bytes_scanned
+        if not self._done and max_bytes is not None and len(self._data) > max_bytes:
+            raise LimitExceeded('max_bytes_scanned', max_bytes, "JPEG header", len(self._data))
+        return self._bytes_needed
+
+    def jpeg_file(self):
+        """ Read the header that has been fed so far. Unless the whole file was fed, the JpegFile only holds the header,
+        so it refuses to decode, rewrite or verify the file, like one read from a stream without full_scan.
+        """
+        if not self._done:
+            raise RuntimeError(f"JPEG header is incomplete; at least {self._bytes_needed} more bytes are needed")
+        jpeg_file = JpegFile.from_bytes(bytes(self._data), limits=self._limits)
+        jpeg_file._header_only = not self._complete
+        return jpeg_file
+
+    def _advance(self):
+        """ Walk the segments that are complete, the same way JpegFile does, and return the number of bytes needed
+        to get past the next one.
+        """
+        data = self._data
+        if self._position == 0:
+            if len(data) < 2:
+                return 2 - len(data)
+            elif data[:2] != struct.pack('>H', segment_markers.SOI.marker):
+                return 0  # Not a JPEG file; JpegFile will report it.
+            self._position = 2
+
+        while True:
+            position = self._position
+            if position + 2 > len(data):
+                return position + 2 - len(data)
+
+            b1, b2 = data[position], data[position + 1]
+            if b1 == 0xff and b2 == 0xff:
+                # Skip fill bytes
+                self._position += 1
+                continue
+            elif b1 != 0xff or b2 == 0x00:
+                # Not a marker; scan for the next one, keeping the last byte in case it starts a marker.
+                match = scanner.MARKER_PATTERN.search(data, position)
+                if match is None:
+                    self._position = len(data) - 1
+                    return 1
+                self._position = match.start()
+                continue
+
+            marker = b1 << 8 | b2
+            if marker == segment_markers.EOI.marker:
+                self._complete = True
+                return 0
+            elif segment_markers.get_segment_marker(marker) in segment_markers.STANDALONE_MARKERS:
+                self._position += 2
+                continue
+            elif position + 4 > len(data):
+                return position + 4 - len(data)
+            elif marker == segment_markers.SOS.marker:
+                return 0
+
+            segment_end = position + 2 + struct.unpack_from('>H', data, position + 2)[0]
+            if segment_end > len(data):
+                return segment_end - len(data)
+            self._position = segment_end
+
+
+def _read_header(stream: BinaryIO, limits=None):
+    """ Read a stream until its JPEG header is complete, or the stream ends. """
+    parser = JpegPrefixParser(limits)
+    while not parser.done:
+        chunk = stream.read(max(parser.bytes_needed, STREAM_CHUNK_SIZE))
+        if not chunk:
+            break
+        parser.feed(chunk)
+    return parser.data
+
+
+def _is_ifd_revisit(ifd_pointer, ifd0_pointer, sub_ifd_pointers):
+    """ Whether an IFD0 pointer tag leads back to IFD0, or to the same IFD as another pointer tag. Such an IFD is
+    skipped rather than read again as something else.
+    """
+    return ifd_pointer == ifd0_pointer or sum(pointer == ifd_pointer for pointer in sub_ifd_pointers) > 1
+
+
+def _decoder_executor(workers):
+    """ A process pool to decode restart intervals in, or (with a single worker) a context that gives None. """
+    if workers is None or workers > 1:
+        import concurrent.futures
+        return concurrent.futures.ProcessPoolExecutor(workers)
+    return contextlib.nullcontext()
+
+
+def _write_pieces(buffer, pieces, destination: BinaryIO, source: BinaryIO = None):
+    """ Write what JpegFile._get_stripped_pieces gives, copying ranges from `source` in the kernel if it is given
+    (along with an unbuffered destination file), and from the buffer otherwise. Returns the number of bytes written.
+    """
+    written = 0
+    for piece in _merge_ranges(pieces):
+        if isinstance(piece, tuple):
+            start, end = piece
+            if source is not None:
+                start += rewrite.copy_range(source.fileno(), destination.fileno(), start, end - start)
+            with buffer[start:end] as view:
+                _write_all(destination, view)
+            written += piece[1] - piece[0]
+        else:
+            _write_all(destination, piece)
+            written += len(piece)
+    return written
+
+
+def _merge_ranges(pieces):
+    """ Merge ranges that follow each other, so that they are copied at once. """
+    merged = list()
+    for piece in pieces:
+        if merged and isinstance(piece, tuple) and isinstance(merged[-1], tuple) and merged[-1][1] == piece[0]:
+            merged[-1] = (merged[-1][0], piece[1])
+        else:
+            merged.append(piece)
+    return merged
+
+
+def _write_all(destination: BinaryIO, data):
+    """ Write all of the data; unbuffered files may write only part of it at a time. """
+    with memoryview(data) as view:
+        while view:
+            written = destination.write(view)
+            view = view[written:] if written is not None else view[len(view):]
+
+
+def _is_mappable(stream: BinaryIO):
+    """ Only seekable streams backed by a file descriptor, positioned at the start, can be mapped in place. """
+    # noinspection PyBroadException
+    try:
+        return stream.seekable() and stream.tell() == 0 and stream.fileno() >= 0
+    except Exception:
+        return False
+
+
+def _map_file(file: BinaryIO):
+    """ Memory-map a file for reading. Returns None for files that can't be mapped (e.g. empty files). """
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        return None
+
+
+def scan_file(file_path, full_scan=False, tags=None, cache=None, instrument=False, limits=None, hash_scan=False,
+              hash_tables=False):
+    """ Read a file into a ScanResult. Errors, including a LimitExceeded from `limits` (a ReadLimits), are captured
+    in the result instead of being raised.
+
+    If a FileCache is given, unchanged files are served from it, and successful reads are stored in it. If `instrument`
+    is set, the result's `stats` hold a ReadStats for the read (files served from the cache have none). With
+    `hash_scan`, the result's `scan_hash` is set; see JpegFile for it and `hash_tables`.
+    """
+    if cache is not None:
+        options = _cache_options(full_scan, tags, hash_scan, hash_tables)
+        result, fingerprint = _read_cache(cache, file_path, options)
+        if result is None:
+            result = scan_file(file_path, full_scan=full_scan, tags=tags, instrument=instrument, limits=limits,
+                               hash_scan=hash_scan, hash_tables=hash_tables)
+            _write_cache(cache, result, fingerprint, options)
+        return result
+
+    stats = instrumentation.ReadStats() if instrument else None
+    # noinspection PyBroadException
+    try:
+        with JpegFile(file_path, full_scan=full_scan, tags=tags, stats=stats, limits=limits, hash_scan=hash_scan,
+                      hash_tables=hash_tables) as jpeg_file:
+            return jpeg_file.detach()._replace(file_path=file_path)
+    except Exception:
+        import traceback
+        return ScanResult(file_path, None, None, None, None, error=traceback.format_exc(), stats=stats)
+
+
+def scan_files(file_paths, workers=None, use_threads=False, max_in_flight=None, full_scan=False, tags=None,
+               cache=None, instrument=False, limits=None, hash_scan=False, hash_tables=False):
+    """ Read many files in parallel, yielding a ScanResult for each one in the order they finish.
+
+    Files are spread across a pool of `workers` processes (the CPU count by default), or threads when `use_threads` is
+    set, which suits storage where I/O latency rather than parsing is the bottleneck. At most `max_in_flight` files are
+    queued at once (4 per worker by default), so `file_paths` can be a lazy iterable over millions of files.
+
+    If a FileCache is given, it is checked (and updated) from the calling thread, so unchanged files are never sent to
+    the pool; the cache's hits and misses count how many files were served from it.
+
+    If `instrument` is set, each result carries a ReadStats, which is also passed to the hooks registered with
+    utils.instrumentation.add_hook as the result is yielded.
+
+    Pass a ReadLimits as `limits` so that no single corrupt or hostile file can tie up a worker; files that hit a
+    limit get a result with an error.
+
+    With `hash_scan`, each result's `scan_hash` is set, so files with the same compressed pixels can be grouped; see
+    JpegFile for it and `hash_tables`.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    options = _cache_options(full_scan, tags, hash_scan, hash_tables)
+
+    def _jobs():
+        for file_path in file_paths:
+            fingerprint = None
+            if cache is not None:
+                cached_result, fingerprint = _read_cache(cache, file_path, options)
+                if cached_result is not None:
+                    yield _Ready(cached_result)
+                    continue
+            yield fingerprint, file_path, full_scan, tags, None, instrument, limits, hash_scan, hash_tables
+
+    for value in _imap_unordered(_scan_file_job, _jobs(), workers, use_threads, max_in_flight):
+        if isinstance(value, ScanResult):
+            # Served from the cache
+            yield value
+            continue
+
+        result, fingerprint = value
+        if workers > 1 and not use_threads:
+            result = _intern_tag_names(result)
+        if cache is not None:
+            _write_cache(cache, result, fingerprint, options)
+        yield _emit_stats(result)
+
+
+def _scan_file_job(fingerprint, *args):
+    """ Call scan_file in a worker for scan_files, passing back the fingerprint the file had when it was queued. """
+    return scan_file(*args), fingerprint
+
+
+async def async_scan_files(file_paths, max_in_flight=32, full_scan=False, tags=None, executor=None, instrument=False,
+                           limits=None, hash_scan=False, hash_tables=False):
+    """ Read many files without blocking the event loop, yielding a ScanResult for each one in the order they finish.
+
+    Files are read in `executor` (the loop's default executor if None), with at most `max_in_flight` in flight at once.
+    Pass a dedicated executor to keep a slow disk from tying up the threads that other tasks rely on. See scan_files for
+    `instrument`, `limits`, `hash_scan` and `hash_tables`.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    pending = set()
+    for file_path in file_paths:
+        pending.add(loop.run_in_executor(
+            executor, scan_file, file_path, full_scan, tags, None, instrument, limits, hash_scan, hash_tables))
+        if len(pending) >= max_in_flight:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield _emit_stats(_intern_tag_names(future.result()))
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            yield _emit_stats(_intern_tag_names(future.result()))
+
+
+def scan_directory(directory, recursive=False, **kwargs):
+    """ Read every JPEG file in a directory in parallel; see scan_files for the keyword arguments. """
+    return scan_files(iter_jpeg_files(directory, recursive=recursive), **kwargs)
+
+
+def iter_jpeg_files(directory, recursive=False):
+    """ Yield the path of each JPEG file in a directory. Like os.walk, subdirectories that can't be read are skipped.
+    """
+    directories = [directory]
+    while directories:
+        current_directory = directories.pop()
+        try:
+            entries = os.scandir(current_directory)
+        except OSError:
+            if current_directory is directory:
+                raise
+            continue
+
+        with entries:
+            for entry in entries:
+                if recursive and entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.name.lower().endswith(JPEG_EXTENSIONS) and entry.is_file():
+                    yield entry.path
+
+
+def extract_thumbnail(file_path, output_path):
+    """ Write the embedded thumbnail of a JPEG file to output_path, creating its directory if needed. Errors are
+    captured in the result instead of being raised. Files without a thumbnail get an output_path of None.
+    """
+    # noinspection PyBroadException
+    try:
+        with JpegFile(file_path) as jpeg_file:
+            if jpeg_file.thumbnail_location is None:
+                return ThumbnailResult(file_path, None, None, error=None)
+            os.makedirs(os.path.dirname(output_path) or os.curdir, exist_ok=True)
+            length = jpeg_file.write_thumbnail(output_path)
+            return ThumbnailResult(file_path, output_path, length, error=None)
+    except Exception:
+        import traceback
+        return ThumbnailResult(file_path, None, None, error=traceback.format_exc())
+
+
+def verify_file(file_path, deep=False):
+    """ Check that a file is complete and well-formed (see JpegFile.verify), without reading anything else. Only the
+    pages of the file that are checked are read, so a quick check costs little more than a stat. Errors reading the
+    file are captured in the result instead of being raised.
+    """
+    # noinspection PyBroadException
+    try:
+        with open(file_path, 'rb') as f:
+            data = _map_file(f) if _is_mappable(f) else None
+            if data is None:
+                # Empty files can't be mapped
+                data = f.read()
+        try:
+            status, offset, detail = integrity.verify_buffer(data, deep=deep)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        return VerifyResult(file_path, status, offset, detail, error=None)
+    except Exception:
+        import traceback
+        return VerifyResult(file_path, None, None, None, error=traceback.format_exc())
+
+
+def verify_files(file_paths, deep=False, workers=None, use_threads=False, max_in_flight=None):
+    """ Check many files in parallel (see verify_file), yielding a VerifyResult for each one in the order they finish.
+    See scan_files for the keyword arguments. Quick checks mostly wait on the disk, so threads usually suit them best.
+    """
+    jobs = ((file_path, deep) for file_path in file_paths)
+    return _imap_unordered(verify_file, jobs, workers, use_threads, max_in_flight)
+
+
+def strip_file(file_path, output_path, drop_segments=(), drop_tags=rewrite.PRIVATE_TAGS):
+    """ Write a copy of a JPEG file to output_path without some of its metadata (see JpegFile.write_stripped), creating
+    its directory if needed. Errors are captured in the result instead of being raised; nothing is left at output_path
+    if the copy couldn't be written.
+    """
+    # noinspection PyBroadException
+    try:
+        with JpegFile(file_path) as jpeg_file:
+            os.makedirs(os.path.dirname(output_path) or os.curdir, exist_ok=True)
+            try:
+                length = jpeg_file.write_stripped(output_path, drop_segments=drop_segments, drop_tags=drop_tags)
+            except BaseException:
+                if os.path.exists(output_path) and not os.path.samefile(file_path, output_path):
+                    os.remove(output_path)
+                raise
+        return StripResult(file_path, output_path, length, error=None)
+    except Exception:
+        import traceback
+        return StripResult(file_path, None, None, error=traceback.format_exc())
+
+
+def strip_files(directory, output_directory, recursive=False, workers=None, use_threads=False, max_in_flight=None,
+                drop_segments=(), drop_tags=rewrite.PRIVATE_TAGS):
+    """ Write a copy of every JPEG file in a directory to output_directory without some of its metadata (see
+    JpegFile.write_stripped) in parallel, yielding a StripResult for each file in the order they finish. Each copy
+    keeps the name, and relative path, of the file it came from. See scan_files for the keyword arguments.
+    output_directory can't be directory itself, or be inside it when it is read recursively.
+    """
+    _check_output_directory(directory, output_directory, recursive, 'stripped files')
+    jobs = (
+        (file_path, os.path.join(output_directory, os.path.relpath(file_path, directory)), drop_segments, drop_tags)
+        for file_path in iter_jpeg_files(directory, recursive=recursive))
+    return _imap_unordered(strip_file, jobs, workers, use_threads, max_in_flight)
+
+
+def extract_thumbnails(directory, output_directory, recursive=False, workers=None, use_threads=False,
+                       max_in_flight=None):
+    """ Write the embedded thumbnail of every JPEG file in a directory to output_directory in parallel, yielding a
+    ThumbnailResult for each file in the order they finish. Each thumbnail keeps the name, and relative path, of the
+    file it came from. See scan_files for the keyword arguments. output_directory can't be directory itself, or be
+    inside it when it is read recursively.
+    """
+    _check_output_directory(directory, output_directory, recursive, 'thumbnails')
+    jobs = (
+        (file_path, os.path.join(output_directory, os.path.relpath(file_path, directory)))
+        for file_path in iter_jpeg_files(directory, recursive=recursive))
+    return _imap_unordered(extract_thumbnail, jobs, workers, use_threads, max_in_flight)
+
+
+def _check_output_directory(directory, output_directory, recursive, description):
+    """ Raise ValueError if files written to output_directory would overwrite the files in directory or, when it is
+    read recursively, be read from it again.
+    """
+    real_directory = os.path.realpath(directory)
+    real_output_directory = os.path.realpath(output_directory)
+    if real_output_directory == real_directory:
+        raise ValueError(f"Writing {description} to {output_directory} would overwrite the files they come from")
+    elif recursive and os.path.commonpath([real_directory, real_output_directory]) == real_directory:
+        raise ValueError(f"Writing {description} to {output_directory}, inside {directory}, would read them back in")
+
+
+def _imap_unordered(fn, arguments, workers=None, use_threads=False, max_in_flight=None):
+    """ Call fn(*args) for each tuple of arguments, in a pool of `workers` processes (the CPU count by default) or
+    threads, yielding the return values in the order they finish. At most `max_in_flight` calls (4 per worker by
+    default) are queued at once, so `arguments` can be a lazy iterable over millions of items. An item may also be a
+    _Ready, whose value is yielded as it is, without calling fn.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = workers * 4
+
+    if workers <= 1:
+        for args in arguments:
+            yield args.value if isinstance(args, _Ready) else fn(*args)
+        return
+
+    import concurrent.futures
+    executor_class = concurrent.futures.ThreadPoolExecutor if use_threads else concurrent.futures.ProcessPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        pending = set()
+        for args in arguments:
+            if isinstance(args, _Ready):
+                yield args.value
+                continue
+            pending.add(executor.submit(fn, *args))
+            if len(pending) >= max_in_flight:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+def _intern_tag_names(result: ScanResult):
+    """ Share the tag name strings in a result's metadata, and short string values (e.g. Make, Model), with every other
+    result. Unpickled results (from worker processes, or the cache) would otherwise each hold their own copies.
+    """
+    if not result.metadata:
+        return result
+    metadata = dict()
+    for tag_name, value in result.metadata.items():
+        if isinstance(value, str) and len(value) <= INTERNED_VALUE_LENGTH:
+            value = sys.intern(value)
+        metadata[sys.intern(tag_name)] = value
+    return result._replace(metadata=metadata)
+
+
+def _emit_stats(result: ScanResult):
+    """ Pass an instrumented result's stats to the registered hooks. """
+    if result.stats is not None:
+        instrumentation.emit(result.file_path, result.stats)
+    return result
+
+
+def _read_cache(cache, file_path, options):
+    """ Look a file up in the cache. Returns the cached ScanResult (or None), and the file's current fingerprint. """
+    from utils.cache import get_fingerprint
+    try:
+        fingerprint = get_fingerprint(file_path)
+    except OSError:
+        # The file can't be read; let scan_file report it.
+        return None, None
+
+    value = cache.get(os.path.abspath(file_path), fingerprint, options=options)
+    if value is None:
+        return None, fingerprint
+
+    # Cached values only hold builtin types, so that they can be loaded no matter which module defines ScanResult.
+    # Entries written before scan hashes were added have no hash; they were never read with hash_scan.
+    resolution, pixel_aspect, segments, metadata = value[:4]
+    scan_hash = value[4] if len(value) > 4 else None
+    result = ScanResult(
+        file_path, resolution, pixel_aspect, SegmentTable(segments), metadata, error=None, scan_hash=scan_hash)
+    return _intern_tag_names(result), fingerprint
+
+
+def _write_cache(cache, result: ScanResult, fingerprint, options):
+    """ Store a ScanResult in the cache. Errors aren't cached, since they may not happen next time. """
+    if result.error is not None or fingerprint is None:
+        return
+
+    value = (result.resolution, result.pixel_aspect, result.segments.pairs(), result.metadata, result.scan_hash)
+    cache.put(os.path.abspath(result.file_path), fingerprint, value, options=options)
+
+
+def _cache_options(full_scan, tags, hash_scan=False, hash_tables=False):
+    """ Cache entries depend on how the file was read. The hash options are only included when set, so that entries
+    written before they existed are still found.
+    """
+    tags = None if tags is None else sorted(tags)
+    options = f"full_scan={full_scan};tags={tags}"
+    if hash_scan:
+        options += f";hash_scan=True;hash_tables={bool(hash_tables)}"
+    return options
+
+
+def print_file_info(file_path, stats=None, limits=None, hash_scan=False, full_scan=False):
     """ Print out information about a jpeg file. """
     print(f"reading {file_path}")
-    jpeg_file = JpegFile(file_path)
-    resolution = f"{jpeg_file.resolution[0]} x {jpeg_file.resolution[1]}"
-    if jpeg_file.pixel_aspect is not None:
-        resolution = f"{resolution} ({jpeg_file.pixel_aspect} PAR)"
+    with JpegFile(file_path, full_scan=full_scan, stats=stats, limits=limits, hash_scan=hash_scan) as jpeg_file:
+        _print_info(jpeg_file.resolution, jpeg_file.pixel_aspect, jpeg_file.metadata, jpeg_file.scan_hash)
+
+
+def print_scan_result(result: ScanResult):
+    """ Print out information about a jpeg file from a ScanResult. """
+    print(f"reading {result.file_path}")
+    if result.error is not None:
+        print(result.error)
+    else:
+        _print_info(result.resolution, result.pixel_aspect, result.metadata, result.scan_hash)
+
+
+def print_verify_result(result: VerifyResult):
+    if result.error is not None:
+        print(f"reading {result.file_path}")
+        print(result.error)
+    elif result.detail is None:
+        print(f"{result.file_path}: {result.status}")
+    else:
+        print(f"{result.file_path}: {result.status} ({result.detail})")
+
+
+def print_strip_result(result: StripResult):
+    if result.error is not None:
+        print(f"reading {result.file_path}")
+        print(result.error)
+    else:
+        print(f"{result.file_path} -> {result.output_path} ({result.length} bytes)")
+
+
+def print_thumbnail_result(result: ThumbnailResult):
+    if result.error is not None:
+        print(f"reading {result.file_path}")
+        print(result.error)
+    elif result.output_path is None:
+        print(f"{result.file_path}: no thumbnail")
+    else:
+        print(f"{result.file_path} -> {result.output_path} ({result.length} bytes)")
+
+
+def _print_info(resolution, pixel_aspect, metadata, scan_hash=None):
+    resolution = f"{resolution[0]} x {resolution[1]}"
+    if pixel_aspect is not None:
+        resolution = f"{resolution} ({pixel_aspect} PAR)"
     print(f"resolution: {resolution}")
-    print(f"metadata: {pprint.pformat(jpeg_file.metadata, compact=False)}")
+    if scan_hash is not None:
+        print(f"scan hash: {scan_hash}")
+    import pprint
+    print(f"metadata: {pprint.pformat(metadata, compact=False)}")
     print("\n")
 
 
+def main(argv=None):
+    # Imported here, like everything else that only some uses need, to keep startup fast.
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Print information about a JPEG file, or about every JPEG file in a directory.")
+    parser.add_argument('path', nargs='?', help="JPEG file or directory")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Include subdirectories")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Number of files to read in parallel (default: CPU count)")
+    parser.add_argument('--threads', action='store_true', help="Use threads instead of processes")
+    parser.add_argument('--full-scan', action='store_true', help="Walk the entropy-coded data to EOI")
+    parser.add_argument('--hash-scan', action='store_true',
+                        help="Hash the compressed image data, to find files that only differ in their metadata")
+    parser.add_argument('--cache', metavar='DB_PATH', help="Cache results in this SQLite database")
+    parser.add_argument('--stats', action='store_true', help="Print where the time went, and the I/O done, to stderr")
+    parser.add_argument('--thumbnails', metavar='OUTPUT',
+                        help="Write embedded thumbnails to this file (or directory, when reading a directory) instead")
+    parser.add_argument('--strip', metavar='OUTPUT',
+                        help="Instead of printing information, write copies without GPS data and maker notes to this "
+                             "file (or directory, when reading a directory)")
+    parser.add_argument('--verify', action='store_true',
+                        help="Instead of printing information, check that files are complete and well-formed")
+    parser.add_argument('--deep', action='store_true',
+                        help="With --verify, walk all of the image data, and check the order of the RST markers")
+    parser.add_argument('--limits', action='store_true',
+                        help="Apply the default ReadLimits, so that corrupt or hostile files fail fast")
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help="Instead of reading a path, answer queries on this Unix socket until interrupted; "
+                             "see utils/daemon_client.py")
+    args = parser.parse_args(argv)
+
+    limits = ReadLimits() if args.limits else None
+    if args.serve is not None:
+        import signal
+        from utils import daemon
+        # Stop on SIGTERM the same way as on Ctrl+C, so that the socket is removed.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            daemon.serve(args.serve, workers=args.workers, limits=limits)
+        except KeyboardInterrupt:
+            pass
+        return
+    elif args.path is None:
+        parser.error("the following arguments are required: path")
+
+    stats = instrumentation.ReadStats() if args.stats else None
+    if args.verify:
+        if os.path.isdir(args.path):
+            file_paths = iter_jpeg_files(args.path, recursive=args.recursive)
+        else:
+            file_paths = [args.path]
+        for result in verify_files(file_paths, deep=args.deep, workers=args.workers, use_threads=args.threads):
+            print_verify_result(result)
+    elif args.strip is not None and os.path.isfile(args.path):
+        print_strip_result(strip_file(args.path, args.strip))
+    elif args.strip is not None:
+        results = strip_files(
+            args.path,
+            args.strip,
+            recursive=args.recursive,
+            workers=args.workers,
+            use_threads=args.threads)
+        for result in results:
+            print_strip_result(result)
+    elif args.thumbnails is not None and os.path.isfile(args.path):
+        print_thumbnail_result(extract_thumbnail(args.path, args.thumbnails))
+    elif args.thumbnails is not None:
+        results = extract_thumbnails(
+            args.path,
+            args.thumbnails,
+            recursive=args.recursive,
+            workers=args.workers,
+            use_threads=args.threads)
+        for result in results:
+            print_thumbnail_result(result)
+    elif os.path.isfile(args.path) and args.cache is None:
+        print_file_info(args.path, stats=stats, limits=limits, hash_scan=args.hash_scan, full_scan=args.full_scan)
+    elif os.path.isfile(args.path) or os.path.isdir(args.path):
+        cache = None
+        if args.cache is not None:
+            from utils.cache import FileCache
+            cache = FileCache(args.cache)
+        if os.path.isfile(args.path):
+            results = [scan_file(
+                args.path,
+                full_scan=args.full_scan,
+                cache=cache,
+                instrument=args.stats,
+                limits=limits,
+                hash_scan=args.hash_scan)]
+        else:
+            results = scan_directory(
+                args.path,
+                recursive=args.recursive,
+                workers=args.workers,
+                use_threads=args.threads,
+                full_scan=args.full_scan,
+                cache=cache,
+                instrument=args.stats,
+                limits=limits,
+                hash_scan=args.hash_scan)
+        for result in results:
+            print_scan_result(result)
+            if result.stats is not None:
+                stats.merge(result.stats)
+
+        if cache is not None:
+            cache.close()
+            print(f"cache: {cache.hits} hits, {cache.misses} misses ({cache.hit_rate:.1%} hit rate)", file=sys.stderr)
+
+    if stats is not None:
+        print(stats, file=sys.stderr)
+
+
 if __name__ == "__main__":
-    p = sys.argv[1]
-    if os.path.isfile(p):
-        print_file_info(p)
-    elif os.path.isdir(p):
-        for item in os.listdir(p):
-            if item.endswith(('.jpg', '.jpeg', '.JPG', '.JPEG')):
-                fp = os.path.join(p, item)
-                # noinspection PyBroadException
-                try:
-                    print_file_info(fp)
-                except Exception:
-                    print(traceback.format_exc())
+    main()
@@ -0,0 +1,38 @@
+import os
+import shutil
+import struct
+
+import pytest
+
+
+TEST_IMAGES_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_images')
+TEST_IMAGE_NAMES = sorted(name for name in os.listdir(TEST_IMAGES_DIRECTORY) if name.endswith('.jpg'))
+
+
+def make_segment(marker, payload):
+    """ A segment with the given marker code and payload, preceded by its length. """
+    return struct.pack('>2H', marker, len(payload) + 2) + payload
+
+
+@pytest.fixture
+def read_test_image():
+    """ Read a file from test_images/ by name. """
+    def _read_test_image(name):
+        with open(os.path.join(TEST_IMAGES_DIRECTORY, name), 'rb') as f:
+            return f.read()
+    return _read_test_image
+
+
+@pytest.fixture(params=TEST_IMAGE_NAMES)
+def test_image_path(request):
+    """ The path of each file in test_images/ in turn. """
+    return os.path.join(TEST_IMAGES_DIRECTORY, request.param)
+
+
+@pytest.fixture
+def jpeg_directory(tmp_path):
+    """ A directory holding a copy of every file in test_images/, and another copy in a subdirectory. """
+    directory = tmp_path / 'images'
+    shutil.copytree(TEST_IMAGES_DIRECTORY, directory)
+    shutil.copytree(TEST_IMAGES_DIRECTORY, directory / 'nested')
+    return directory
@@ -0,0 +1,29 @@
+import asyncio
+import collections
+import concurrent.futures
+
+from jpeg_reader import JpegFile
+from jpeg_reader import async_scan_files
+from jpeg_reader import iter_jpeg_files
+from jpeg_reader import scan_file
+
+
+def test_aopen(test_image_path):
+    jpeg_file = asyncio.run(JpegFile.aopen(test_image_path))
+    # Everything was read before the file was closed
+    assert jpeg_file.closed
+    with JpegFile(test_image_path) as expected:
+        assert (jpeg_file.resolution, jpeg_file.pixel_aspect, jpeg_file.metadata) == (
+            expected.resolution, expected.pixel_aspect, expected.metadata)
+
+
+def test_async_scan_files(jpeg_directory):
+    file_paths = sorted(iter_jpeg_files(str(jpeg_directory), recursive=True))
+
+    async def scan(executor):
+        return [result async for result in async_scan_files(file_paths, max_in_flight=3, executor=executor)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        results = asyncio.run(scan(executor))
+    assert collections.Counter(result.file_path for result in results) == collections.Counter(file_paths)
+    assert all(result == scan_file(result.file_path) for result in results)
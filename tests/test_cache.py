@@ -0,0 +1,62 @@
+from jpeg_reader import iter_jpeg_files
+from jpeg_reader import scan_file
+from jpeg_reader import scan_files
+from utils.cache import FileCache
+from utils.cache import get_fingerprint
+
+
+def test_scan_file(tmp_path, read_test_image):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(read_test_image('img_photoshop.jpg'))
+    with FileCache(str(tmp_path / 'cache.db')) as cache:
+        result = scan_file(str(path), cache=cache)
+        assert scan_file(str(path), cache=cache) == result
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # Entries depend on how the file was read
+        full_scan_result = scan_file(str(path), full_scan=True, cache=cache)
+        assert full_scan_result != result
+        assert scan_file(str(path), full_scan=True, cache=cache) == full_scan_result
+        assert (cache.hits, cache.misses) == (2, 2)
+
+        # A changed file is read again
+        path.write_bytes(read_test_image('img_natron.jpg'))
+        assert scan_file(str(path), cache=cache) == scan_file(str(path))
+        assert (cache.hits, cache.misses) == (2, 3)
+
+    # Entries persist once the cache is closed
+    with FileCache(str(tmp_path / 'cache.db')) as cache:
+        assert scan_file(str(path), cache=cache) == scan_file(str(path))
+        assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_errors_are_not_cached(tmp_path):
+    path = tmp_path / 'not_a_jpeg.jpg'
+    path.write_bytes(b'not a jpeg file')
+    with FileCache(str(tmp_path / 'cache.db')) as cache:
+        for _ in range(2):
+            assert scan_file(str(path), cache=cache).error is not None
+        assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_eviction(tmp_path):
+    path = tmp_path / 'file'
+    path.write_bytes(b'')
+    fingerprint = get_fingerprint(str(path))
+    with FileCache(str(tmp_path / 'cache.db'), max_bytes=10000) as cache:
+        for x in range(100):
+            cache.put(f'file_{x}', fingerprint, bytes(500))
+        assert cache.total_bytes <= 10000
+        # The least recently used entries went first
+        assert cache.get('file_0', fingerprint) is None
+        assert cache.get('file_99', fingerprint) == bytes(500)
+
+
+def test_scan_files(jpeg_directory, tmp_path):
+    file_paths = sorted(iter_jpeg_files(str(jpeg_directory), recursive=True))
+    with FileCache(str(tmp_path / 'cache.db')) as cache:
+        first_pass = sorted(scan_files(file_paths, workers=2, use_threads=True, cache=cache))
+        second_pass = sorted(scan_files(file_paths, workers=2, use_threads=True, cache=cache))
+        assert [result.file_path for result in first_pass] == file_paths
+        assert second_pass == first_pass
+        assert (cache.hits, cache.misses) == (len(file_paths), len(file_paths))
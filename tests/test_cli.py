@@ -0,0 +1,28 @@
+from jpeg_reader import main
+
+
+def test_single_file_full_scan(read_test_image, tmp_path, capsys):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(read_test_image('img_photoshop.jpg'))
+    main([str(path), '--stats'])
+    header_only = capsys.readouterr()
+    main([str(path), '--stats', '--full-scan'])
+    full_scan = capsys.readouterr()
+
+    assert full_scan.out == header_only.out
+    assert f"bytes scanned: {path.stat().st_size}" in full_scan.err
+    assert f"bytes scanned: {path.stat().st_size}" not in header_only.err
+
+
+def test_single_file_cache(read_test_image, tmp_path, capsys):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(read_test_image('img_photoshop.jpg'))
+    cache_path = tmp_path / 'cache.db'
+    main([str(path), '--cache', str(cache_path)])
+    first = capsys.readouterr()
+    main([str(path), '--cache', str(cache_path)])
+    second = capsys.readouterr()
+
+    assert second.out == first.out
+    assert "0 hits, 1 misses" in first.err
+    assert "1 hits, 0 misses" in second.err
@@ -0,0 +1,50 @@
+import concurrent.futures
+import json
+import os
+
+import pytest
+
+from jpeg_reader import scan_file
+from utils import daemon
+
+
+def test_answer(tmp_path, read_test_image):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(read_test_image('img_natron.jpg'))
+    paths = [str(path), str(tmp_path / 'missing.jpg'), str(path)]
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        response = daemon.answer({'paths': paths, 'tags': ['Orientation', 'ExifVersion']}, executor)
+
+    # A result for each path, in order
+    results = json.loads(json.dumps(response, default=str))['results']
+    assert [result['file_path'] for result in results] == paths
+    assert results[0] == results[2]
+    assert results[0]['resolution'] == [12, 3]
+    assert results[0]['metadata'] == {'Orientation': 1, 'ExifVersion': '0220'}
+    expected_segments = scan_file(str(path)).segments
+    assert results[0]['segments'] == [[segment.marker.code, segment.offset] for segment in expected_segments]
+    assert results[0]['error'] is None
+    assert results[1]['error'] is not None and results[1]['resolution'] is None
+
+
+def test_full_scan(read_test_image, tmp_path):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(read_test_image('img_paint.jpg'))
+    header = daemon.answer({'paths': [str(path)]})['results'][0]
+    full_scan = daemon.answer({'paths': [str(path)], 'full_scan': True})['results'][0]
+    assert full_scan['segments'][:len(header['segments'])] == header['segments']
+    assert full_scan['segments'][-1][1] == os.path.getsize(path) - 2
+
+
+@pytest.mark.parametrize('request_', [
+    {},
+    [],
+    {'paths': 'photo.jpg'},
+    {'paths': ['photo.jpg', 1]},
+    {'paths': ['photo.jpg'], 'tags': 'Orientation'},
+    {'paths': ['photo.jpg'], 'tags': [None]},
+])
+def test_malformed_requests(request_):
+    response = daemon.answer(request_)
+    assert list(response) == ['error']
+    assert response['error'].startswith('Bad request')
@@ -0,0 +1,201 @@
+""" Decoder tests, against files made by a minimal baseline encoder: Huffman tables with a 4-bit code for each symbol,
+a quantization table of ones, and only the leading run of nonzero AC coefficients of each block.
+"""
+import concurrent.futures
+import math
+import struct
+
+import pytest
+
+from conftest import make_segment
+from jpeg_reader import JpegFile
+from utils import decoder
+from utils import segment_markers
+
+numpy = pytest.importorskip('numpy')
+
+
+# Zigzag position -> (row, column) of the coefficient in its 8x8 block
+ZIGZAG_POSITIONS = sorted(
+    ((row, column) for row in range(8) for column in range(8)),
+    key=lambda p: (p[0] + p[1], p[0] if (p[0] + p[1]) % 2 else p[1]))
+
+
+class BitWriter:
+    def __init__(self):
+        self.bits = list()
+
+    def write(self, value, length):
+        self.bits.extend((value >> (length - 1 - x)) & 1 for x in range(length))
+
+    def flush(self):
+        """ Pad to a byte with 1 bits, and return the bytes written so far, with 0xff bytes stuffed. """
+        self.bits.extend([1] * (-len(self.bits) % 8))
+        data = bytearray()
+        for x in range(0, len(self.bits), 8):
+            data.append(int(''.join(map(str, self.bits[x:x + 8])), 2))
+            if data[-1] == 0xff:
+                data.append(0x00)
+        self.bits = list()
+        return bytes(data)
+
+
+def _write_value(writer, value):
+    """ Write a coefficient as its size category (a 4-bit code, for the symbol equal to it) and its extra bits. """
+    size = abs(value).bit_length()
+    writer.write(size, 4)
+    writer.write(value if value >= 0 else value + (1 << size) - 1, size)
+
+
+def encode(blocks, width, height, sampling, restart_interval=0):
+    """ Encode the coefficient blocks of each component (arrays shaped (block rows, block columns, 64), in zigzag
+    order) as a baseline JPEG file.
+    """
+    max_h = max(h for h, _ in sampling)
+    max_v = max(v for _, v in sampling)
+    mcus_x = -(-width // (8 * max_h))
+    mcus_y = -(-height // (8 * max_v))
+
+    components = b''.join(bytes([x + 1, h << 4 | v, 0]) for x, (h, v) in enumerate(sampling))
+    # DC symbols 0-11 and AC symbols 0x00 (EOB) and 0x01-0x0a (no zeros before a value of size 1-10), 4 bits each
+    dc_table = b'\x00' + bytes([0, 0, 0, 12] + [0] * 12) + bytes(range(12))
+    ac_table = b'\x10' + bytes([0, 0, 0, 11] + [0] * 12) + bytes(range(11))
+    scan_components = b''.join(bytes([x + 1, 0x00]) for x in range(len(sampling)))
+    scan_header = bytes([len(sampling)]) + scan_components + b'\x00\x3f\x00'
+    parts = [
+        b'\xff\xd8',
+        make_segment(0xffdb, b'\x00' + bytes([1] * 64)),
+        make_segment(0xffc0, struct.pack('>B2HB', 8, height, width, len(sampling)) + components),
+        make_segment(0xffc4, dc_table),
+        make_segment(0xffc4, ac_table),
+    ]
+    if restart_interval:
+        parts.append(make_segment(0xffdd, struct.pack('>H', restart_interval)))
+    parts.append(make_segment(0xffda, scan_header))
+
+    writer = BitWriter()
+    predictions = [0] * len(sampling)
+    for mcu in range(mcus_x * mcus_y):
+        if restart_interval and mcu and mcu % restart_interval == 0:
+            parts.append(writer.flush())
+            parts.append(struct.pack('>H', 0xffd0 + (mcu // restart_interval - 1) % 8))
+            predictions = [0] * len(sampling)
+        mcu_y, mcu_x = divmod(mcu, mcus_x)
+        for c, (h, v) in enumerate(sampling):
+            for y in range(v):
+                for x in range(h):
+                    block = [int(value) for value in blocks[c][mcu_y * v + y, mcu_x * h + x]]
+                    _write_value(writer, block[0] - predictions[c])
+                    predictions[c] = block[0]
+
+                    ac_values = block[1:]
+                    count = next((k for k, value in enumerate(ac_values) if value == 0), 63)
+                    assert not any(ac_values[count:]), "Only a leading run of AC values can be encoded"
+                    for value in ac_values[:count]:
+                        _write_value(writer, value)
+                    if count < 63:
+                        writer.write(0, 4)
+    parts.append(writer.flush())
+    parts.append(b'\xff\xd9')
+    return b''.join(parts)
+
+
+def random_blocks(width, height, sampling, ac_count, seed=0):
+    """ Random coefficient blocks for each component of a frame, with `ac_count` nonzero AC values each. """
+    rng = numpy.random.default_rng(seed)
+    max_h = max(h for h, _ in sampling)
+    max_v = max(v for _, v in sampling)
+    mcus_x = -(-width // (8 * max_h))
+    mcus_y = -(-height // (8 * max_v))
+    component_blocks = list()
+    for h, v in sampling:
+        blocks = numpy.zeros((mcus_y * v, mcus_x * h, 64), dtype=numpy.int32)
+        blocks[:, :, 0] = rng.integers(-400, 400, size=blocks.shape[:2])
+        ac_values = rng.integers(1, 12, size=blocks.shape[:2] + (ac_count, ))
+        blocks[:, :, 1:1 + ac_count] = ac_values * rng.choice([-1, 1], size=ac_values.shape)
+        component_blocks.append(blocks)
+    return component_blocks
+
+
+def reference_samples(blocks):
+    """ Level shifted samples of a component, from the IDCT formula of the JPEG standard. """
+    scale = [1 / math.sqrt(2)] + [1.0] * 7
+    basis = numpy.array([[scale[u] * math.cos((2 * x + 1) * u * math.pi / 16) for u in range(8)] for x in range(8)])
+    coefficients = numpy.zeros(blocks.shape[:2] + (8, 8))
+    for k, (row, column) in enumerate(ZIGZAG_POSITIONS):
+        coefficients[:, :, row, column] = blocks[:, :, k]
+    samples = numpy.einsum('yv,abvu,xu->abyx', basis, coefficients, basis) / 4 + 128
+    rows, columns = blocks.shape[:2]
+    return samples.transpose(0, 2, 1, 3).reshape(rows * 8, columns * 8)
+
+
+def test_grayscale_matches_reference():
+    width, height = 45, 29
+    blocks = random_blocks(width, height, [(1, 1)], ac_count=9)
+    with JpegFile.from_bytes(encode(blocks, width, height, [(1, 1)])) as jpeg_file:
+        image = jpeg_file.decode()
+
+    expected = numpy.clip(numpy.round(reference_samples(blocks[0])), 0, 255)[:height, :width]
+    assert image.shape == (height, width)
+    assert numpy.abs(image.astype(int) - expected).max() <= 1
+
+
+@pytest.mark.parametrize('sampling', [[(1, 1)] * 3, [(2, 2), (1, 1), (1, 1)], [(2, 1), (1, 1), (1, 1)]])
+def test_colour_matches_reference(sampling):
+    width, height = 50, 35
+    blocks = random_blocks(width, height, sampling, ac_count=0)
+    with JpegFile.from_bytes(encode(blocks, width, height, sampling)) as jpeg_file:
+        image = jpeg_file.decode()
+
+    # Flat blocks, so that upsampling the chroma planes is exact.
+    max_h = max(h for h, _ in sampling)
+    max_v = max(v for _, v in sampling)
+    planes = [
+        numpy.repeat(numpy.repeat(reference_samples(b), max_v // v, axis=0), max_h // h, axis=1)[:height, :width]
+        for b, (h, v) in zip(blocks, sampling)]
+    y, cb, cr = planes[0], planes[1] - 128, planes[2] - 128
+    expected = numpy.stack((y + 1.402 * cr, y - 0.344136 * cb - 0.714136 * cr, y + 1.772 * cb), axis=-1)
+    expected = numpy.clip(numpy.round(expected), 0, 255)
+    assert image.shape == (height, width, 3)
+    assert numpy.abs(image.astype(int) - expected).max() <= 1
+
+
+def test_restart_intervals():
+    width, height, sampling = 100, 70, [(2, 2), (1, 1), (1, 1)]
+    blocks = random_blocks(width, height, sampling, ac_count=5)
+    data = encode(blocks, width, height, sampling, restart_interval=3)
+    without_restarts = encode(blocks, width, height, sampling)
+    with JpegFile.from_bytes(without_restarts) as jpeg_file:
+        expected = jpeg_file.decode()
+
+    box = (13, 9, 77, 50)
+    with JpegFile.from_bytes(data) as jpeg_file:
+        assert jpeg_file.restart_index.interval == 3
+        assert numpy.array_equal(jpeg_file.decode(), expected)
+        assert numpy.array_equal(jpeg_file.decode(box=box), expected[9:50, 13:77])
+        assert numpy.array_equal(jpeg_file.decode(box=box, workers=2), expected[9:50, 13:77])
+
+
+def test_preview_is_block_means():
+    width, height = 40, 24
+    blocks = random_blocks(width, height, [(1, 1)], ac_count=6)
+    with JpegFile.from_bytes(encode(blocks, width, height, [(1, 1)])) as jpeg_file:
+        preview = jpeg_file.decode_preview()
+
+    expected = numpy.clip(numpy.round(blocks[0][:, :, 0] / 8 + 128), 0, 255)
+    assert numpy.abs(preview.astype(int) - expected).max() <= 1
+
+
+def test_box_past_the_restart_intervals():
+    width, height = 48, 32
+    blocks = random_blocks(width, height, [(1, 1)], ac_count=2)
+    data = encode(blocks, width, height, [(1, 1)], restart_interval=2)
+    with JpegFile.from_bytes(data) as jpeg_file:
+        scan_decoder = decoder.Decoder(data, jpeg_file.segments)
+    scan_decoder._read_frame(allowed_markers=(segment_markers.SOF0, ))
+
+    # No interval of the scan covers a box of MCUs to the right of the frame, so there is nothing to hand out.
+    mcus_x = scan_decoder.frame.mcus_x
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        (values, ) = scan_decoder._decode_blocks((mcus_x, 0, mcus_x + 1, 1), block_size=1, executor=executor)
+    assert values.shape == (1, 1, 1) and not values.any()
@@ -0,0 +1,58 @@
+import struct
+
+import pytest
+
+from jpeg_reader import JpegFile
+from utils import encoding
+from utils import segment_markers
+
+
+@pytest.mark.parametrize('name, quality, chroma_subsampling', [
+    ('img_natron.jpg', (100, True), '4:2:0'),
+    ('img_paint.jpg', (94, True), '4:2:0'),
+    ('img_photoshop.jpg', (99, False), '4:4:4'),
+    ('smpte169.jpg', (94, False), '4:4:4'),
+])
+def test_test_images(read_test_image, name, quality, chroma_subsampling):
+    with JpegFile.from_bytes(read_test_image(name)) as jpeg_file:
+        assert jpeg_file.quality == quality
+        assert jpeg_file.chroma_subsampling == chroma_subsampling
+        assert len(jpeg_file.components) == 3
+        assert all(len(table) == 64 for table in jpeg_file.quantization_tables.values())
+
+
+def test_chroma_subsampling():
+    def components(*sampling):
+        return [encoding.Component(x, h, v, 0) for x, (h, v) in enumerate(sampling)]
+
+    assert encoding.chroma_subsampling(components((1, 1))) == '4:0:0'
+    assert encoding.chroma_subsampling(components((1, 1), (1, 1), (1, 1))) == '4:4:4'
+    assert encoding.chroma_subsampling(components((2, 1), (1, 1), (1, 1))) == '4:2:2'
+    assert encoding.chroma_subsampling(components((2, 2), (1, 1), (1, 1))) == '4:2:0'
+    assert encoding.chroma_subsampling(components((3, 1), (1, 1), (1, 1))) is None
+    # Sampling factors of 0 only come from damaged frame headers.
+    assert encoding.chroma_subsampling(components((0, 1), (1, 1), (1, 1))) is None
+    assert encoding.chroma_subsampling(components((2, 2), (0, 0), (0, 0))) is None
+
+
+def test_quality_of_libjpeg_tables():
+    for quality in (1, 10, 50, 75, 90, 100):
+        luminance = encoding.scale_table(encoding.LUMINANCE_TABLE, quality)
+        chrominance = encoding.scale_table(encoding.CHROMINANCE_TABLE, quality)
+        assert encoding.estimate_quality(luminance, chrominance) == (quality, True)
+    # Grayscale files only have a luminance table
+    assert encoding.estimate_quality(encoding.scale_table(encoding.LUMINANCE_TABLE, 85)) == (85, True)
+
+
+def test_load_with_damaged_quantization_table(read_test_image):
+    data = bytearray(read_test_image('img_photoshop.jpg'))
+    with JpegFile.from_bytes(bytes(data)) as jpeg_file:
+        dqt_offset = next(segment.offset for segment in jpeg_file.segments if segment.marker is segment_markers.DQT)
+        assert jpeg_file.quality is not None
+
+    # Shorten the DQT segment so that its table overruns it
+    struct.pack_into('>H', data, dqt_offset + 2, 40)
+    with JpegFile.from_bytes(bytes(data)) as jpeg_file:
+        jpeg_file.load()
+        assert jpeg_file.quantization_tables == {}
+        assert jpeg_file.quality is None
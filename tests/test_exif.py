@@ -0,0 +1,101 @@
+import random
+import struct
+
+import pytest
+
+from conftest import make_segment
+from jpeg_reader import JpegFile
+from utils import exif
+
+
+def _exif_segment(endian, entries, values):
+    """ An EXIF APP1 segment holding an IFD0 with the given (tag id, type id, count, value field) entries, followed by
+    `values`. Value fields that are offsets should point past the IFD, at 8 + 2 + 12 * len(entries) + 4.
+    """
+    ifd0 = (struct.pack(f'{endian}H', len(entries))
+            + b''.join(struct.pack(f'{endian}HHLL', *entry) for entry in entries)
+            + struct.pack(f'{endian}L', 0))
+    tiff = (b'II' if endian == '<' else b'MM') + struct.pack(f'{endian}HL', 42, 8) + ifd0 + values
+    return make_segment(0xffe1, b'Exif\x00\x00' + tiff)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('tag_type', ['H', 'L', 'l', '2L', '2l'])
+def test_unpack_standard_ifd_values(endian, tag_type):
+    rng = random.Random(0)
+    size = exif.tag_type_sizes[tag_type]
+    data = bytes(rng.randrange(1, 256) for _ in range(size * 10 + 3))
+    for offset in (0, 3):
+        values = exif.unpack_standard_ifd_values(data, endian, tag_type, 10, offset)
+        assert values == [
+            exif.unpack_standard_ifd_value(data, endian, tag_type, offset + x * size) for x in range(10)]
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_array_values(read_test_image, endian):
+    values_offset = 8 + 2 + 12 * 5 + 4
+    values = struct.pack(f'{endian}3H', 8, 8, 8) + struct.pack(f'{endian}4L', 3127, 10000, 3290, 10000)
+    entries = [
+        (0x0102, 3, 3, values_offset),  # BitsPerSample, 3 SHORTs
+        (0x011a, 5, 1, values_offset + 6),  # XResolution, a single RATIONAL
+        (0x013e, 5, 2, values_offset + 6),  # WhitePoint, 2 RATIONALs
+        (0x0212, 3, 2, struct.unpack(f'{endian}L', struct.pack(f'{endian}2H', 2, 1))[0]),  # YCbCrSubSampling, inline
+        (0x0213, 3, 1, struct.unpack(f'{endian}L', struct.pack(f'{endian}H', 1) + bytes(2))[0]),  # YCbCrPositioning
+    ]
+    data = read_test_image('img_paint.jpg')
+    data = data[:2] + _exif_segment(endian, entries, values) + data[2:]
+    with JpegFile.from_bytes(data) as jpeg_file:
+        assert jpeg_file.ifd0_metadata == {
+            'BitsPerSample': [8, 8, 8],
+            'XResolution': 0.3127,
+            'WhitePoint': [0.3127, 0.329],
+            'YCbCrSubSampling': [2, 1],
+            'YCbCrPositioning': 1,
+        }
+
+
+def test_unpack_ifd_entries():
+    entries = [(0x010f, 2, 6, 26), (0x0112, 3, 1, 1)]
+    data = struct.pack('<H', len(entries)) + exif.pack_ifd_entries('<', entries)
+    assert exif.unpack_ifd_entries(data, '<', 0, 2) == entries
+    with pytest.raises(struct.error):
+        exif.unpack_ifd_entries(data, '<', 0, 3)
+    with pytest.raises(struct.error):
+        exif.unpack_ifd_entries(bytes(100), '<', 0, 0xffff)
+
+
+def test_struct_cache_ignores_counts_from_files(read_test_image):
+    data = read_test_image('img_paint.jpg')
+
+    def read(entry_count):
+        values_offset = 8 + 2 + 12 * entry_count + 4
+        entries = [(0x013e, 5, entry_count, values_offset)] + [(0x0213, 3, 1, 1)] * (entry_count - 1)
+        values = struct.pack(f'<{entry_count * 2}L', *[1, 2] * entry_count)
+        with JpegFile.from_bytes(data[:2] + _exif_segment('<', entries, values) + data[2:]) as jpeg_file:
+            assert jpeg_file.ifd0_metadata['WhitePoint'] == [0.5] * entry_count
+
+    read(2)
+    cache_size = exif.get_struct.cache_info().currsize
+    for entry_count in range(3, 40):
+        read(entry_count)
+    assert exif.get_struct.cache_info().currsize == cache_size
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('tag_type', ['2L', '2l'])
+def test_zero_denominators(endian, tag_type):
+    data = struct.pack(f'{endian}4{tag_type[1]}', 1, 0, 1, 2)
+    assert exif.unpack_standard_ifd_value(data, endian, tag_type) is None
+    assert exif.unpack_standard_ifd_values(data, endian, tag_type, 2) == [None, 0.5]
+
+
+def test_zero_resolution(read_test_image):
+    values_offset = 8 + 2 + 12 * 2 + 4
+    values = struct.pack('<4L', 72, 0, 72, 1)
+    entries = [(0x011a, 5, 1, values_offset), (0x011b, 5, 1, values_offset + 8)]  # XResolution, YResolution
+    data = read_test_image('img_paint.jpg')
+    data = data[:2] + _exif_segment('<', entries, values) + data[2:]
+    with JpegFile.from_bytes(data) as jpeg_file:
+        # Values that can't be worked out are left out, like any other tag that can't be read.
+        assert jpeg_file.ifd0_metadata == {'YResolution': 72.0}
+        assert jpeg_file.pixel_aspect == 1.0
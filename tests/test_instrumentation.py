@@ -0,0 +1,76 @@
+import io
+import os
+
+import pytest
+
+from jpeg_reader import JpegFile
+from jpeg_reader import iter_jpeg_files
+from jpeg_reader import scan_files
+from utils import instrumentation
+from utils.instrumentation import ReadStats
+
+
+def test_phases(test_image_path):
+    stats = ReadStats()
+    with JpegFile(test_image_path, stats=stats) as jpeg_file:
+        jpeg_file.load()
+    assert stats.files == 1
+    assert {'open', 'markers', 'sof'} <= set(stats.phases)
+    assert all(seconds >= 0 for seconds in stats.phases.values())
+    assert stats.total_time == sum(stats.phases.values())
+
+    # The file was memory-mapped, so it took no reads or seeks.
+    assert (stats.reads, stats.seeks, stats.bytes_read) == (0, 0, 0)
+    assert stats.bytes_mapped == os.path.getsize(test_image_path)
+    assert 0 < stats.bytes_scanned <= stats.bytes_mapped
+
+
+def test_only_decoded_phases_are_timed(read_test_image):
+    stats = ReadStats()
+    with JpegFile.from_bytes(read_test_image('img_natron.jpg'), stats=stats) as jpeg_file:
+        jpeg_file.get_tags({'Orientation'})
+    assert 'ifd0' in stats.phases
+    assert not {'jfif', 'exif_ifd', 'gps_ifd'} & set(stats.phases)
+
+
+def test_stream_reads(read_test_image):
+    data = read_test_image('img_photoshop.jpg')
+    stats = ReadStats()
+    with JpegFile.from_stream(io.BytesIO(data), full_scan=True, stats=stats):
+        pass
+    assert stats.reads > 0
+    assert stats.bytes_read == stats.bytes_scanned == len(data)
+    assert stats.bytes_mapped == 0
+
+
+def test_total(read_test_image):
+    all_stats = list()
+    for name in ('img_natron.jpg', 'img_photoshop.jpg'):
+        all_stats.append(ReadStats())
+        with JpegFile.from_bytes(read_test_image(name), stats=all_stats[-1]) as jpeg_file:
+            jpeg_file.load()
+
+    total = ReadStats.total(all_stats + [None])
+    assert total.files == 2
+    assert total.bytes_scanned == sum(stats.bytes_scanned for stats in all_stats)
+    assert total.phases['sof'] == pytest.approx(sum(stats.phases['sof'] for stats in all_stats))
+    assert total.as_dict()['files'] == 2
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_hooks(jpeg_directory, workers):
+    file_paths = sorted(iter_jpeg_files(str(jpeg_directory), recursive=True))
+    emitted = list()
+
+    def hook(file_path, stats):
+        emitted.append((file_path, stats.files))
+
+    instrumentation.add_hook(hook)
+    try:
+        results = list(scan_files(file_paths, workers=workers, use_threads=True, instrument=True))
+    finally:
+        instrumentation.remove_hook(hook)
+    assert {result.file_path for result in results} == set(file_paths)
+    assert all(result.stats.files == 1 for result in results)
+    # Each result's stats were passed to the hook
+    assert sorted(emitted) == sorted((result.file_path, 1) for result in results)
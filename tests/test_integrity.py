@@ -0,0 +1,71 @@
+import struct
+
+import pytest
+
+from benchmarks.synthetic import make_jpeg
+from jpeg_reader import JpegFile
+from jpeg_reader import iter_jpeg_files
+from jpeg_reader import verify_file
+from jpeg_reader import verify_files
+from utils import integrity
+from utils import segment_markers
+
+
+@pytest.mark.parametrize('deep', [False, True])
+def test_ok(test_image_path, deep):
+    assert verify_file(test_image_path, deep=deep).status == integrity.OK
+    with JpegFile(test_image_path, full_scan=True) as jpeg_file:
+        assert jpeg_file.verify(deep=deep) == (integrity.OK, None, None)
+
+
+@pytest.mark.parametrize('deep', [False, True])
+def test_truncated(read_test_image, deep):
+    data = read_test_image('img_photoshop.jpg')
+    for length in (1, 100, len(data) - 100, len(data) - 1):
+        verification = integrity.verify_buffer(data[:length], deep=deep)
+        assert verification.status == integrity.TRUNCATED, length
+        assert verification.offset == length
+
+
+@pytest.mark.parametrize('deep', [False, True])
+def test_trailing_garbage(read_test_image, deep):
+    data = read_test_image('img_photoshop.jpg')
+    verification = integrity.verify_buffer(data + b'trailing garbage', deep=deep)
+    assert (verification.status, verification.offset) == (integrity.TRAILING_GARBAGE, len(data))
+
+
+def test_bad_segment_length(read_test_image):
+    data = bytearray(read_test_image('img_paint.jpg'))
+    with JpegFile.from_bytes(bytes(data)) as jpeg_file:
+        dqt_offset = next(segment.offset for segment in jpeg_file.segments if segment.marker is segment_markers.DQT)
+    length = struct.unpack_from('>H', data, dqt_offset + 2)[0]
+    struct.pack_into('>H', data, dqt_offset + 2, length + 3)
+    verification = integrity.verify_buffer(bytes(data))
+    assert (verification.status, verification.offset) == (integrity.BAD_SEGMENT_LENGTH, dqt_offset)
+
+
+def test_not_a_jpeg_file():
+    assert integrity.verify_buffer(b'GIF89a' + bytes(64)).status == integrity.NOT_JPEG
+    assert integrity.verify_buffer(b'').status == integrity.TRUNCATED
+
+
+def test_bad_restart_sequence():
+    data = bytearray(make_jpeg(width=64, height=64, scan_bytes=8192, restart_interval=1024, ff_density=0))
+    rst_offset = data.index(struct.pack('>H', segment_markers.RST2.marker))
+    data[rst_offset + 1] = segment_markers.RST5.marker & 0xff
+
+    # Only a deep check looks at the order of RST markers
+    assert integrity.verify_buffer(bytes(data)).status == integrity.OK
+    verification = integrity.verify_buffer(bytes(data), deep=True)
+    assert (verification.status, verification.offset) == (integrity.BAD_RESTART_SEQUENCE, rst_offset)
+
+
+def test_verify_files(jpeg_directory):
+    file_paths = sorted(iter_jpeg_files(str(jpeg_directory), recursive=True))
+    results = list(verify_files(file_paths + [str(jpeg_directory / 'missing.jpg')], workers=2, use_threads=True))
+    assert sorted(result.file_path for result in results) == sorted(file_paths + [str(jpeg_directory / 'missing.jpg')])
+    for result in results:
+        if result.file_path in file_paths:
+            assert (result.status, result.error) == (integrity.OK, None)
+        else:
+            assert result.status is None and 'FileNotFoundError' in result.error
@@ -0,0 +1,91 @@
+import pickle
+import struct
+
+import pytest
+
+from benchmarks.synthetic import make_jpeg
+from conftest import make_segment
+from jpeg_reader import JpegFile
+from jpeg_reader import JpegPrefixParser
+from jpeg_reader import scan_file
+from utils.limits import LimitExceeded
+from utils.limits import ReadLimits
+
+
+def _with_exif_ifd0(entry_count, entries):
+    """ A file whose IFD0 claims `entry_count` entries, followed by the given (tag id, type id, count, value field)
+    entries.
+    """
+    ifd0 = struct.pack('<H', entry_count) + b''.join(struct.pack('<HHLL', *entry) for entry in entries)
+    tiff = b'II' + struct.pack('<HL', 42, 8) + ifd0 + bytes(4)
+    exif_segment = make_segment(0xffe1, b'Exif\x00\x00' + tiff)
+    return b'\xff\xd8' + exif_segment + make_jpeg(width=16, height=16, scan_bytes=64)[2:]
+
+
+def test_ifd_entry_count():
+    # An IFD claiming the most entries a count can hold, most of which run past the end of the segment
+    data = _with_exif_ifd0(0xffff, [(0x010f, 2, 4, 0)] * 16)
+    with JpegFile.from_bytes(data, limits=ReadLimits()) as jpeg_file:
+        with pytest.raises(LimitExceeded) as e:
+            _ = jpeg_file.metadata
+    assert e.value.limit == 'max_ifd_entries'
+
+
+def test_value_size():
+    data = _with_exif_ifd0(1, [(0x010f, 2, 0x7fffffff, 0)])
+    with JpegFile.from_bytes(data, limits=ReadLimits()) as jpeg_file:
+        with pytest.raises(LimitExceeded) as e:
+            _ = jpeg_file.metadata
+    assert e.value.limit == 'max_value_bytes'
+
+
+def test_segment_count():
+    data = b'\xff\xd8' + make_segment(0xfffe, b'x') * 1000 + make_jpeg(width=16, height=16, scan_bytes=64)[2:]
+    with pytest.raises(LimitExceeded) as e:
+        JpegFile.from_bytes(data, limits=ReadLimits(max_segments=100))
+    assert e.value.limit == 'max_segments'
+
+
+def test_bytes_scanned():
+    data = make_jpeg(width=16, height=16, scan_bytes=256 * 1024)
+    limits = ReadLimits(max_bytes_scanned=64 * 1024)
+    with pytest.raises(LimitExceeded) as e:
+        JpegFile.from_bytes(data, full_scan=True, limits=limits)
+    assert e.value.limit == 'max_bytes_scanned'
+
+    # The header is within the limit, so reading only the header is fine.
+    with JpegFile.from_bytes(data, limits=limits) as jpeg_file:
+        assert jpeg_file.resolution == (16, 16)
+
+
+def test_time_budget():
+    data = make_jpeg(width=16, height=16, scan_bytes=64)
+    with pytest.raises(LimitExceeded) as e:
+        JpegFile.from_bytes(data, limits=ReadLimits(max_seconds=-1))
+    assert e.value.limit == 'max_seconds'
+
+
+def test_prefix_parser():
+    parser = JpegPrefixParser(limits=ReadLimits(max_bytes_scanned=1024))
+    parser.feed(b'\xff\xd8' + struct.pack('>2H', 0xffe1, 0xffff))
+    with pytest.raises(LimitExceeded):
+        parser.feed(bytes(2048))
+
+
+def test_not_a_jpeg_file():
+    with pytest.raises(ValueError):
+        JpegFile.from_bytes(b'GIF89a' + bytes(64), limits=ReadLimits())
+
+
+def test_errors_are_captured(tmp_path):
+    path = tmp_path / 'hostile.jpg'
+    path.write_bytes(_with_exif_ifd0(0xffff, []))
+    result = scan_file(str(path), limits=ReadLimits())
+    assert result.metadata is None
+    assert 'max_ifd_entries' in result.error
+
+
+def test_limit_exceeded_pickles():
+    error = pickle.loads(pickle.dumps(LimitExceeded('max_segments', 100, 'file.jpg', 0x40)))
+    assert (error.limit, error.value, error.file_name, error.offset) == ('max_segments', 100, 'file.jpg', 0x40)
+    assert pickle.loads(pickle.dumps(ReadLimits(max_seconds=1.5))).max_seconds == 1.5
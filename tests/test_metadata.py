@@ -0,0 +1,60 @@
+import pytest
+
+from jpeg_reader import JpegFile
+
+
+def test_metadata_groups(test_image_path):
+    with JpegFile(test_image_path) as jpeg_file:
+        metadata = dict()
+        for group in (jpeg_file.jfif_metadata, jpeg_file.ifd0_metadata, jpeg_file.exif_metadata,
+                      jpeg_file.gps_metadata):
+            metadata.update(group)
+        assert jpeg_file.metadata == metadata
+
+
+def test_values_read_before_closing(read_test_image):
+    jpeg_file = JpegFile.from_bytes(read_test_image('img_natron.jpg'))
+    resolution = jpeg_file.resolution
+    ifd0_metadata = jpeg_file.ifd0_metadata
+    jpeg_file.close()
+
+    assert jpeg_file.closed
+    assert jpeg_file.resolution == resolution
+    assert jpeg_file.ifd0_metadata == ifd0_metadata
+    # The JFIF segment was never decoded, so it can no longer be read.
+    with pytest.raises(ValueError):
+        _ = jpeg_file.jfif_metadata
+
+
+@pytest.mark.parametrize('tags', [
+    {'Orientation'},
+    {'XResolution', 'ColorSpace', 'JFIFVersion'},
+    {'ExifVersion', 'GPSLatitude', 'NotATag'},
+])
+def test_get_tags(test_image_path, tags):
+    with JpegFile(test_image_path) as jpeg_file:
+        selected = jpeg_file.get_tags(tags)
+    with JpegFile(test_image_path) as jpeg_file:
+        assert selected == {tag: value for tag, value in jpeg_file.metadata.items() if tag in tags}
+    with JpegFile(test_image_path, tags=tags) as jpeg_file:
+        assert jpeg_file.metadata == selected
+
+
+def test_get_tags_skips_sub_ifds(read_test_image, monkeypatch):
+    def _read_sub_ifds(*args, **kwargs):
+        raise AssertionError("The EXIF and GPSInfo IFDs shouldn't be read for IFD0 tags")
+
+    monkeypatch.setattr(JpegFile, '_read_sub_ifds', _read_sub_ifds)
+    with JpegFile.from_bytes(read_test_image('img_natron.jpg')) as jpeg_file:
+        assert jpeg_file.get_tags({'Orientation', 'XResolution'}) == {'Orientation': 1, 'XResolution': 144.5}
+        assert jpeg_file.pixel_aspect == 144.5 / 72
+
+
+def test_damaged_exif_header_warns(read_test_image, capsys):
+    data = bytearray(read_test_image('img_photoshop.jpg'))
+    byte_order_offset = data.index(b'Exif\x00\x00') + 6
+    data[byte_order_offset:byte_order_offset + 2] = b'XX'
+    with JpegFile.from_bytes(bytes(data)) as jpeg_file:
+        with pytest.warns(UserWarning, match='EXIF segment'):
+            assert 'Orientation' not in jpeg_file.metadata
+    assert capsys.readouterr().out == ''
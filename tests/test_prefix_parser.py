@@ -0,0 +1,65 @@
+import pytest
+
+from jpeg_reader import JpegFile
+from jpeg_reader import JpegPrefixParser
+from utils import segment_markers
+
+
+def _summary(jpeg_file):
+    segments = [(segment.marker, segment.offset) for segment in jpeg_file.segments]
+    return jpeg_file.resolution, jpeg_file.pixel_aspect, jpeg_file.metadata, segments
+
+
+def test_feed_only_what_is_needed(test_image_path):
+    with open(test_image_path, 'rb') as f:
+        data = f.read()
+    parser = JpegPrefixParser()
+    while parser.feed(data[len(parser.data):len(parser.data) + parser.bytes_needed]):
+        assert not parser.done
+
+    # Nothing past the SOS marker and its length was needed
+    expected = JpegFile(test_image_path)
+    sos = expected.segments[-1]
+    assert sos.marker is segment_markers.SOS
+    assert len(parser.data) == sos.offset + 4
+    assert _summary(parser.jpeg_file()) == _summary(expected)
+
+
+def test_feed_one_byte_at_a_time(read_test_image):
+    data = read_test_image('img_photoshop.jpg')
+    parser = JpegPrefixParser()
+    position = 0
+    while parser.feed(data[position:position + 1]):
+        position += 1
+    assert _summary(parser.jpeg_file()) == _summary(JpegFile.from_bytes(data))
+
+
+def test_incomplete_header(read_test_image):
+    parser = JpegPrefixParser()
+    assert parser.feed(read_test_image('img_photoshop.jpg')[:100]) > 0
+    with pytest.raises(RuntimeError):
+        parser.jpeg_file()
+
+
+def test_not_a_jpeg_file():
+    assert JpegPrefixParser().feed(b'GIF89a') == 0
+
+
+def test_header_only_file(read_test_image):
+    data = read_test_image('smpte169.jpg')
+    parser = JpegPrefixParser()
+    position = 0
+    while parser.feed(data[position:position + 512]):
+        position += 512
+
+    jpeg_file = parser.jpeg_file()
+    with JpegFile.from_bytes(data) as whole_file:
+        assert jpeg_file.resolution == whole_file.resolution
+        assert jpeg_file.metadata == whole_file.metadata
+
+    # Everything that needs the image data refuses to run on the header alone.
+    for operation in (jpeg_file.decode, jpeg_file.decode_preview, jpeg_file.verify):
+        with pytest.raises(ValueError):
+            operation()
+    with pytest.raises(ValueError):
+        jpeg_file.write_stripped(bytearray())
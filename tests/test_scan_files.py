@@ -0,0 +1,72 @@
+import collections
+import os
+import pickle
+
+import pytest
+
+from jpeg_reader import iter_jpeg_files
+from jpeg_reader import scan_directory
+from jpeg_reader import scan_file
+from jpeg_reader import scan_files
+from utils import segment_markers
+from utils.cache import FileCache
+
+
+def test_iter_jpeg_files(jpeg_directory):
+    file_names = sorted(name for name in os.listdir(jpeg_directory) if name.endswith('.jpg'))
+    assert sorted(iter_jpeg_files(str(jpeg_directory))) == [os.path.join(jpeg_directory, name) for name in file_names]
+    assert sorted(iter_jpeg_files(str(jpeg_directory), recursive=True)) == sorted(
+        [os.path.join(jpeg_directory, name) for name in file_names]
+        + [os.path.join(jpeg_directory, 'nested', name) for name in file_names])
+
+
+@pytest.mark.parametrize('use_threads', [True, False])
+def test_scan_directory(jpeg_directory, use_threads):
+    file_paths = sorted(iter_jpeg_files(str(jpeg_directory), recursive=True))
+    results = {
+        result.file_path: result
+        for result in scan_directory(str(jpeg_directory), recursive=True, workers=2, use_threads=use_threads)}
+    assert sorted(results) == file_paths
+    for file_path, result in results.items():
+        assert result.error is None
+        assert result == scan_file(file_path)
+        # Markers are compared by identity, so those from worker processes must be the module's own.
+        assert all(segment_markers.get_segment_marker(marker.marker) is marker for marker, _ in result.segments)
+
+
+@pytest.mark.parametrize('use_threads', [True, False])
+@pytest.mark.parametrize('with_cache', [False, True])
+def test_each_path_yielded_once(jpeg_directory, tmp_path, use_threads, with_cache):
+    file_paths = sorted(iter_jpeg_files(str(jpeg_directory), recursive=True))
+    cache = FileCache(str(tmp_path / 'cache.db')) if with_cache else None
+
+    # A second pass is served from the cache, when there is one.
+    for _ in range(2):
+        results = list(scan_files(file_paths, workers=2, use_threads=use_threads, max_in_flight=3, cache=cache))
+        counts = collections.Counter(result.file_path for result in results)
+        assert sorted(counts) == file_paths
+        assert set(counts.values()) == {1}
+        assert all(result.error is None for result in results)
+
+    if cache is not None:
+        assert cache.hits == len(file_paths)
+        cache.close()
+
+
+def test_single_worker(jpeg_directory):
+    file_paths = sorted(iter_jpeg_files(str(jpeg_directory), recursive=True))
+    results = list(scan_files(file_paths, workers=1))
+    assert [result.file_path for result in results] == file_paths
+
+
+def test_errors_are_captured(tmp_path):
+    bad_path = tmp_path / 'not_a_jpeg.jpg'
+    bad_path.write_bytes(b'not a jpeg file')
+    results = list(scan_files([str(bad_path)] * 3, workers=2, use_threads=True))
+    assert len(results) == 3
+    assert all(result.error is not None and result.resolution is None for result in results)
+
+
+def test_segment_markers_pickle_by_reference():
+    for marker in (segment_markers.SOI, segment_markers.APP1, segment_markers.SOS):
+        assert pickle.loads(pickle.dumps(marker)) is marker
@@ -0,0 +1,61 @@
+import io
+import struct
+
+from conftest import make_segment
+from jpeg_reader import JpegFile
+from jpeg_reader import scan_file
+from utils import segment_markers
+
+
+def _scan_hash(data, **kwargs):
+    with JpegFile.from_bytes(data, hash_scan=True, **kwargs) as jpeg_file:
+        return jpeg_file.scan_hash
+
+
+def _segment_offset(data, marker):
+    with JpegFile.from_bytes(data) as jpeg_file:
+        return next(segment.offset for segment in jpeg_file.segments if segment.marker is marker)
+
+
+def test_stable_across_metadata_edits(read_test_image):
+    data = read_test_image('img_photoshop.jpg')
+    comment = b'edited'
+    edited = data[:2] + make_segment(segment_markers.APPF.marker, comment) + data[2:]
+
+    # Drop the EXIF segment as well
+    exif_offset = _segment_offset(edited, segment_markers.APP1)
+    exif_end = exif_offset + 2 + struct.unpack_from('>H', edited, exif_offset + 2)[0]
+    edited = edited[:exif_offset] + edited[exif_end:]
+    assert _scan_hash(edited) == _scan_hash(data)
+    assert _scan_hash(edited, hash_tables=True) == _scan_hash(data, hash_tables=True)
+
+
+def test_image_data_changes_hash(read_test_image):
+    data = bytearray(read_test_image('img_photoshop.jpg'))
+    scan_hash = _scan_hash(bytes(data))
+    data[-10] ^= 0x01
+    assert _scan_hash(bytes(data)) != scan_hash
+
+
+def test_hash_tables(read_test_image):
+    data = bytearray(read_test_image('img_photoshop.jpg'))
+    scan_hash = _scan_hash(bytes(data))
+    tables_hash = _scan_hash(bytes(data), hash_tables=True)
+    assert tables_hash != scan_hash
+
+    # A different quantization table only changes the hash that includes the tables
+    data[_segment_offset(bytes(data), segment_markers.DQT) + 5] ^= 0x01
+    assert _scan_hash(bytes(data)) == scan_hash
+    assert _scan_hash(bytes(data), hash_tables=True) != tables_hash
+
+
+def test_sources_agree(test_image_path):
+    with open(test_image_path, 'rb') as f:
+        data = f.read()
+    scan_hash = _scan_hash(data)
+    assert scan_hash is not None
+    assert scan_file(test_image_path, hash_scan=True).scan_hash == scan_hash
+    with JpegFile.from_stream(io.BytesIO(data), hash_scan=True) as jpeg_file:
+        assert jpeg_file.scan_hash == scan_hash
+    with JpegFile(test_image_path) as jpeg_file:
+        assert jpeg_file.scan_hash is None
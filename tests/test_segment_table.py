@@ -0,0 +1,67 @@
+import pathlib
+import pickle
+import sys
+
+from jpeg_reader import JpegFile
+from jpeg_reader import iter_jpeg_files
+from jpeg_reader import scan_file
+from jpeg_reader import scan_files
+from utils import segment_markers
+from utils.segment_table import Segment
+from utils.segment_table import SegmentTable
+
+
+def _table():
+    return SegmentTable([(0xffd8, 0), (0xffe0, 2), (0xffdb, 20), (0xffda, 0x1_0000_0000)])
+
+
+def test_indexing_and_slicing():
+    table = _table()
+    expected = [
+        Segment(segment_markers.SOI, 0),
+        Segment(segment_markers.APP0, 2),
+        Segment(segment_markers.DQT, 20),
+        Segment(segment_markers.SOS, 0x1_0000_0000),
+    ]
+    assert len(table) == 4
+    assert list(table) == expected
+    assert [table[x] for x in range(-4, 4)] == expected * 2
+    assert isinstance(table[1:3], SegmentTable)
+    assert list(table[1:3]) == expected[1:3]
+    assert list(table[::-1]) == expected[::-1]
+    assert table.pairs() == [(0xffd8, 0), (0xffe0, 2), (0xffdb, 20), (0xffda, 0x1_0000_0000)]
+    assert table == _table() and table != table[1:]
+
+
+def test_pickling():
+    table = pickle.loads(pickle.dumps(_table()))
+    assert table == _table()
+    assert table[0].marker is segment_markers.SOI
+
+
+def test_detach(read_test_image):
+    with JpegFile.from_bytes(read_test_image('img_natron.jpg')) as jpeg_file:
+        result = jpeg_file.detach()
+    assert result.resolution == (12, 3)
+    assert result.metadata['ExifVersion'] == '0220'
+    assert isinstance(result.segments, SegmentTable)
+
+
+def test_detach_keeps_the_whole_path(tmp_path, read_test_image):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(read_test_image('img_paint.jpg'))
+    with JpegFile(path) as jpeg_file:
+        result = jpeg_file.detach()
+    assert pathlib.Path(result.file_path) == path
+    assert result.resolution == (3, 3)
+
+
+def test_results_from_worker_processes(jpeg_directory):
+    file_paths = sorted(iter_jpeg_files(str(jpeg_directory), recursive=True))
+    for result in scan_files(file_paths, workers=2, full_scan=True):
+        assert result.error is None
+        assert isinstance(result.segments, SegmentTable)
+        assert result.segments == scan_file(result.file_path, full_scan=True).segments
+        assert all(segment_markers.get_segment_marker(marker.marker) is marker for marker, _ in result.segments)
+        # Tag names are interned once they are back in this process
+        assert all(sys.intern(tag_name) is tag_name for tag_name in result.metadata)
@@ -0,0 +1,114 @@
+import random
+import struct
+
+import pytest
+
+from conftest import make_segment
+from jpeg_reader import JpegFile
+from utils import scanner
+from utils import segment_markers
+
+
+def _markers_and_offsets(jpeg_file):
+    return [(segment.marker, segment.offset) for segment in jpeg_file.segments]
+
+
+def _find_marker_byte_by_byte(data, start):
+    """ The next marker at or after `start`, found one byte at a time the way JpegFile used to. """
+    for offset in range(start, len(data) - 1):
+        if data[offset] == 0xff and data[offset + 1] not in (0x00, 0xff):
+            return offset, data[offset] << 8 | data[offset + 1]
+    raise EOFError
+
+
+def _find_segments_byte_by_byte(data):
+    """ Every known marker up to EOI, found one byte at a time. Up to the first SOS, the data of each segment is
+    skipped using its length field, so that the markers of an embedded thumbnail aren't mistaken for the file's own.
+    """
+    segments = list()
+    position = 0
+    in_header = True
+    while True:
+        marker_offset, marker = _find_marker_byte_by_byte(data, position)
+        segment_marker = segment_markers.get_segment_marker(marker)
+        if segment_marker is not None:
+            segments.append((segment_marker, marker_offset))
+        if marker == segment_markers.EOI.marker:
+            return segments
+
+        position = marker_offset + 2
+        if in_header and segment_marker not in segment_markers.STANDALONE_MARKERS:
+            position += struct.unpack_from('>H', data, position)[0]
+            in_header = segment_marker is not segment_markers.SOS
+
+
+def _with_segments_after_soi(path, data, *segments):
+    """ Write `data` to `path`, with the given segments inserted after its SOI marker. """
+    with open(path, 'wb') as f:
+        f.write(data[:2] + b''.join(segments) + data[2:])
+    return path
+
+
+def test_header_only_stops_at_first_sos(test_image_path):
+    segments = _markers_and_offsets(JpegFile(test_image_path, full_scan=True))
+    assert segments[0] == (segment_markers.SOI, 0)
+    assert segments[-1][0] is segment_markers.EOI
+
+    sos_index = next(x for x, (marker, _) in enumerate(segments) if marker is segment_markers.SOS)
+    assert _markers_and_offsets(JpegFile(test_image_path)) == segments[:sos_index + 1]
+
+
+def test_header_only_keeps_header_values(test_image_path):
+    header_only = JpegFile(test_image_path)
+    full_scan = JpegFile(test_image_path, full_scan=True)
+    assert header_only.resolution == full_scan.resolution
+    assert header_only.pixel_aspect == full_scan.pixel_aspect
+    assert header_only.metadata == full_scan.metadata
+
+
+def test_full_scan_matches_byte_by_byte_search(test_image_path):
+    with open(test_image_path, 'rb') as f:
+        data = f.read()
+    assert _markers_and_offsets(JpegFile(test_image_path, full_scan=True)) == _find_segments_byte_by_byte(data)
+
+
+def test_markers_inside_segment_data(tmp_path, read_test_image):
+    # An APP segment holding an SOI, a 16x16 SOF0 and an EOI marker, like an embedded thumbnail would
+    data = read_test_image('img_paint.jpg')
+    payload = b'\xff\xd8\xff\xc0\x00\x11\x08\x00\x10\x00\x10\xff\xd9'
+    app_segment = make_segment(segment_markers.APPF.marker, payload)
+    plain_file = JpegFile(_with_segments_after_soi(tmp_path / 'plain.jpg', data), full_scan=True)
+    jpeg_file = JpegFile(_with_segments_after_soi(tmp_path / 'app.jpg', data, app_segment), full_scan=True)
+
+    assert _markers_and_offsets(jpeg_file) == [(segment_markers.SOI, 0), (segment_markers.APPF, 2)] + [
+        (marker, offset + len(app_segment)) for marker, offset in _markers_and_offsets(plain_file)[1:]]
+    assert jpeg_file.resolution == plain_file.resolution == (3, 3)
+
+
+def test_fill_bytes_between_segments(tmp_path, read_test_image):
+    data = read_test_image('img_paint.jpg')
+    plain_file = JpegFile(_with_segments_after_soi(tmp_path / 'plain.jpg', data))
+    jpeg_file = JpegFile(_with_segments_after_soi(tmp_path / 'fill.jpg', data, b'\xff' * 5))
+    assert _markers_and_offsets(jpeg_file) == [(segment_markers.SOI, 0)] + [
+        (marker, offset + 5) for marker, offset in _markers_and_offsets(plain_file)[1:]]
+
+
+@pytest.mark.parametrize('buffer_type', [bytes, memoryview])
+def test_find_marker(buffer_type):
+    # Mostly stuffed and fill bytes, so that most candidate markers have to be skipped
+    rng = random.Random(0)
+    data = bytes(rng.choice(b'\x00\xff\xff\xd8\x12') for _ in range(2000)) + b'\xff\xd9'
+    buffer = buffer_type(data)
+    for start in range(0, len(data) - 1, 3):
+        assert scanner.find_marker(buffer, start) == _find_marker_byte_by_byte(data, start)
+
+
+def test_no_marker_before_end_of_buffer():
+    with pytest.raises(EOFError):
+        scanner.find_marker(b'\x12\xff\x00\xff\xff', 0)
+
+
+def test_get_segment_marker():
+    for marker in (segment_markers.SOI, segment_markers.SOF2, segment_markers.APP1, segment_markers.EOI):
+        assert segment_markers.get_segment_marker(marker.marker) is marker
+    assert segment_markers.get_segment_marker(0xff00) is None
@@ -0,0 +1,81 @@
+import io
+import mmap
+import os
+
+import jpeg_reader
+from jpeg_reader import JpegFile
+
+
+class _UnseekableStream(io.RawIOBase):
+    """ A stream that can only be read from start to end, like a pipe or a socket. """
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._stream.readinto(buffer)
+
+
+def _summary(jpeg_file):
+    segments = [(segment.marker, segment.offset) for segment in jpeg_file.segments]
+    return jpeg_file.resolution, jpeg_file.pixel_aspect, jpeg_file.metadata, segments
+
+
+def test_files_are_memory_mapped(test_image_path, monkeypatch):
+    mapped = list()
+    map_file = jpeg_reader._map_file
+
+    def _map_file(file):
+        mapped.append(map_file(file))
+        return mapped[-1]
+
+    monkeypatch.setattr(jpeg_reader, '_map_file', _map_file)
+    with JpegFile(test_image_path) as jpeg_file:
+        assert len(mapped) == 1 and isinstance(mapped[0], mmap.mmap)
+        assert None not in jpeg_file.resolution
+    assert mapped[0].closed
+
+
+def test_unmappable_files(tmp_path):
+    # Empty files can't be mapped
+    path = tmp_path / 'empty.jpg'
+    path.write_bytes(b'')
+    with open(path, 'rb') as f:
+        assert jpeg_reader._map_file(f) is None
+
+
+def test_bytes_like_data(test_image_path):
+    with open(test_image_path, 'rb') as f:
+        data = f.read()
+    expected = _summary(JpegFile(test_image_path, full_scan=True))
+    for buffer in (data, bytearray(data), memoryview(data)):
+        assert _summary(JpegFile.from_bytes(buffer, full_scan=True)) == expected
+
+
+def test_bytes_path(test_image_path):
+    # As with open(), bytes given to the constructor are a path.
+    with JpegFile(os.fsencode(test_image_path), full_scan=True) as jpeg_file:
+        assert _summary(jpeg_file) == _summary(JpegFile(test_image_path, full_scan=True))
+        assert jpeg_file.detach().file_path == os.fsencode(test_image_path)
+
+
+def test_unseekable_stream(test_image_path):
+    with open(test_image_path, 'rb') as f:
+        data = f.read()
+    for full_scan in (False, True):
+        assert (_summary(JpegFile.from_stream(_UnseekableStream(data), full_scan=full_scan))
+                == _summary(JpegFile(test_image_path, full_scan=full_scan)))
+
+
+def test_stream_not_at_start(test_image_path, tmp_path):
+    with open(test_image_path, 'rb') as f:
+        data = f.read()
+    path = tmp_path / 'wrapped.bin'
+    path.write_bytes(b'some other data' + data)
+    with open(path, 'rb') as f:
+        f.seek(len(b'some other data'))
+        jpeg_file = JpegFile.from_stream(f, full_scan=True)
+    # Offsets are relative to where the stream was when reading started.
+    assert _summary(jpeg_file) == _summary(JpegFile(test_image_path, full_scan=True))
@@ -0,0 +1,26 @@
+import pytest
+
+from benchmarks.synthetic import make_jpeg
+from jpeg_reader import JpegFile
+from utils import segment_markers
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+@pytest.mark.parametrize('progressive', [False, True])
+def test_make_jpeg(endian, progressive):
+    data = make_jpeg(width=640, height=480, scan_bytes=16 * 1024, app_segments=3, exif_entries=20,
+                     maker_note_bytes=256, progressive=progressive, restart_interval=1024, endian=endian)
+    with JpegFile.from_bytes(data, full_scan=True) as jpeg_file:
+        assert jpeg_file.resolution == (640, 480)
+        assert len(jpeg_file.exif_metadata) > 0 and len(jpeg_file.gps_metadata) > 0
+        markers = [segment.marker for segment in jpeg_file.segments]
+
+    assert (segment_markers.SOF2 if progressive else segment_markers.SOF0) in markers
+    assert sum(marker in segment_markers.APP_MARKERS for marker in markers) == 2 + 3
+    assert sum(marker in segment_markers.RST_MARKERS for marker in markers) >= 8
+    assert markers[-1] is segment_markers.EOI
+
+
+def test_seed():
+    assert make_jpeg(scan_bytes=1024, seed=1) == make_jpeg(scan_bytes=1024, seed=1)
+    assert make_jpeg(scan_bytes=1024, seed=1) != make_jpeg(scan_bytes=1024, seed=2)
@@ -0,0 +1,85 @@
+import io
+import os
+
+import pytest
+
+from benchmarks.synthetic import make_jpeg
+from jpeg_reader import JpegFile
+from jpeg_reader import extract_thumbnails
+from jpeg_reader import iter_jpeg_files
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_synthetic_thumbnail(endian):
+    data = make_jpeg(width=640, height=480, scan_bytes=4096, thumbnail_bytes=1024, endian=endian)
+    with JpegFile.from_bytes(data) as jpeg_file:
+        offset, length = jpeg_file.thumbnail_location
+        with jpeg_file.get_thumbnail() as thumbnail:
+            assert bytes(thumbnail) == data[offset:offset + length]
+        destination = io.BytesIO()
+        assert jpeg_file.write_thumbnail(destination) == length
+
+    assert destination.getvalue() == data[offset:offset + length]
+    with JpegFile.from_bytes(destination.getvalue(), full_scan=True) as thumbnail_file:
+        assert thumbnail_file.resolution == (160, 120)
+        assert thumbnail_file.segments[-1].offset == length - 2
+
+
+def test_test_image_thumbnails(test_image_path, tmp_path):
+    with JpegFile(test_image_path) as jpeg_file:
+        if jpeg_file.thumbnail_location is None:
+            assert jpeg_file.get_thumbnail() is None
+            assert jpeg_file.write_thumbnail(tmp_path / 'thumbnail.jpg') is None
+            assert not os.path.exists(tmp_path / 'thumbnail.jpg')
+            return
+
+        length = jpeg_file.write_thumbnail(tmp_path / 'thumbnail.jpg')
+        assert length == jpeg_file.thumbnail_location[1]
+
+    thumbnail = (tmp_path / 'thumbnail.jpg').read_bytes()
+    assert len(thumbnail) == length
+    assert thumbnail[:2] == b'\xff\xd8' and thumbnail[-2:] == b'\xff\xd9'
+
+
+def test_no_thumbnail_in_ifd1(read_test_image):
+    # IFD1 pointers that don't land on an SOI marker aren't trusted
+    data = bytearray(read_test_image('img_photoshop.jpg'))
+    with JpegFile.from_bytes(bytes(data)) as jpeg_file:
+        offset, _ = jpeg_file.thumbnail_location
+    data[offset:offset + 2] = b'\x00\x00'
+    with JpegFile.from_bytes(bytes(data)) as jpeg_file:
+        assert jpeg_file.thumbnail_location is None
+
+
+@pytest.mark.parametrize('recursive', [False, True])
+def test_extract_thumbnails(jpeg_directory, tmp_path, recursive):
+    output_directory = tmp_path / 'thumbnails'
+    results = list(extract_thumbnails(
+        str(jpeg_directory), str(output_directory), recursive=recursive, workers=2, use_threads=True))
+    assert sorted(result.file_path for result in results) == sorted(iter_jpeg_files(str(jpeg_directory), recursive))
+    for result in results:
+        assert result.error is None
+        with JpegFile(result.file_path) as jpeg_file:
+            if jpeg_file.thumbnail_location is None:
+                assert result.output_path is None
+                continue
+            with jpeg_file.get_thumbnail() as thumbnail:
+                expected = bytes(thumbnail)
+        assert result.output_path == os.path.join(output_directory, os.path.relpath(result.file_path, jpeg_directory))
+        with open(result.output_path, 'rb') as f:
+            assert f.read() == expected
+
+
+def test_extract_thumbnails_into_input_directory(jpeg_directory):
+    with pytest.raises(ValueError):
+        extract_thumbnails(str(jpeg_directory), str(jpeg_directory))
+
+
+def test_extract_thumbnails_into_nested_directory(jpeg_directory):
+    output_directory = jpeg_directory / 'thumbnails'
+    with pytest.raises(ValueError):
+        extract_thumbnails(str(jpeg_directory), str(output_directory), recursive=True)
+
+    # Only the top of the directory is read, so the thumbnails aren't read back in.
+    results = list(extract_thumbnails(str(jpeg_directory), str(output_directory), workers=1))
+    assert sorted(result.file_path for result in results) == sorted(iter_jpeg_files(str(jpeg_directory)))
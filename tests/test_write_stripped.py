@@ -0,0 +1,150 @@
+import io
+import struct
+
+import pytest
+
+from conftest import make_segment
+from jpeg_reader import JpegFile
+from jpeg_reader import iter_jpeg_files
+from jpeg_reader import strip_file
+from jpeg_reader import strip_files
+from utils import constants
+from utils import integrity
+from utils import segment_markers
+
+
+def _strip(data, **kwargs):
+    destination = io.BytesIO()
+    with JpegFile.from_bytes(data, full_scan=True) as jpeg_file:
+        length = jpeg_file.write_stripped(destination, **kwargs)
+    assert length == len(destination.getvalue())
+    return destination.getvalue()
+
+
+def test_drop_comment(read_test_image):
+    original = read_test_image('img_photoshop.jpg')
+    data = original[:2] + make_segment(segment_markers.COM.marker, b'private comment') + original[2:]
+
+    stripped = _strip(data, drop_segments=(segment_markers.COM, ))
+    assert b'private comment' not in stripped
+    assert stripped == original
+
+
+def _make_exif_segment(endian):
+    """ An EXIF APP1 segment with Make in IFD0, a MakerNote in the EXIF IFD, and a GPSInfo IFD. Returns the segment and
+    the values that stripping should remove.
+    """
+    def ifd(entries, next_ifd=0):
+        return (struct.pack(f'{endian}H', len(entries))
+                + b''.join(struct.pack(f'{endian}HHLL', *entry) for entry in entries)
+                + struct.pack(f'{endian}L', next_ifd))
+
+    ifd0_offset = 8
+    exif_offset = ifd0_offset + 2 + 12 * 3 + 4
+    gps_offset = exif_offset + 2 + 12 * 2 + 4
+    values_offset = gps_offset + 2 + 12 * 2 + 4
+    make = b'SecretCam\x00'
+    maker_note = b'PRIVATE MAKER NOTE' * 4
+    latitude = struct.pack(f'{endian}6L', 51, 1, 30, 1, 1234, 100)
+    maker_note_offset = values_offset + len(make)
+    latitude_offset = maker_note_offset + len(maker_note)
+
+    version = struct.unpack(f'{endian}L', b'0231')[0]
+    latitude_ref = struct.unpack(f'{endian}L', b'N\x00\x00\x00')[0]
+    tiff = b''.join([
+        b'II' if endian == '<' else b'MM',
+        struct.pack(f'{endian}HL', 42, ifd0_offset),
+        ifd([(0x010f, 2, len(make), values_offset), (0x8769, 4, 1, exif_offset), (0x8825, 4, 1, gps_offset)]),
+        ifd([(0x9000, 7, 4, version), (0x927c, 7, len(maker_note), maker_note_offset)]),
+        ifd([(0x0001, 2, 2, latitude_ref), (0x0002, 5, 3, latitude_offset)]),
+        make,
+        maker_note,
+        latitude,
+    ])
+    return make_segment(segment_markers.APP1.marker, b'Exif\x00\x00' + tiff), (maker_note, latitude)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_drop_private_tags(read_test_image, endian):
+    original = read_test_image('img_photoshop.jpg')
+    exif_segment, private_values = _make_exif_segment(endian)
+    data = original[:2] + exif_segment + original[2:]
+    with JpegFile.from_bytes(data, hash_scan=True) as jpeg_file:
+        assert {'Make', 'MakerNote', 'GPSLatitudeRef', 'GPSLatitude'} <= set(jpeg_file.metadata)
+        scan_hash = jpeg_file.scan_hash
+
+    stripped = _strip(data)
+    assert len(stripped) == len(data)
+    assert not any(value in stripped for value in private_values)
+    with JpegFile.from_bytes(stripped, hash_scan=True) as jpeg_file:
+        assert jpeg_file.metadata['Make'] == 'SecretCam'
+        assert jpeg_file.metadata['ExifVersion'] == '0231'
+        assert not {'MakerNote', 'GPSLatitudeRef', 'GPSLatitude'} & set(jpeg_file.metadata)
+        assert jpeg_file.scan_hash == scan_hash
+        assert jpeg_file.verify(deep=True).status == integrity.OK
+
+
+def test_damaged_exif_segment(read_test_image):
+    original = read_test_image('img_paint.jpg')
+    exif_segment, _ = _make_exif_segment('<')
+    # Break the byte order of the TIFF header, so that none of its tags can be found
+    data = original[:2] + exif_segment[:10] + b'XX' + exif_segment[12:] + original[2:]
+    with pytest.warns(UserWarning, match='EXIF segment'):
+        with pytest.raises(ValueError):
+            _strip(data)
+
+    # It can still be copied as it is, or dropped whole.
+    assert _strip(data, drop_tags=()) == data
+    with pytest.warns(UserWarning, match='EXIF segment'):
+        assert _strip(data, drop_segments=(constants.EXIF_HEADER, )) == original
+
+
+def test_drop_app_segment_by_header(read_test_image):
+    original = read_test_image('img_paint.jpg')
+    xmp_segment = make_segment(segment_markers.APP1.marker, constants.XMP_HEADER.encode() + b'\x00<x:gps>51.5</x:gps>')
+    data = original[:2] + xmp_segment + original[2:]
+    assert _strip(data, drop_segments=(constants.XMP_HEADER, )) == original
+
+
+def test_nothing_to_strip(read_test_image):
+    data = read_test_image('img_natron.jpg')
+    assert _strip(data, drop_tags=()) == data
+
+
+def test_bytes_to_path(read_test_image, tmp_path):
+    original = read_test_image('img_photoshop.jpg')
+    data = original[:2] + make_segment(segment_markers.COM.marker, b'private comment') + original[2:]
+    path = tmp_path / 'stripped.jpg'
+    with JpegFile.from_bytes(data, full_scan=True) as jpeg_file:
+        assert jpeg_file.write_stripped(str(path), drop_segments=(segment_markers.COM, )) == len(original)
+    assert path.read_bytes() == original
+
+
+def test_strip_file(read_test_image, tmp_path):
+    exif_segment, private_values = _make_exif_segment('<')
+    original = read_test_image('img_photoshop.jpg')
+    source = tmp_path / 'photo.jpg'
+    source.write_bytes(original[:2] + exif_segment + original[2:])
+
+    result = strip_file(str(source), str(tmp_path / 'stripped' / 'photo.jpg'))
+    assert result.error is None
+    stripped = (tmp_path / 'stripped' / 'photo.jpg').read_bytes()
+    assert result.length == len(stripped) == source.stat().st_size
+    assert not any(value in stripped for value in private_values)
+
+    # Refuses to overwrite the file it reads
+    result = strip_file(str(source), str(source))
+    assert result.error is not None
+    assert source.read_bytes() == original[:2] + exif_segment + original[2:]
+
+
+def test_strip_files_into_nested_directory(jpeg_directory):
+    output_directory = jpeg_directory / 'stripped'
+    for bad_directory in (jpeg_directory, output_directory):
+        with pytest.raises(ValueError):
+            strip_files(str(jpeg_directory), str(bad_directory), recursive=True)
+
+    # Only the top of the directory is read, so the copies aren't read back in.
+    results = list(strip_files(str(jpeg_directory), str(output_directory), workers=1))
+    assert sorted(result.file_path for result in results) == sorted(iter_jpeg_files(str(jpeg_directory)))
+    assert all(result.error is None for result in results)
@@ -0,0 +1,124 @@
+import os
+import pickle
+import sqlite3
+from collections import namedtuple
+
+
+Fingerprint = namedtuple('Fingerprint', "size mtime_ns inode")
+
+
+def get_fingerprint(file_path):
+    """ Get the stat fingerprint that cache entries for a file are validated against. """
+    stat_result = os.stat(file_path)
+    return Fingerprint(stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+class FileCache:
+    """ Persistent cache of values read from files, stored in a SQLite database.
+
+    Entries are keyed by file path plus an options string (for values that depend on how the file was read), and are
+    only returned while the file's stat fingerprint (size, mtime, inode) still matches. Once the stored values take up
+    more than `max_bytes`, the least recently used entries are evicted.
+    """
+    # Number of writes between commits
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, db_path, max_bytes=256 * 1024 * 1024):
+        self._db_path = db_path
+        self._max_bytes = max_bytes
+        self._connection = sqlite3.connect(db_path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "path TEXT NOT NULL, "
+            "options TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, "
+            "last_used INTEGER NOT NULL, "
+            "value BLOB NOT NULL, "
+            "PRIMARY KEY (path, options))")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+        # Total size of the stored values, and a counter that orders entries by when they were last used.
+        self._total_bytes, self._clock = self._connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0), COALESCE(MAX(last_used), 0) FROM entries").fetchone()
+        self._pending_writes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def get(self, file_path, fingerprint, options=''):
+        """ Return the cached value for a file, or None if there is none or the file has changed since. """
+        row = self._connection.execute(
+            "SELECT size, mtime_ns, inode, value FROM entries WHERE path = ? AND options = ?",
+            (file_path, options)).fetchone()
+        if row is None or Fingerprint(*row[:3]) != fingerprint:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._clock += 1
+        self._connection.execute(
+            "UPDATE entries SET last_used = ? WHERE path = ? AND options = ?", (self._clock, file_path, options))
+        self._count_write()
+        return pickle.loads(row[3])
+
+    def put(self, file_path, fingerprint, value, options=''):
+        """ Store the value read from a file, along with the fingerprint the file had before it was read. """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        row = self._connection.execute(
+            "SELECT LENGTH(value) FROM entries WHERE path = ? AND options = ?", (file_path, options)).fetchone()
+        if row is not None:
+            self._total_bytes -= row[0]
+
+        self._clock += 1
+        self._connection.execute(
+            "INSERT OR REPLACE INTO entries (path, options, size, mtime_ns, inode, last_used, value) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (file_path, options, fingerprint.size, fingerprint.mtime_ns, fingerprint.inode, self._clock, data))
+        self._total_bytes += len(data)
+
+        if self._total_bytes > self._max_bytes:
+            self._evict()
+        self._count_write()
+
+    def flush(self):
+        self._connection.commit()
+        self._pending_writes = 0
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def _count_write(self):
+        self._pending_writes += 1
+        if self._pending_writes >= self.COMMIT_INTERVAL:
+            self.flush()
+
+    def _evict(self):
+        """ Remove the least recently used entries, until the cache is back to 90% of its maximum size. """
+        target_bytes = self._max_bytes * 9 // 10
+        evicted = list()
+        rows = self._connection.execute("SELECT path, options, LENGTH(value) FROM entries ORDER BY last_used")
+        for path, options, size in rows:
+            if self._total_bytes <= target_bytes:
+                break
+            evicted.append((path, options))
+            self._total_bytes -= size
+        rows.close()
+        self._connection.executemany("DELETE FROM entries WHERE path = ? AND options = ?", evicted)
@@ -0,0 +1,131 @@
+""" A resident server that reads JPEG files for short-lived clients over a local Unix socket.
+
+Starting Python and importing jpeg_reader cost far more than reading the header of one file, so tools that would run
+jpeg_reader once per file can send their paths to a server that is already running instead. Start one with
+
+    python jpeg_reader.py --serve /tmp/jpeg_reader.sock
+
+and query it with utils/daemon_client.py. The protocol is newline-delimited JSON. Each request is a line holding
+
+    {"paths": ["/photos/a.jpg", ...], "full_scan": false, "tags": null, "hash_scan": false, "hash_tables": false}
+
+(all but "paths" are optional, and work as they do for scan_file), and is answered with a line holding
+
+    {"results": [{"file_path": ..., "resolution": ..., "pixel_aspect": ..., "segments": ..., "metadata": ...,
+                  "scan_hash": ..., "error": ...}, ...]}
+
+with a result for each path, in the same order, or {"error": "..."} if the request itself is malformed. A connection
+can carry any number of requests. Relative paths are resolved against the server's working directory.
+"""
+import concurrent.futures
+import functools
+import json
+import os
+import socket
+import socketserver
+import stat
+
+
+def serve(socket_path, workers=None, limits=None):
+    """ Answer requests on a Unix socket until interrupted. Each connection gets its own thread, and the files of every
+    request are read by a shared pool of `workers` threads (by default, the pool's default size), with `limits` (a
+    ReadLimits) if given. The socket is only accessible by the current user, and is removed when the server stops.
+    """
+    _remove_stale_socket(socket_path)
+    # Create the socket with no permissions for anyone but its owner, rather than changing them once it's listening.
+    umask = os.umask(0o177)
+    try:
+        server = _Server(socket_path, _RequestHandler)
+    finally:
+        os.umask(umask)
+    server.limits = limits
+
+    try:
+        with server, concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            server.executor = executor
+            server.serve_forever()
+    finally:
+        os.unlink(socket_path)
+
+
+def answer(request, executor=None, limits=None):
+    """ Answer a decoded request (see the module docstring), reading its files in `executor` if given. """
+    try:
+        paths = request['paths']
+        full_scan = bool(request.get('full_scan', False))
+        tags = request.get('tags')
+        hash_scan = bool(request.get('hash_scan', False))
+        hash_tables = bool(request.get('hash_tables', False))
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise ValueError("'paths' must be a list of strings")
+        if tags is not None and (not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags)):
+            raise ValueError("'tags' must be a list of strings, or null")
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        return {'error': f"Bad request: {e!r}"}
+
+    # Imported here, since jpeg_reader imports this module to start the server.
+    from jpeg_reader import scan_file
+    read = functools.partial(
+        scan_file, full_scan=full_scan, tags=tags, limits=limits, hash_scan=hash_scan, hash_tables=hash_tables)
+    results = map(read, paths) if executor is None else executor.map(read, paths)
+    return {'results': [result_to_json(result) for result in results]}
+
+
+def result_to_json(result):
+    """ Convert a ScanResult to a dict that can be serialized as JSON. Segments are given as [marker code, offset]. """
+    segments = None
+    if result.segments is not None:
+        segments = [[segment.marker.code, segment.offset] for segment in result.segments]
+    return {
+        'file_path': result.file_path,
+        'resolution': result.resolution,
+        'pixel_aspect': result.pixel_aspect,
+        'segments': segments,
+        'metadata': result.metadata,
+        'scan_hash': result.scan_hash,
+        'error': result.error,
+    }
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Set by serve(): the pool that files are read in, and the limits they are read with
+    executor = None
+    limits = None
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    response = {'error': f"Bad request: {e!r}"}
+                else:
+                    response = answer(request, self.server.executor, self.server.limits)
+                # Metadata values are builtin types; anything unexpected is sent as its string form.
+                self.wfile.write(json.dumps(response, default=str).encode() + b'\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; there is nobody left to answer.
+            pass
+
+
+def _remove_stale_socket(socket_path):
+    """ Remove a socket left behind by a server that didn't stop cleanly. Refuses to replace a running server, or
+    anything that isn't a socket.
+    """
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError(f"{socket_path} exists, and is not a socket")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            os.unlink(socket_path)
+        else:
+            raise RuntimeError(f"A server is already listening on {socket_path}")
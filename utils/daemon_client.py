@@ -0,0 +1,81 @@
+""" Thin client for the server in utils/daemon.py: sends file paths to it, and prints a JSON result for each file.
+
+    python utils/daemon_client.py /tmp/jpeg_reader.sock image.jpg ...
+    find /photos -name '*.jpg' | python utils/daemon_client.py /tmp/jpeg_reader.sock -
+
+Each result is printed on its own line, in the order the paths were given. The exit status is 1 if any file couldn't
+be read. The point of the server is to skip the cost of starting up, so this module only imports what it needs from
+the standard library, and can be run as a script from any directory.
+"""
+import json
+import os
+import socket
+import sys
+
+
+# Paths sent per request, so that long lists of paths (e.g. from stdin) are streamed rather than sent all at once.
+BATCH_SIZE = 256
+
+
+def query(socket_path, paths, full_scan=False, tags=None, batch_size=BATCH_SIZE, hash_scan=False):
+    """ Read files through the server, yielding a result dict (see utils.daemon.result_to_json) for each path, in
+    order. Paths are sent as absolute paths, but each result's file_path is the path as it was given.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile('rb') as responses:
+            batch = list()
+            for path in paths:
+                batch.append(path)
+                if len(batch) >= batch_size:
+                    yield from _send(connection, responses, batch, full_scan, tags, hash_scan)
+                    batch = list()
+            if batch:
+                yield from _send(connection, responses, batch, full_scan, tags, hash_scan)
+
+
+def _send(connection, responses, paths, full_scan, tags, hash_scan):
+    request = {
+        'paths': [os.path.abspath(path) for path in paths],
+        'full_scan': full_scan,
+        'tags': tags,
+        'hash_scan': hash_scan,
+    }
+    connection.sendall(json.dumps(request).encode() + b'\n')
+    line = responses.readline()
+    if not line:
+        raise RuntimeError("The server closed the connection without answering")
+
+    response = json.loads(line)
+    if 'error' in response:
+        raise RuntimeError(f"The server rejected the request: {response['error']}")
+    for path, result in zip(paths, response['results']):
+        result['file_path'] = path
+        yield result
+
+
+def main(argv=None):
+    # Arguments are parsed by hand, since importing argparse would take longer than a query.
+    args = sys.argv[1:] if argv is None else argv
+    full_scan = '--full-scan' in args
+    hash_scan = '--hash-scan' in args
+    args = [arg for arg in args if arg not in ('--full-scan', '--hash-scan')]
+    if len(args) < 2 or any(arg in ('-h', '--help') for arg in args):
+        print("usage: daemon_client.py [--full-scan] [--hash-scan] SOCKET PATH [PATH ...]\n"
+              "Pass - as the only PATH to read paths from stdin, one per line.", file=sys.stderr)
+        return 2
+
+    socket_path, paths = args[0], args[1:]
+    if paths == ['-']:
+        paths = (line.rstrip('\n') for line in sys.stdin if line.strip())
+
+    status = 0
+    for result in query(socket_path, paths, full_scan=full_scan, hash_scan=hash_scan):
+        print(json.dumps(result))
+        if result['error'] is not None:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,523 @@
+""" Pure Python/NumPy decoding of JPEG image data, for environments without native imaging libraries.
+
+Huffman decoding has to walk the entropy-coded data bit by bit, so it is done in Python. Everything after it works on
+all blocks at once with NumPy.
+"""
+import struct
+from array import array
+from collections import namedtuple
+
+import numpy
+
+from utils import constants
+from utils import restart
+from utils import segment_markers
+from utils.encoding import Component
+
+
+# Number of bits decoded with a single table lookup. Longer Huffman codes are rare, and are decoded one length at a
+# time.
+LOOKAHEAD_BITS = 9
+
+# Position in an 8x8 block (row-major) of each coefficient, in the zigzag order they are coded in.
+ZIGZAG = (
+    0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+)
+
+Frame = namedtuple('Frame', "marker precision height width components max_h max_v mcus_x mcus_y")
+Scan = namedtuple('Scan', "component_indexes dc_table_ids ac_table_ids ss se ah al")
+
+# Everything needed to decode restart intervals of a scan, in this process or another one; see _decode_intervals.
+ScanContext = namedtuple('ScanContext', "frame scan dc_tables ac_tables interval mcus_x mcu_count block_size")
+
+# Restart intervals are sent to an executor in (at most) this many batches per scan.
+EXECUTOR_BATCHES = 64
+
+
+class HuffmanTable:
+    """ A Huffman table from a DHT segment, set up for decoding. Codes of up to LOOKAHEAD_BITS bits are found with a
+    single lookup; longer ones are found by comparing against the largest code of each length, as in the JPEG spec
+    (F.2.2.3).
+    """
+    def __init__(self, counts, symbols):
+        self.symbols = symbols
+        # (code length << 8 | symbol) for every LOOKAHEAD_BITS-bit prefix, or 0 if the code is longer than that
+        self.lookup = [0] * (1 << LOOKAHEAD_BITS)
+        # Largest code of each length (-1 if there are none), and the offset from a code to its symbol's index
+        self.max_codes = [-1] * 17
+        self.symbol_offsets = [0] * 17
+
+        code = 0
+        k = 0
+        for length in range(1, 17):
+            count = counts[length - 1]
+            self.symbol_offsets[length] = k - code
+            for _ in range(count):
+                if length <= LOOKAHEAD_BITS:
+                    shift = LOOKAHEAD_BITS - length
+                    for prefix in range(code << shift, (code + 1) << shift):
+                        self.lookup[prefix] = length << 8 | symbols[k]
+                code += 1
+                k += 1
+            if count:
+                self.max_codes[length] = code - 1
+            code <<= 1
+
+
+class BitReader:
+    """ Reads bits, most significant first, from entropy-coded data that has already been unstuffed. Reading past the
+    end gives zero bits, like libjpeg does for truncated files.
+    """
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+        self._accumulator = 0
+        self._bits = 0
+
+    def peek(self, count):
+        """ Return the next `count` bits (at most 16) without consuming them. """
+        while self._bits < count:
+            byte = self._data[self._position] if self._position < len(self._data) else 0
+            self._position += 1
+            self._accumulator = (self._accumulator << 8) | byte
+            self._bits += 8
+        return (self._accumulator >> (self._bits - count)) & ((1 << count) - 1)
+
+    def skip(self, count):
+        if count > self._bits:
+            self.peek(count)
+        self._bits -= count
+        self._accumulator &= (1 << self._bits) - 1
+
+    def receive_extend(self, size):
+        """ Read a `size`-bit coefficient value, and extend it to its signed value (F.2.2.1). """
+        if size == 0:
+            return 0
+        value = self.peek(size)
+        self.skip(size)
+        if value < 1 << (size - 1):
+            value -= (1 << size) - 1
+        return value
+
+    def decode(self, table: HuffmanTable):
+        """ Decode the next Huffman-coded symbol. """
+        window = self.peek(16)
+        entry = table.lookup[window >> (16 - LOOKAHEAD_BITS)]
+        if entry:
+            self.skip(entry >> 8)
+            return entry & 0xff
+
+        for length in range(LOOKAHEAD_BITS + 1, 17):
+            code = window >> (16 - length)
+            if code <= table.max_codes[length]:
+                self.skip(length)
+                return table.symbols[code + table.symbol_offsets[length]]
+        raise ValueError("Corrupt JPEG data: invalid Huffman code")
+
+
+class Decoder:
+    """ Decodes the image data of a JPEG file, given its data and the segments found up to (at least) the first SOS.
+
+    Tables and the frame header are taken from the segment index. The scans themselves, and any tables defined
+    between them, are walked from there to EOI.
+    """
+    def __init__(self, buffer, segments):
+        self._buffer = buffer
+        self._segments = segments
+        self.frame = None
+        self.quantization_tables = dict()
+        self.dc_tables = dict()
+        self.ac_tables = dict()
+        self.restart_interval = 0
+        self.adobe_transform = None
+
+    def decode_dc(self, executor=None):
+        """ Decode the DC coefficient of every block, and return the mean of each block as an image at 1/8 scale (one
+        pixel per block): uint8, shaped (height, width) for grayscale or (height, width, 3) for RGB.
+
+        AC coefficients still have to be Huffman decoded to find where each block ends, but they are thrown away, so
+        there is no dequantization or IDCT. Progressive files only need their first (DC) scans. See decode for
+        `executor`.
+        """
+        self._read_frame(allowed_markers=(segment_markers.SOF0, segment_markers.SOF1, segment_markers.SOF2))
+        frame = self.frame
+        dc_values = self._decode_blocks((0, 0, frame.mcus_x, frame.mcus_y), block_size=1, executor=executor)
+
+        planes = list()
+        for c, values in zip(frame.components, dc_values):
+            quantization = self.quantization_tables[c.table_id]
+            # The DC coefficient is 8 times the mean of the block's (level shifted) samples.
+            blocks = values[:, :, 0] * (quantization[0] / 8.0) + 128.0
+            planes.append(_upsample(blocks, frame.max_h // c.h, frame.max_v // c.v))
+
+        height = _ceil_div(frame.height, 8)
+        width = _ceil_div(frame.width, 8)
+        return self._to_image([plane[:height, :width] for plane in planes])
+
+    def decode(self, box=None, executor=None):
+        """ Decode the full image, or the region within `box` (left, top, right, bottom): uint8, shaped (height, width)
+        for grayscale or (height, width, 3) for RGB.
+
+        Huffman decoding fills a table of coefficients for each component. Dequantization, the IDCT, upsampling and
+        colour conversion are then done on all blocks at once.
+
+        Files with a restart interval can be decoded one interval at a time. Only the intervals that cover `box` are
+        decoded, and if an executor (e.g. a ProcessPoolExecutor) is given, they are decoded in parallel in it.
+        """
+        self._read_frame(allowed_markers=(segment_markers.SOF0, segment_markers.SOF1))
+        frame = self.frame
+        if box is None:
+            box = (0, 0, frame.width, frame.height)
+        left, top, right, bottom = box
+        if not 0 <= left < right <= frame.width or not 0 <= top < bottom <= frame.height:
+            raise ValueError(f"Box {box} is not within the {frame.width}x{frame.height} image")
+
+        # The MCUs that cover the box
+        mcu_width = 8 * frame.max_h
+        mcu_height = 8 * frame.max_v
+        mcu_box = (left // mcu_width, top // mcu_height, _ceil_div(right, mcu_width), _ceil_div(bottom, mcu_height))
+        coefficients = self._decode_blocks(mcu_box, block_size=64, executor=executor)
+
+        planes = list()
+        for c, values in zip(frame.components, coefficients):
+            blocks_y, blocks_x = values.shape[:2]
+            blocks = values.astype(numpy.float32).reshape(-1, 8, 8)
+
+            # Dequantize; tables are stored in zigzag order.
+            quantization = numpy.zeros(64, dtype=numpy.float32)
+            quantization[list(ZIGZAG)] = self.quantization_tables[c.table_id]
+            blocks *= quantization.reshape(8, 8)
+
+            # 2D IDCT of every block: C^T . F . C, with C the 8x8 DCT basis.
+            samples = numpy.matmul(numpy.matmul(_IDCT_BASIS.T, blocks), _IDCT_BASIS) + 128.0
+
+            # Lay the blocks out as a plane, then scale it up to the size of the largest component.
+            plane = samples.reshape(blocks_y, blocks_x, 8, 8).transpose(0, 2, 1, 3).reshape(blocks_y * 8, blocks_x * 8)
+            planes.append(_upsample(plane, frame.max_h // c.h, frame.max_v // c.v))
+
+        # The planes start at the top left corner of the first MCU.
+        x = left - mcu_box[0] * mcu_width
+        y = top - mcu_box[1] * mcu_height
+        return self._to_image([plane[y:y + bottom - top, x:x + right - left] for plane in planes])
+
+    def _read_frame(self, allowed_markers):
+        """ Read the tables and frame header that come before the first scan. """
+        for segment in self._segments:
+            if segment.marker is segment_markers.SOS:
+                break
+            self._read_table_segment(segment.marker, segment.offset)
+
+        if self.frame is None:
+            raise ValueError("JPEG file has no frame header (SOF segment)")
+        elif self.frame.marker not in allowed_markers:
+            raise RuntimeError(f"Unsupported JPEG frame type: {self.frame.marker}")
+        elif self.frame.precision != 8:
+            raise RuntimeError(f"Unsupported sample precision: {self.frame.precision} bits")
+        elif len(self.frame.components) not in (1, 3):
+            raise RuntimeError(f"Unsupported number of components: {len(self.frame.components)}")
+
+    def _read_table_segment(self, marker, offset):
+        """ Read a segment that sets up decoding: tables, the restart interval, the frame header, or Adobe's colour
+        transform flag. Other segments are ignored.
+        """
+        buffer = self._buffer
+        start = offset + 4
+        end = offset + 2 + struct.unpack_from('>H', buffer, offset + 2)[0]
+
+        if marker is segment_markers.DQT:
+            position = start
+            while position < end:
+                precision, table_id = buffer[position] >> 4, buffer[position] & 0x0f
+                value_format = '>64H' if precision else '64B'
+                self.quantization_tables[table_id] = struct.unpack_from(value_format, buffer, position + 1)
+                position += 1 + 64 * (2 if precision else 1)
+        elif marker is segment_markers.DHT:
+            position = start
+            while position < end:
+                table_class, table_id = buffer[position] >> 4, buffer[position] & 0x0f
+                counts = struct.unpack_from('16B', buffer, position + 1)
+                symbols = struct.unpack_from(f'{sum(counts)}B', buffer, position + 17)
+                tables = self.ac_tables if table_class else self.dc_tables
+                tables[table_id] = HuffmanTable(counts, symbols)
+                position += 17 + sum(counts)
+        elif marker is segment_markers.DRI:
+            self.restart_interval = struct.unpack_from('>H', buffer, start)[0]
+        elif marker in segment_markers.SOF_MARKERS:
+            precision, height, width, component_count = struct.unpack_from('>B2HB', buffer, start)
+            components = list()
+            for x in range(component_count):
+                component_id, sampling, table_id = struct.unpack_from('3B', buffer, start + 6 + x * 3)
+                components.append(Component(component_id, sampling >> 4, sampling & 0x0f, table_id))
+            max_h = max(c.h for c in components)
+            max_v = max(c.v for c in components)
+            mcus_x = _ceil_div(width, 8 * max_h)
+            mcus_y = _ceil_div(height, 8 * max_v)
+            self.frame = Frame(marker, precision, height, width, components, max_h, max_v, mcus_x, mcus_y)
+        elif marker is segment_markers.APPE:
+            header = struct.unpack_from('5s', buffer, start)[0]
+            if header == constants.ADOBE_HEADER.encode() and end - start >= 12:
+                self.adobe_transform = buffer[start + 11]
+
+    def _iter_scans(self):
+        """ Yield each scan header, along with the index of its restart intervals. The tables defined between scans are
+        read along the way.
+        """
+        buffer = self._buffer
+        frame = self.frame
+        position = next(s.offset for s in self._segments if s.marker is segment_markers.SOS)
+        while position + 4 <= len(buffer):
+            marker = segment_markers.get_segment_marker(buffer[position] << 8 | buffer[position + 1])
+            if marker is segment_markers.EOI:
+                break
+            elif marker in segment_markers.STANDALONE_MARKERS or marker is None:
+                position += 1 if marker is None else 2
+                continue
+
+            segment_end = position + 2 + struct.unpack_from('>H', buffer, position + 2)[0]
+            if marker is not segment_markers.SOS:
+                self._read_table_segment(marker, position)
+                position = segment_end
+                continue
+
+            scan = self._read_scan_header(position)
+            marker_offsets, scan_end = restart.find_restart_markers(buffer, segment_end)
+            mcus_x, mcus_y = restart.scan_mcu_grid(
+                frame.width, frame.height, [(c.h, c.v) for c in frame.components], scan.component_indexes)
+            yield scan, restart.RestartIndex(
+                self.restart_interval, mcus_x, mcus_y, segment_end, scan_end, marker_offsets)
+            position = scan_end
+
+    def _read_scan_header(self, offset):
+        buffer = self._buffer
+        component_count = buffer[offset + 4]
+        component_ids = [c.id for c in self.frame.components]
+        component_indexes = list()
+        dc_table_ids = list()
+        ac_table_ids = list()
+        for x in range(component_count):
+            component_id, table_ids = struct.unpack_from('2B', buffer, offset + 5 + x * 2)
+            component_indexes.append(component_ids.index(component_id))
+            dc_table_ids.append(table_ids >> 4)
+            ac_table_ids.append(table_ids & 0x0f)
+        ss, se, approximation = struct.unpack_from('3B', buffer, offset + 5 + component_count * 2)
+        return Scan(component_indexes, dc_table_ids, ac_table_ids, ss, se, approximation >> 4, approximation & 0x0f)
+
+    def _decode_blocks(self, mcu_box, block_size, executor=None):
+        """ Decode the blocks within a box of MCUs (left, top, right, bottom) from every scan. Returns an array for each
+        component, shaped (block rows, block columns, block_size). With a block size of 1, only DC coefficients are
+        kept; with 64, every coefficient is kept, in row-major order.
+        """
+        frame = self.frame
+        mcu_left, mcu_top, mcu_right, mcu_bottom = mcu_box
+        component_blocks = [
+            numpy.zeros(((mcu_bottom - mcu_top) * c.v, (mcu_right - mcu_left) * c.h, block_size), dtype=numpy.int32)
+            for c in frame.components]
+
+        for scan, index in self._iter_scans():
+            if frame.marker is segment_markers.SOF2 and (scan.ss != 0 or scan.ah != 0):
+                # Only the first DC scan of a progressive file is needed; the others refine it, or hold AC values.
+                continue
+
+            context = ScanContext(
+                frame=frame,
+                scan=scan,
+                dc_tables=[self.dc_tables[table_id] for table_id in scan.dc_table_ids],
+                ac_tables=[self.ac_tables.get(table_id) for table_id in scan.ac_table_ids],
+                interval=index.interval or index.mcu_count,
+                mcus_x=index.mcus_x,
+                mcu_count=index.mcu_count,
+                block_size=block_size)
+            numbers = self._intervals_in_box(scan, index, mcu_box)
+            jobs = [(number, self._read_interval(index, number)) for number in numbers]
+            if not jobs:
+                # No restart interval of this scan covers the box
+                continue
+            elif executor is None:
+                results = [_decode_intervals(context, jobs)]
+            else:
+                batch_size = _ceil_div(len(jobs), EXECUTOR_BATCHES)
+                futures = [
+                    executor.submit(_decode_intervals, context, jobs[x:x + batch_size])
+                    for x in range(0, len(jobs), batch_size)]
+                results = (future.result() for future in futures)
+
+            for result in results:
+                for component_index, (block_indexes, values) in zip(scan.component_indexes, result):
+                    blocks = component_blocks[component_index]
+                    self._place_blocks(blocks, component_index, mcu_box, block_indexes, values)
+        return component_blocks
+
+    def _intervals_in_box(self, scan, index, mcu_box):
+        """ Numbers of the restart intervals of a scan that hold MCUs within a box of the frame's MCUs. """
+        mcu_left, mcu_top, mcu_right, mcu_bottom = mcu_box
+        if not index.interval:
+            return [0]
+
+        # Scans of a single component code each of its blocks as an MCU.
+        scale_x = scale_y = 1
+        if len(scan.component_indexes) == 1:
+            c = self.frame.components[scan.component_indexes[0]]
+            scale_x, scale_y = c.h, c.v
+        column_start = mcu_left * scale_x
+        column_end = min(mcu_right * scale_x, index.mcus_x)
+        if column_start >= column_end:
+            return []
+
+        numbers = set()
+        for row in range(mcu_top * scale_y, min(mcu_bottom * scale_y, index.mcus_y)):
+            numbers.update(range(index.interval_at(row, column_start), index.interval_at(row, column_end - 1) + 1))
+        return sorted(numbers)
+
+    def _read_interval(self, index, number):
+        """ The entropy-coded data of a restart interval, unstuffed. """
+        start, end = index.interval_range(number)
+        return bytes(self._buffer[start:end]).replace(b'\xff\x00', b'\xff')
+
+    def _place_blocks(self, blocks, component_index, mcu_box, block_indexes, values):
+        """ Copy decoded blocks of a component into its array of blocks for an MCU box, dropping those outside it. """
+        if not block_indexes:
+            return
+        c = self.frame.components[component_index]
+        rows, columns = numpy.divmod(numpy.frombuffer(block_indexes, dtype=numpy.int32), self.frame.mcus_x * c.h)
+        rows -= mcu_box[1] * c.v
+        columns -= mcu_box[0] * c.h
+        inside = (rows >= 0) & (rows < blocks.shape[0]) & (columns >= 0) & (columns < blocks.shape[1])
+        values = numpy.frombuffer(values, dtype=numpy.int32).reshape(-1, blocks.shape[2])
+        blocks[rows[inside], columns[inside]] = values[inside]
+
+    def _to_image(self, planes):
+        """ Convert component planes of level shifted samples to a uint8 image. """
+        if len(planes) == 1:
+            return _to_uint8(planes[0])
+
+        y, cb, cr = planes
+        rgb_ids = [c.id for c in self.frame.components] == [ord('R'), ord('G'), ord('B')]
+        if self.adobe_transform == 0 or (self.adobe_transform is None and rgb_ids):
+            # The components are already RGB.
+            return _to_uint8(numpy.stack(planes, axis=-1))
+
+        # YCbCr to RGB, as defined by JFIF
+        cb = cb - 128.0
+        cr = cr - 128.0
+        r = y + 1.402 * cr
+        g = y - 0.344136 * cb - 0.714136 * cr
+        b = y + 1.772 * cb
+        return _to_uint8(numpy.stack((r, g, b), axis=-1))
+
+
+def _decode_intervals(context: ScanContext, jobs):
+    """ Decode restart intervals of a scan, given as (interval number, unstuffed data). Returns, for each component in
+    the scan, the index of each block decoded (row-major, in the component's grid of blocks) and its values
+    (block_size per block), in the order they were decoded.
+
+    This only needs the context and the data, so that it can run in another process.
+    """
+    frame = context.frame
+    scan = context.scan
+    components = [frame.components[i] for i in scan.component_indexes]
+    blocks_x = [frame.mcus_x * c.h for c in components]
+    # Progressive DC scans have no AC coefficients, but their DC values are shifted by the successive approximation
+    # bit position.
+    has_ac = frame.marker is not segment_markers.SOF2
+    block_size = context.block_size
+    empty_block = array('i', [0]) * block_size
+
+    # Blocks of each component in an interleaved MCU, as offsets from the MCU's first block
+    interleaved = len(components) > 1
+    mcu_block_offsets = [
+        [v * blocks_x[n] + h for v in range(c.v) for h in range(c.h)]
+        for n, c in enumerate(components)]
+
+    block_indexes = [array('i') for _ in components]
+    values = [array('i') for _ in components]
+    for number, data in jobs:
+        # Each restart interval starts with fresh data and predictions.
+        reader = BitReader(data)
+        predictions = [0] * len(components)
+        first_mcu = number * context.interval
+        for mcu in range(first_mcu, min(first_mcu + context.interval, context.mcu_count)):
+            mcu_y, mcu_x = divmod(mcu, context.mcus_x)
+            for n, c in enumerate(components):
+                if interleaved:
+                    first_block = mcu_y * c.v * blocks_x[n] + mcu_x * c.h
+                    mcu_blocks = [first_block + offset for offset in mcu_block_offsets[n]]
+                else:
+                    mcu_blocks = [mcu_y * blocks_x[n] + mcu_x]
+
+                for block_index in mcu_blocks:
+                    base = len(values[n])
+                    block_indexes[n].append(block_index)
+                    values[n].extend(empty_block)
+
+                    predictions[n] += reader.receive_extend(reader.decode(context.dc_tables[n]))
+                    values[n][base] = predictions[n] << scan.al
+                    if not has_ac:
+                        pass
+                    elif block_size == 1:
+                        _skip_ac(reader, context.ac_tables[n])
+                    else:
+                        _decode_ac(reader, context.ac_tables[n], values[n], base)
+    return list(zip(block_indexes, values))
+
+
+def _decode_ac(reader: BitReader, table: HuffmanTable, values, base):
+    """ Decode the AC coefficients of a block (F.2.2.2) into values, from index `base` on, in row-major order. """
+    k = 1
+    while k < 64:
+        symbol = reader.decode(table)
+        run, size = symbol >> 4, symbol & 0x0f
+        if size:
+            k += run
+            values[base + ZIGZAG[k]] = reader.receive_extend(size)
+            k += 1
+        elif run == 15:
+            k += 16
+        else:
+            break
+
+
+def _skip_ac(reader: BitReader, table: HuffmanTable):
+    """ Read past the AC coefficients of a block (F.2.2.2), without keeping them. """
+    k = 1
+    while k < 64:
+        symbol = reader.decode(table)
+        run, size = symbol >> 4, symbol & 0x0f
+        if size:
+            reader.skip(size)
+            k += run + 1
+        elif run == 15:
+            k += 16
+        else:
+            break
+
+
+def _make_idct_basis():
+    """ The 8x8 DCT basis: C[u, x] = c(u) / 2 * cos((2x + 1) * u * pi / 16), with c(0) = 1 / sqrt(2) and c(u) = 1. """
+    u = numpy.arange(8).reshape(8, 1)
+    x = numpy.arange(8).reshape(1, 8)
+    basis = numpy.cos((2 * x + 1) * u * numpy.pi / 16) / 2
+    basis[0] /= numpy.sqrt(2)
+    return basis.astype(numpy.float32)
+
+
+_IDCT_BASIS = _make_idct_basis()
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+def _upsample(plane, factor_x, factor_y):
+    """ Scale a component plane up to the size of the largest component, by repeating samples. """
+    if factor_x > 1:
+        plane = numpy.repeat(plane, factor_x, axis=1)
+    if factor_y > 1:
+        plane = numpy.repeat(plane, factor_y, axis=0)
+    return plane
+
+
+def _to_uint8(samples):
+    return numpy.clip(numpy.rint(samples), 0, 255).astype(numpy.uint8)
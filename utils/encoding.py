@@ -0,0 +1,109 @@
+""" How a JPEG file was encoded, from its header alone: the quality its quantization tables correspond to, and its
+chroma subsampling.
+"""
+import functools
+import operator
+from collections import namedtuple
+
+
+Component = namedtuple('Component', "id h v table_id")
+
+# `quality` is the IJG (libjpeg) quality factor, 1-100, whose tables are closest to the file's. `exact` is set if the
+# file's tables are exactly the ones libjpeg writes at that quality; other encoders' tables only approximate it.
+QualityEstimate = namedtuple('QualityEstimate', "quality exact")
+
+# The example tables from Annex K of the JPEG standard, which libjpeg scales by its quality factor. They are in zigzag
+# order, like the tables in a DQT segment.
+LUMINANCE_TABLE = (
+    16, 11, 12, 14, 12, 10, 16, 14, 13, 14, 18, 17, 16, 19, 24, 40,
+    26, 24, 22, 22, 24, 49, 35, 37, 29, 40, 58, 51, 61, 60, 57, 51,
+    56, 55, 64, 72, 92, 78, 64, 68, 87, 69, 55, 56, 80, 109, 81, 87,
+    95, 98, 103, 104, 103, 62, 77, 113, 121, 112, 100, 120, 92, 101, 103, 99,
+)
+CHROMINANCE_TABLE = (
+    17, 18, 18, 24, 21, 24, 47, 26, 26, 47, 99, 66, 56, 66, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99, 99,
+)
+
+# Qualities on either side of the first guess that are tried for an exact match
+_QUALITY_SEARCH_RADIUS = 2
+
+
+def scale_table(table, quality, max_value=255):
+    """ Scale a table by an IJG quality factor, the way libjpeg does. Baseline files limit values to 255. """
+    scale = 5000 // quality if quality < 50 else 200 - quality * 2
+    return tuple(min(max((value * scale + 50) // 100, 1), max_value) for value in table)
+
+
+def estimate_quality(luminance, chrominance=None):
+    """ Estimate the IJG quality factor of a file from its luminance table and, for colour files, its chrominance
+    table (each 64 values, in zigzag order). Returns a QualityEstimate.
+    """
+    tables = (tuple(luminance), ) if chrominance is None else (tuple(luminance), tuple(chrominance))
+    max_value = 255 if max(map(max, tables)) <= 255 else 32767
+    guess = _guess_quality(tables, max_value)
+
+    # Rounding within each value blurs the scale, so nearby qualities are tried too, closest first. Files written by
+    # libjpeg match one exactly; for the rest, whichever gives the closest tables is picked.
+    candidates = sorted(
+        range(max(1, guess - _QUALITY_SEARCH_RADIUS), min(100, guess + _QUALITY_SEARCH_RADIUS) + 1),
+        key=lambda quality: abs(quality - guess))
+    for quality in candidates:
+        if _standard_tables(quality, max_value)[:len(tables)] == tables:
+            return QualityEstimate(quality, True)
+    errors = [
+        sum(sum(map(abs, map(operator.sub, table, standard)))
+            for table, standard in zip(tables, _standard_tables(quality, max_value)))
+        for quality in candidates]
+    return QualityEstimate(candidates[errors.index(min(errors))], False)
+
+
+def chroma_subsampling(components):
+    """ The J:a:b name of the chroma subsampling of a frame's components (e.g. '4:2:0'), '4:0:0' for a single
+    component, or None if the sampling factors don't match a common scheme.
+    """
+    if len(components) == 1:
+        return '4:0:0'
+    elif any(not component.h or not component.v for component in components[:3]):
+        # Sampling factors run from 1 to 4; a 0 comes from a damaged frame header.
+        return None
+    luma, chroma = components[0], components[1:3]
+    h, v = chroma[0].h, chroma[0].v
+    if any((component.h, component.v) != (h, v) for component in chroma) or (4 * h) % luma.h:
+        return None
+
+    # a = chroma samples in a row of 4 pixels; b = chroma samples in the row below, which are either new or shared
+    a = 4 * h // luma.h
+    if v == luma.v:
+        b = a
+    elif 2 * v == luma.v:
+        b = 0
+    else:
+        return None
+    return f"4:{a}:{b}"
+
+
+def _guess_quality(tables, max_value):
+    """ First guess at the quality. libjpeg scales every value by the same percentage, so the ratio of the sums of the
+    tables to the sums of the standard ones gives it. Values that were clamped to 1 or to the maximum would skew it, so
+    they are left out unless nothing else is left.
+    """
+    actual_sum = standard_sum = 0
+    for table, standard in zip(tables, (LUMINANCE_TABLE, CHROMINANCE_TABLE)):
+        for value, standard_value in zip(table, standard):
+            if 1 < value < max_value:
+                actual_sum += value
+                standard_sum += standard_value
+    if not standard_sum:
+        return 100 if max(map(max, tables)) <= 1 else 1
+
+    scale = 100 * actual_sum / standard_sum
+    return min(max(round((200 - scale) / 2 if scale <= 100 else 5000 / scale), 1), 100)
+
+
+@functools.lru_cache(maxsize=None)
+def _standard_tables(quality, max_value):
+    """ The luminance and chrominance tables libjpeg writes at a quality, computed once for each. """
+    return scale_table(LUMINANCE_TABLE, quality, max_value), scale_table(CHROMINANCE_TABLE, quality, max_value)
@@ -1,3 +1,4 @@
+import functools
 import struct
 
 
@@ -130,6 +131,11 @@ gpsinfo_tag_names = {
     0x1e: "GPSDifferential",
 }
 
+# Names of the tags in each IFD, for working out which IFDs need to be read for a set of tags.
+tiff_tag_name_set = frozenset(tiff_tag_names.values())
+exif_tag_name_set = frozenset(exif_tag_names.values())
+gpsinfo_tag_name_set = frozenset(gpsinfo_tag_names.values())
+
 tag_types = {
     1: "B",  # BYTE
     2: "s",  # ASCII
@@ -142,24 +148,60 @@ tag_types = {
 }
 
 
+# Size in bytes of a single value of each tag type.
+tag_type_sizes = {
+    'B': 1,
+    's': 1,
+    None: 1,
+    'H': 2,
+    'L': 4,
+    'l': 4,
+    '2L': 8,
+    '2l': 8,
+}
+
+
 def get_byte_count(tag_type, count):
     """ Return the number of bytes for a given tag. """
-    if tag_type in ['B', 's', None]:
-        tag_bytes = 1
-    elif tag_type in ['H']:
-        tag_bytes = 2
-    elif tag_type in ['L', 'l']:
-        tag_bytes = 4
-    elif tag_type in ['2L', '2l']:
-        tag_bytes = 8
-    else:
+    tag_bytes = tag_type_sizes.get(tag_type)
+    if tag_bytes is None:
         raise RuntimeError(f"Unsupported tag type: {tag_type}")
     return tag_bytes * count
 
 
-def unpack_standard_ifd_value(string: bytes, endian, tag_type):
-    """ Unpacks a value from an ifd string, as long as its value is not UNDEFINED. """
-    value = struct.unpack(f'{endian}{tag_type}', string)
+@functools.lru_cache(maxsize=512)
+def get_struct(fmt):
+    """ Return a compiled struct for a format string. Formats built on the fly are cached here, so they are only
+    parsed once. Only formats drawn from a small, fixed set belong here: never one built from a count read from a file,
+    which a hostile file could make huge and different every time.
+    """
+    return struct.Struct(fmt)
+
+
+def unpack_ifd_entries(buffer, endian, ifd_offset, interop_count):
+    """ Unpack the table of `interop_count` 12-byte entries that follows the entry count of the IFD at `ifd_offset`.
+    Each entry unpacks to 4 values: tag id, type id, count, and the 4-byte value field as an unsigned LONG (the value
+    offset, when the value doesn't fit). Raises struct.error if the table runs past the end of the buffer.
+    """
+    entry_struct = get_struct(f'{endian}HHLL')
+    start = ifd_offset + 2
+    end = start + interop_count * 12
+    if end > len(buffer):
+        raise struct.error(f"IFD at {hex(ifd_offset)} has {interop_count} entries, which run past the end of the data")
+    return [entry_struct.unpack_from(buffer, offset) for offset in range(start, end, 12)]
+
+
+def pack_ifd_entries(endian, entries):
+    """ Pack (tag id, type id, count, value field) entries into a table of IFD entries; see unpack_ifd_entries. """
+    entry_struct = get_struct(f'{endian}HHLL')
+    return b''.join(entry_struct.pack(*entry) for entry in entries)
+
+
+def unpack_standard_ifd_value(string: bytes, endian, tag_type, offset=0):
+    """ Unpacks a value from an ifd string (or any buffer, at the given offset), as long as its value is not
+    UNDEFINED. """
+    # String formats hold the count from the file (e.g. '20s'); see unpack_standard_ifd_values.
+    value = struct.unpack_from(f'{endian}{tag_type}', string, offset)
 
     # Format values for metadata
     if value is None:
@@ -168,7 +210,7 @@ def unpack_standard_ifd_value(string: bytes, endian, tag_type):
         value = value[0]
     elif len(value) == 2:
         # Rational numbers
-        value = value[0] / value[1]
+        value = rational_value(*value)
     if tag_type.endswith('s'):
         # Strings
         null = struct.pack('B', 0x00)
@@ -178,7 +220,26 @@ def unpack_standard_ifd_value(string: bytes, endian, tag_type):
     return value
 
 
-def unpack_undefined_ifd_value(tag_id, string, count):
+def unpack_standard_ifd_values(string: bytes, endian, tag_type, count, offset=0):
+    """ Unpacks an array of `count` values of the same type in one go, as long as their type is not UNDEFINED. The count
+    comes from the file, so the format is left to struct's own small cache rather than get_struct.
+    """
+    if tag_type.startswith('2'):
+        # Rational numbers; unpack numerators and denominators together, then pair them up.
+        values = struct.unpack_from(f'{endian}{count * 2}{tag_type[1:]}', string, offset)
+        return [rational_value(numerator, denominator) for numerator, denominator in zip(values[0::2], values[1::2])]
+    return list(struct.unpack_from(f'{endian}{count}{tag_type}', string, offset))
+
+
+def rational_value(numerator, denominator):
+    """ The value of a RATIONAL or SRATIONAL, or None if its denominator is 0 (which some cameras write for values they
+    don't know). """
+    if denominator == 0:
+        return None
+    return numerator / denominator
+
+
+def unpack_undefined_ifd_value(tag_id, string, count, offset=0):
     """ Each UNDEFINED ifd type has its own unique data structure.
     See Exif 2.2 specs starting on p.17 for a complete list of UNDEFINED data types and how to read them.
     ToDo: This can be greatly expanded upon should the need arise.
@@ -190,28 +251,28 @@ def unpack_undefined_ifd_value(tag_id, string, count):
         0x927c: unpack_maker_note,  # MakerNote
     }
 
-    def _unpack_unknown(_string, _count):
+    def _unpack_unknown(_string, _count, _offset):
         return None
 
     unpack_fn = unpack_fn_dispatch_table.get(tag_id, _unpack_unknown)
-    value = unpack_fn(string, count)
+    value = unpack_fn(string, count, offset)
     return value
 
 
-def unpack_exif_version(string, count):
-    value = struct.unpack(f'>{count}s', string)[0]
+def unpack_exif_version(string, count, offset=0):
+    value = struct.unpack_from(f'>{count}s', string, offset)[0]
     value = value.decode('utf-8')
     return value
 
 
-def unpack_flashpix_version(string, count):
-    value = struct.unpack(f'>{count}s', string)[0]
+def unpack_flashpix_version(string, count, offset=0):
+    value = struct.unpack_from(f'>{count}s', string, offset)[0]
     value = value.decode('utf-8')
     return value
 
 
-def unpack_components_configuration(string, count):
-    value = struct.unpack(f'>{count}B', string)
+def unpack_components_configuration(string, count, offset=0):
+    value = struct.unpack_from(f'>{count}B', string, offset)
     if value == (4, 5, 6, 0):
         value = "RGB"
     elif value == (1, 2, 3, 0):
@@ -219,8 +280,8 @@ def unpack_components_configuration(string, count):
     return value
 
 
-def unpack_maker_note(string, count):
-    value = struct.unpack(f'>{count}s', string)[0]
+def unpack_maker_note(string, count, offset=0):
+    value = struct.unpack_from(f'>{count}s', string, offset)[0]
     value = value.decode('utf-8')
     return value
 
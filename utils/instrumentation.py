@@ -0,0 +1,134 @@
+import contextlib
+import os
+import time
+
+
+# Callables that are passed (file_path, stats) for each instrumented file read by a batch; see add_hook.
+_hooks = list()
+
+
+def add_hook(hook):
+    """ Register a callable to be passed (file_path, ReadStats) for every instrumented file that scan_files reads, e.g.
+    to export the stats to a metrics pipeline. Hooks are called from the thread iterating over the results.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def emit(file_path, stats):
+    """ Pass the stats for a file to every registered hook. """
+    for hook in list(_hooks):
+        hook(file_path, stats)
+
+
+class ReadStats:
+    """ Where the time went while reading JPEG files, and how much I/O it took.
+
+    `phases` maps each phase to the wall time spent in it, in seconds:
+        open = Opening and mapping (or reading) the file, i.e. filesystem latency
+        markers = The marker pass over the segments
+        sof = Decoding the resolution from the SOF segment
+        tables = Reading the quantization tables and frame components, for the quality and chroma subsampling
+        jfif = Decoding the JFIF APP0 segment
+        ifd0, exif_ifd, gps_ifd = Decoding each EXIF IFD
+        ifd1 = Locating the embedded thumbnail, through IFD1
+    Phases that never ran are left out.
+
+    `reads` and `seeks` count calls on the file object (memory-mapped files need neither). `bytes_read` counts bytes
+    returned by those reads, `bytes_mapped` the size of memory-mapped files, and `bytes_scanned` how far into each file
+    the marker pass got.
+
+    A single ReadStats can be passed to several JpegFile objects to add up their stats, or the stats of separate files
+    can be added up afterwards with merge() or total().
+    """
+    def __init__(self):
+        self.files = 0
+        self.phases = dict()
+        self.reads = 0
+        self.seeks = 0
+        self.bytes_read = 0
+        self.bytes_mapped = 0
+        self.bytes_scanned = 0
+
+    def __repr__(self):
+        return f"ReadStats({self.as_dict()})"
+
+    def __str__(self):
+        lines = [
+            f"files: {self.files}, reads: {self.reads}, seeks: {self.seeks}, bytes read: {self.bytes_read}, "
+            f"bytes mapped: {self.bytes_mapped}, bytes scanned: {self.bytes_scanned}"]
+        for phase, seconds in self.phases.items():
+            per_file = seconds / self.files if self.files else 0.0
+            lines.append(f"{phase}: {seconds * 1000:.3f} ms ({per_file * 1000:.3f} ms per file)")
+        return "\n".join(lines)
+
+    @property
+    def total_time(self):
+        return sum(self.phases.values())
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """ Add the wall time spent in the `with` block to a phase. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + time.perf_counter() - start
+
+    def merge(self, other):
+        """ Add another ReadStats to this one, and return this one. """
+        self.files += other.files
+        for phase, seconds in other.phases.items():
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.reads += other.reads
+        self.seeks += other.seeks
+        self.bytes_read += other.bytes_read
+        self.bytes_mapped += other.bytes_mapped
+        self.bytes_scanned += other.bytes_scanned
+        return self
+
+    @classmethod
+    def total(cls, stats):
+        """ Add up an iterable of ReadStats (None entries are skipped) into a new ReadStats. """
+        total = cls()
+        for item in stats:
+            if item is not None:
+                total.merge(item)
+        return total
+
+    def as_dict(self):
+        """ The stats as builtin types, e.g. for serializing to JSON. """
+        return {
+            'files': self.files,
+            'phases': dict(self.phases),
+            'reads': self.reads,
+            'seeks': self.seeks,
+            'bytes_read': self.bytes_read,
+            'bytes_mapped': self.bytes_mapped,
+            'bytes_scanned': self.bytes_scanned,
+        }
+
+
+class CountingStream:
+    """ Wraps a binary stream, counting read and seek calls, and bytes read, into a ReadStats. Every other attribute is
+    passed through to the stream.
+    """
+    def __init__(self, stream, stats: ReadStats):
+        self._stream = stream
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._stats.reads += 1
+        self._stats.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._stats.seeks += 1
+        return self._stream.seek(offset, whence)
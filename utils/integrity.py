@@ -0,0 +1,104 @@
+""" Structural checks of JPEG files, to spot truncated or damaged ones (e.g. interrupted uploads) without decoding them.
+
+Unlike the marker pass, which looks for the next marker when a segment's length doesn't lead to one, these checks are
+strict: every length field has to land on a marker.
+"""
+import struct
+from collections import namedtuple
+
+from utils import scanner
+from utils import segment_markers
+
+
+# Statuses
+OK = 'ok'
+NOT_JPEG = 'not-jpeg'  # The file doesn't start with an SOI marker
+TRUNCATED = 'truncated'  # The file ends before the EOI marker
+TRAILING_GARBAGE = 'trailing-garbage'  # There is data after the EOI marker
+BAD_SEGMENT_LENGTH = 'bad-segment-length'  # A segment's length field doesn't lead to the next marker
+BAD_RESTART_SEQUENCE = 'bad-restart-sequence'  # RST markers are out of order (only checked by a deep check)
+
+# `offset` is where the problem was found: the first byte after EOI for trailing garbage, the end of the file when it
+# is truncated, the segment or marker at fault otherwise. None for files that are ok.
+Verification = namedtuple('Verification', "status offset detail")
+
+_SOI_BYTES = struct.pack('>H', segment_markers.SOI.marker)
+_EOI_BYTES = struct.pack('>H', segment_markers.EOI.marker)
+_RST_MARKERS = frozenset(marker.marker for marker in segment_markers.RST_MARKERS)
+
+
+def verify_buffer(buffer, deep=False):
+    """ Check the structure of a JPEG file held in a buffer (bytes, mmap, memoryview), and return a Verification.
+
+    The quick check walks the segment lengths from SOI to the first SOS, then checks that the file ends with EOI, so
+    only the start and end of the file are read. If it doesn't end with EOI, the rest of the file is walked to tell a
+    truncated file from one with trailing garbage. A deep check always walks the whole file, and also checks that the
+    RST markers of each scan count up from RST0, wrapping after RST7.
+    """
+    length = len(buffer)
+    if length < 2 and buffer[:length] == _SOI_BYTES[:length]:
+        return Verification(TRUNCATED, length, "The file ends within the SOI marker")
+    elif buffer[:2] != _SOI_BYTES:
+        return Verification(NOT_JPEG, 0, "The file doesn't start with an SOI marker")
+
+    position = 2
+    segment_offset = 0
+    in_scan = False
+    walk_to_end = deep
+    restart_number = 0
+    while True:
+        if in_scan:
+            try:
+                offset, marker = scanner.find_marker(buffer, position)
+            except EOFError:
+                return Verification(TRUNCATED, length, "The entropy-coded data runs to the end of the file")
+            if marker in _RST_MARKERS:
+                if deep and marker != segment_markers.RST0.marker + restart_number:
+                    return Verification(
+                        BAD_RESTART_SEQUENCE, offset, f"Expected RST{restart_number}, found RST{marker & 0x07}")
+                restart_number = (restart_number + 1) % 8
+                position = offset + 2
+                continue
+            in_scan = False
+        else:
+            # Outside entropy-coded data, the next marker has to be right where the last segment ended (after any
+            # fill bytes).
+            offset = position
+            while offset + 1 < length and buffer[offset] == 0xff and buffer[offset + 1] == 0xff:
+                offset += 1
+            if offset + 2 > length:
+                return Verification(TRUNCATED, length, f"The file ends where a marker was expected, at {hex(offset)}")
+            elif buffer[offset] != 0xff or buffer[offset + 1] == 0x00:
+                detail = f"The segment at {hex(segment_offset)} isn't followed by a marker"
+                return Verification(BAD_SEGMENT_LENGTH, segment_offset, detail)
+            marker = buffer[offset] << 8 | buffer[offset + 1]
+
+        if marker == segment_markers.EOI.marker:
+            if offset + 2 < length:
+                return Verification(TRAILING_GARBAGE, offset + 2, f"{length - offset - 2} bytes follow the EOI marker")
+            return Verification(OK, None, None)
+        elif segment_markers.get_segment_marker(marker) in segment_markers.STANDALONE_MARKERS:
+            segment_offset = offset
+            position = offset + 2
+            continue
+
+        if offset + 4 > length:
+            return Verification(TRUNCATED, length, f"The file ends within the segment at {hex(offset)}")
+        segment_length = struct.unpack_from('>H', buffer, offset + 2)[0]
+        if segment_length < 2:
+            return Verification(
+                BAD_SEGMENT_LENGTH, offset, f"The segment at {hex(offset)} has a length of {segment_length}")
+        segment_offset = offset
+        position = offset + 2 + segment_length
+        if position > length:
+            return Verification(TRUNCATED, length, f"The file ends within the segment at {hex(offset)}")
+
+        if marker == segment_markers.SOS.marker:
+            if not walk_to_end:
+                # The header is intact. A file that ends with EOI is taken to be complete; otherwise, walk the rest of
+                # it to find out what went wrong.
+                if buffer[length - 2:length] == _EOI_BYTES:
+                    return Verification(OK, None, None)
+                walk_to_end = True
+            in_scan = True
+            restart_number = 0
@@ -3,3 +3,6 @@ density_unit_map = {
     1: "dpi",
     2: "dpcm",
 }
+
+# Names of the metadata read from the JFIF APP0 segment.
+tag_name_set = frozenset(['JFIFVersion', 'DensityUnits', 'Xdensity', 'Ydensity'])
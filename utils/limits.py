@@ -0,0 +1,61 @@
+import time
+
+
+class LimitExceeded(RuntimeError):
+    """ Raised when reading a file would go past one of its ReadLimits.
+
+    `limit` is the name of the ReadLimits attribute that was hit, `value` its setting, and `offset` the position in
+    the file where reading stopped (None if there isn't a meaningful one).
+    """
+    def __init__(self, limit, value, file_name=None, offset=None):
+        self.limit = limit
+        self.value = value
+        self.file_name = file_name
+        self.offset = offset
+        where = "" if offset is None else f" at {hex(offset)}"
+        super().__init__(f"Reading {file_name} went past the limit {limit}={value}{where}")
+
+    def __reduce__(self):
+        # Keep the attributes when the error is pickled, e.g. to pass it back from a worker process.
+        return LimitExceeded, (self.limit, self.value, self.file_name, self.offset)
+
+
+class ReadLimits:
+    """ Resource limits for reading a file that may be corrupt or hostile, so that no single file can use up unbounded
+    time or memory. The defaults are meant for untrusted input; set any of them to None to turn it off.
+
+    max_bytes_scanned = How far into the file the marker pass (and reading a stream) may go
+    max_segments = How many segments the marker pass may find
+    max_ifd_entries = How many entries an EXIF IFD may claim to have
+    max_value_bytes = How large a single EXIF tag value may be
+    max_seconds = Wall-clock budget for the marker pass, and for decoding each group of metadata. It is checked between
+        steps, so a single slow read can overrun it.
+
+    A limit that is hit raises LimitExceeded.
+    """
+    __slots__ = ('max_bytes_scanned', 'max_segments', 'max_ifd_entries', 'max_value_bytes', 'max_seconds')
+
+    def __init__(self, max_bytes_scanned=1024 ** 3, max_segments=100000, max_ifd_entries=4096,
+                 max_value_bytes=1024 ** 2, max_seconds=10.0):
+        self.max_bytes_scanned = max_bytes_scanned
+        self.max_segments = max_segments
+        self.max_ifd_entries = max_ifd_entries
+        self.max_value_bytes = max_value_bytes
+        self.max_seconds = max_seconds
+
+    def __repr__(self):
+        settings = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"ReadLimits({settings})"
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def deadline(self):
+        """ The time.monotonic() value by which a step that starts now has to finish, or None if there's no budget. """
+        if self.max_seconds is None:
+            return None
+        return time.monotonic() + self.max_seconds
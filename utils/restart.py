@@ -0,0 +1,104 @@
+import re
+from array import array
+
+
+# The entropy-coded data of a scan ends at the first marker that isn't a RST marker (0xff00 is a stuffed 0xff byte).
+_SCAN_END_PATTERN = re.compile(b'\xff[^\x00\xd0-\xd7]')
+_RST_PATTERN = re.compile(b'\xff[\xd0-\xd7]')
+
+
+def find_restart_markers(buffer, start):
+    """ Find the RST markers in the entropy-coded data that starts at `start`. Returns their offsets, and where the data
+    ends: at the first marker that isn't a RST marker, or at the end of the buffer.
+    """
+    match = _SCAN_END_PATTERN.search(buffer, start)
+    end = len(buffer) if match is None else match.start()
+    marker_offsets = array('Q', (match.start() for match in _RST_PATTERN.finditer(buffer, start, end)))
+    return marker_offsets, end
+
+
+def scan_mcu_grid(width, height, sampling_factors, scan_component_indexes):
+    """ Number of MCU columns and rows in a scan. An interleaved scan codes MCUs of the whole frame, while a scan of a
+    single component codes each of its blocks as an MCU. `sampling_factors` holds (h, v) for each frame component.
+    """
+    max_h = max(h for h, _ in sampling_factors)
+    max_v = max(v for _, v in sampling_factors)
+    if len(scan_component_indexes) > 1:
+        return _ceil_div(width, 8 * max_h), _ceil_div(height, 8 * max_v)
+
+    h, v = sampling_factors[scan_component_indexes[0]]
+    return _ceil_div(_ceil_div(width * h, max_h), 8), _ceil_div(_ceil_div(height * v, max_v), 8)
+
+
+class RestartIndex:
+    """ Index of the restart intervals of a scan.
+
+    With a restart interval (set by a DRI segment), the encoder resets its state every `interval` MCUs and writes a RST
+    marker, so each interval can be decoded on its own: in parallel, or only the ones covering a region. The index
+    maps each interval to its byte range in the file, and to the MCU row and column it starts at. An interval of 0
+    means the scan has no restart markers, and the whole scan is a single interval.
+    """
+    __slots__ = ('interval', 'mcus_x', 'mcus_y', 'data_offset', 'data_end', 'marker_offsets')
+
+    def __init__(self, interval, mcus_x, mcus_y, data_offset, data_end, marker_offsets):
+        self.interval = interval
+        self.mcus_x = mcus_x
+        self.mcus_y = mcus_y
+        self.data_offset = data_offset
+        self.data_end = data_end
+        self.marker_offsets = marker_offsets
+
+    def __repr__(self):
+        return (f"RestartIndex(interval={self.interval}, mcus={self.mcus_x}x{self.mcus_y}, "
+                f"markers={len(self.marker_offsets)})")
+
+    def __len__(self):
+        """ Number of restart intervals the scan is made of. """
+        if not self.interval:
+            return 1
+        return _ceil_div(self.mcu_count, self.interval)
+
+    @property
+    def mcu_count(self):
+        return self.mcus_x * self.mcus_y
+
+    def interval_range(self, number):
+        """ Start and end offsets of the entropy-coded data of an interval, not including RST markers. If the data is
+        cut short, intervals past the end are empty.
+        """
+        if number == 0:
+            start = self.data_offset
+        elif number - 1 < len(self.marker_offsets):
+            start = self.marker_offsets[number - 1] + 2
+        else:
+            return self.data_end, self.data_end
+
+        if number < len(self.marker_offsets):
+            end = self.marker_offsets[number]
+        else:
+            end = self.data_end
+        return start, end
+
+    def first_mcu(self, number):
+        """ Index (in raster order) of the first MCU of an interval. """
+        return number * self.interval
+
+    def mcu_position(self, number):
+        """ Row and column of the first MCU of an interval. """
+        return divmod(self.first_mcu(number), self.mcus_x)
+
+    def interval_at(self, row, column):
+        """ Number of the interval that holds the MCU at a row and column. """
+        if not self.interval:
+            return 0
+        return (row * self.mcus_x + column) // self.interval
+
+    def markers(self):
+        """ Yield the offset of each RST marker, with the row and column of the MCU that follows it. """
+        for number, offset in enumerate(self.marker_offsets, start=1):
+            row, column = self.mcu_position(number)
+            yield offset, row, column
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
@@ -0,0 +1,143 @@
+""" Lossless rewriting of JPEG files: dropping segments and EXIF tags, and copying everything else verbatim.
+
+EXIF tags are removed in place, so that no offset in the EXIF segment (or anywhere else in the file) moves: the entry
+is taken out of its IFD, and the value it pointed to is zeroed. Removing a pointer tag, like the GPSInfo IFD pointer,
+zeroes the whole IFD it points to.
+"""
+import errno
+import os
+import struct
+
+from utils import exif
+
+
+# EXIF tags that reveal where a photo was taken, or the camera's private data: the GPSInfo IFD, and the MakerNote.
+PRIVATE_TAGS = frozenset(['GPSInfo IFD Pointer', 'MakerNote'])
+
+# Size in bytes of a single value of each TIFF field type, including the types that aren't decoded
+_FIELD_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+# IFD pointer tags of IFD0 and the EXIF IFD, and the tag names of the IFD each one points to. Tags in other IFDs (e.g.
+# the Interoperability IFD) can't be removed by name, but are zeroed along with the IFD pointing to them.
+_SUB_IFD_TAG_NAMES = {0x8769: exif.exif_tag_names, 0x8825: exif.gpsinfo_tag_names, 0xa005: {}}
+
+# Errors from copy_file_range and sendfile meaning they can't be used for these files, rather than that the copy failed
+_UNSUPPORTED_COPY_ERRORS = frozenset([errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP])
+
+
+def remove_exif_tags(data: bytearray, tiff_header_offset, endian, tag_names):
+    """ Remove the tags named in `tag_names` from IFD0, IFD1, and the EXIF and GPSInfo IFDs of an EXIF segment, editing
+    `data` in place. Returns the number of tags removed. Raises struct.error (or ValueError) if an IFD or value runs
+    past the end of the data, rather than leaving tags behind.
+    """
+    uint32 = exif.get_struct(f'{endian}I')
+    ifd0_offset = tiff_header_offset + uint32.unpack_from(data, tiff_header_offset + 4)[0]
+    ifds = [(ifd0_offset, exif.tiff_tag_names)]
+    ifd1_pointer = uint32.unpack_from(data, _next_ifd_pointer_offset(data, ifd0_offset, endian))[0]
+    if ifd1_pointer:
+        ifds.append((tiff_header_offset + ifd1_pointer, exif.tiff_tag_names))
+
+    removed = 0
+    visited = set()
+    while ifds:
+        ifd_offset, names = ifds.pop()
+        if ifd_offset in visited:
+            continue
+        visited.add(ifd_offset)
+
+        kept = list()
+        for entry in _iter_ifd_entries(data, ifd_offset, endian):
+            tag_id, _, _, value_field = entry
+            if names.get(tag_id) in tag_names:
+                _zero_value(data, tiff_header_offset, ifd_offset, entry, endian, visited)
+                removed += 1
+                continue
+            kept.append(entry)
+            if tag_id in _SUB_IFD_TAG_NAMES:
+                ifds.append((tiff_header_offset + value_field, _SUB_IFD_TAG_NAMES[tag_id]))
+
+        if len(kept) < struct.unpack_from(f'{endian}H', data, ifd_offset)[0]:
+            _rewrite_ifd(data, ifd_offset, endian, kept)
+    return removed
+
+
+def copy_range(source_fd, destination_fd, offset, count):
+    """ Copy `count` bytes from `offset` in one file to the current position in another, in the kernel where possible:
+    with copy_file_range (which can share the blocks, on filesystems that support it), or else sendfile. Returns the
+    number of bytes copied, which is less than `count` if neither can be used for these files; the caller writes the
+    rest.
+    """
+    copied = 0
+    for kernel_copy in _KERNEL_COPIES:
+        try:
+            while copied < count:
+                chunk = kernel_copy(source_fd, destination_fd, offset + copied, count - copied)
+                if not chunk:
+                    # The source ended early
+                    return copied
+                copied += chunk
+            return copied
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_COPY_ERRORS:
+                raise
+    return copied
+
+
+def _copy_file_range(source_fd, destination_fd, offset, count):
+    return os.copy_file_range(source_fd, destination_fd, count, offset)
+
+
+def _sendfile(source_fd, destination_fd, offset, count):
+    return os.sendfile(destination_fd, source_fd, offset, count)
+
+
+# Kernel copies available on this platform, in order of preference
+_KERNEL_COPIES = tuple(
+    kernel_copy for kernel_copy, name in ((_copy_file_range, 'copy_file_range'), (_sendfile, 'sendfile'))
+    if hasattr(os, name))
+
+
+def _iter_ifd_entries(data, ifd_offset, endian):
+    """ Yield the (tag id, type id, count, value field) of each entry of an IFD. """
+    count = struct.unpack_from(f'{endian}H', data, ifd_offset)[0]
+    return exif.unpack_ifd_entries(data, endian, ifd_offset, count)
+
+
+def _next_ifd_pointer_offset(data, ifd_offset, endian):
+    """ Offset of the next IFD pointer, which follows the entries of an IFD. """
+    return ifd_offset + 2 + struct.unpack_from(f'{endian}H', data, ifd_offset)[0] * 12
+
+
+def _rewrite_ifd(data, ifd_offset, endian, entries):
+    """ Write an IFD's remaining entries and its next IFD pointer in place, zeroing the space left over. """
+    next_ifd_pointer_offset = _next_ifd_pointer_offset(data, ifd_offset, endian)
+    next_ifd = data[next_ifd_pointer_offset:next_ifd_pointer_offset + 4]
+    if len(next_ifd) < 4:
+        raise ValueError(f"IFD at {hex(ifd_offset)} runs past the end of its segment")
+
+    table = struct.pack(f'{endian}H', len(entries)) + exif.pack_ifd_entries(endian, entries) + next_ifd
+    end = next_ifd_pointer_offset + 4
+    data[ifd_offset:end] = table + bytes(end - ifd_offset - len(table))
+
+
+def _zero_value(data, tiff_header_offset, ifd_offset, entry, endian, visited):
+    """ Zero the value of a removed IFD entry, when it is stored outside the entry, and any IFD it points to. """
+    tag_id, type_id, count, value_field = entry
+    size = _FIELD_TYPE_SIZES.get(type_id, 1) * count
+    if size > 4:
+        start = tiff_header_offset + value_field
+        if start + size > len(data):
+            raise ValueError(f"Value of tag {hex(tag_id)} in the IFD at {hex(ifd_offset)} runs past its segment")
+        data[start:start + size] = bytes(size)
+
+    if tag_id in _SUB_IFD_TAG_NAMES:
+        sub_ifd_offset = tiff_header_offset + value_field
+        if sub_ifd_offset in visited:
+            return
+        visited.add(sub_ifd_offset)
+        for sub_entry in list(_iter_ifd_entries(data, sub_ifd_offset, endian)):
+            _zero_value(data, tiff_header_offset, sub_ifd_offset, sub_entry, endian, visited)
+        end = _next_ifd_pointer_offset(data, sub_ifd_offset, endian) + 4
+        if end > len(data):
+            raise ValueError(f"IFD at {hex(sub_ifd_offset)} runs past the end of its segment")
+        data[sub_ifd_offset:end] = bytes(end - sub_ifd_offset)
@@ -0,0 +1,19 @@
+import re
+
+
+# A marker is 0xff followed by any byte other than 0x00 (byte stuffing in entropy-coded data) or 0xff (fill byte).
+MARKER_PATTERN = re.compile(b'\xff[^\x00\xff]')
+
+
+def find_marker(buffer, start, end=None):
+    """ Find the next segment marker at or after `start` in a buffer (bytes, mmap, memoryview), ending before `end` if
+    given.
+
+    0xff00 (stuffed bytes) and 0xffff (fill bytes) pairs are skipped. Returns the marker offset and the 2-byte marker
+    value.
+    """
+    match = MARKER_PATTERN.search(buffer, start, len(buffer) if end is None else end)
+    if match is None:
+        raise EOFError(f"Reached end of file while looking for a segment marker after {hex(start)}")
+    marker_offset = match.start()
+    return marker_offset, 0xff00 | buffer[marker_offset + 1]
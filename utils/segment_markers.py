@@ -1,4 +1,6 @@
 class SegmentMarker:
+    __slots__ = ('marker', 'code', 'description')
+
     def __init__(self, marker, code, description):
         self.marker = marker
         self.code = code
@@ -7,6 +9,11 @@ class SegmentMarker:
     def __str__(self):
         return f"{self.code} ({self.description})"
 
+    def __reduce__(self):
+        # Markers are compared by identity, so unpickling (e.g. in results from a worker process) must give back the
+        # instance defined in this module.
+        return _get_segment_marker_by_code, (self.code, )
+
 
 # Start of Frame markers, non-differential, Huffman coding
 SOF0 = SegmentMarker(0xffc0, 'SOF0', 'Baseline DCT')
@@ -30,7 +37,7 @@ SOF13 = SegmentMarker(0xffcd, 'SOF13', 'Lossless (sequential)')
 SOF14 = SegmentMarker(0xffce, 'SOF14', 'Lossless (sequential)')
 SOF15 = SegmentMarker(0xffcf, 'SOF15', 'Lossless (sequential)')
 
-SOF_MARKERS = (SOF0, SOF1, SOF3, SOF5, SOF6, SOF7, SOF9, SOF10, SOF11, SOF13, SOF14, SOF15)
+SOF_MARKERS = (SOF0, SOF1, SOF2, SOF3, SOF5, SOF6, SOF7, SOF9, SOF10, SOF11, SOF13, SOF14, SOF15)
 
 
 # Huffman table specification
@@ -110,12 +117,23 @@ COM = SegmentMarker(0xfffe, 'COM', 'Comment')
 # Reserved Markers
 TEM = SegmentMarker(0xff01, 'TEM', 'For temporary private use in arithmetic coding')
 
+# Markers that stand alone, without a length field or any segment data.
+STANDALONE_MARKERS = RST_MARKERS + (SOI, EOI, TEM)
+
 SEGMENT_MARKERS = SOF_MARKERS + (DHT, DAC) + RST_MARKERS + OTHER_MARKERS + APP_MARKERS + JPG_MARKERS + (COM, TEM)
 
 
+# Lookup table of marker bytes to SegmentMarker. When two markers share the same bytes, the first one listed wins.
+_SEGMENT_MARKER_LOOKUP = dict()
+for _segment in SEGMENT_MARKERS:
+    _SEGMENT_MARKER_LOOKUP.setdefault(_segment.marker, _segment)
+del _segment
+
+
+def _get_segment_marker_by_code(code):
+    return globals()[code]
+
+
 def get_segment_marker(marker):
     """ Get a SegmentMarker tuple from marker bytes. """
-    for segment in SEGMENT_MARKERS:
-        if segment.marker == marker:
-            return segment
-    return None
+    return _SEGMENT_MARKER_LOOKUP.get(marker)
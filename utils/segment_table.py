@@ -0,0 +1,62 @@
+from array import array
+from collections import namedtuple
+
+from utils import segment_markers
+
+
+Segment = namedtuple('Segment', "marker offset")
+
+
+class SegmentTable:
+    """ The segments found in a JPEG file, stored compactly as parallel arrays of marker codes (2 bytes each) and
+    offsets (8 bytes each), instead of an object per segment.
+
+    Iterating over it, or indexing it, gives Segment tuples, the same as a list of segments would; slicing it gives
+    another SegmentTable. The raw arrays are available as `marker_codes` and `offsets`.
+    """
+    __slots__ = ('marker_codes', 'offsets')
+
+    def __init__(self, segments=()):
+        """ `segments` is an iterable of (marker code, offset) pairs. """
+        self.marker_codes = array('H')
+        self.offsets = array('Q')
+        for marker_code, offset in segments:
+            self.append(marker_code, offset)
+
+    def __repr__(self):
+        return f"SegmentTable({[(str(segment.marker), segment.offset) for segment in self]})"
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        get_segment_marker = segment_markers.get_segment_marker
+        for marker_code, offset in zip(self.marker_codes, self.offsets):
+            yield Segment(get_segment_marker(marker_code), offset)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            table = SegmentTable()
+            table.marker_codes = self.marker_codes[index]
+            table.offsets = self.offsets[index]
+            return table
+        return Segment(segment_markers.get_segment_marker(self.marker_codes[index]), self.offsets[index])
+
+    def __eq__(self, other):
+        if not isinstance(other, SegmentTable):
+            return NotImplemented
+        return self.marker_codes == other.marker_codes and self.offsets == other.offsets
+
+    def __getstate__(self):
+        return self.marker_codes, self.offsets
+
+    def __setstate__(self, state):
+        self.marker_codes, self.offsets = state
+
+    def append(self, marker_code, offset):
+        self.marker_codes.append(marker_code)
+        self.offsets.append(offset)
+
+    def pairs(self):
+        """ The segments as a list of (marker code, offset) pairs of builtin types. """
+        return list(zip(self.marker_codes, self.offsets))